@@ -96,11 +96,11 @@ juju relate <certificate_transfer provider charm> <certificate_transfer requirer
 
 """
 
+import functools
 import json
 import logging
 from typing import List, Mapping
 
-from jsonschema import exceptions, validate  # type: ignore[import-untyped]
 from ops import Relation
 from ops.charm import (
     CharmBase,
@@ -119,7 +119,7 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 11
+LIBPATCH = 14
 
 PYDEPS = ["jsonschema"]
 
@@ -178,6 +178,50 @@ PROVIDER_JSON_SCHEMA = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def _provider_validator():
+    """Return the JSON schema validator for provider relation data.
+
+    The schema is checked against its metaschema and the validator is built on first use
+    only, then reused for every validation. jsonschema is imported here rather than with
+    this module, so that hooks which never validate relation data don't pay for it.
+    """
+    from jsonschema import validators  # type: ignore[import-untyped]
+
+    validator_class = validators.validator_for(PROVIDER_JSON_SCHEMA)
+    validator_class.check_schema(PROVIDER_JSON_SCHEMA)
+    return validator_class(PROVIDER_JSON_SCHEMA)
+
+
+def _relation_data_is_well_formed(relation_data: dict) -> bool:
+    """Return whether relation data has the usual shape of valid provider data.
+
+    This is a fast structural check that only accepts data also accepted by the JSON
+    schema. Returning False does not mean the data is invalid, only that it needs to be
+    checked against the schema.
+
+    Args:
+        relation_data: Relation data in dict format.
+
+    Returns:
+        bool: Whether relation data is well-formed.
+    """
+    if not any(key in relation_data for key in ("certificate", "ca", "chain")):
+        return False
+    for key in ("certificate", "ca"):
+        if key in relation_data and not isinstance(relation_data[key], str):
+            return False
+    if "chain" in relation_data:
+        chain = relation_data["chain"]
+        if not isinstance(chain, list) or not all(isinstance(item, str) for item in chain):
+            return False
+    if "version" in relation_data:
+        version = relation_data["version"]
+        if type(version) is not int or version < 0:
+            return False
+    return True
+
+
 class CertificateAvailableEvent(EventBase):
     """Charm Event triggered when a TLS certificate is available."""
 
@@ -368,11 +412,9 @@ class CertificateTransferRequires(Object):
         Returns:
             bool: Whether relation data is valid.
         """
-        try:
-            validate(instance=relation_data, schema=PROVIDER_JSON_SCHEMA)
+        if _relation_data_is_well_formed(relation_data):
             return True
-        except exceptions.ValidationError:
-            return False
+        return _provider_validator().is_valid(relation_data)
 
     def _on_relation_changed(self, event: RelationChangedEvent) -> None:
         """Emit certificate available event.
@@ -424,8 +466,18 @@ class CertificateTransferRequires(Object):
             event.relation.data[self.model.app]["version"] = str(LIBAPI)
 
     def is_ready(self, relation: Relation) -> bool:
-        """Check if the relation is ready by checking that it has valid relation data."""
-        relation_data = _load_relation_data(relation.data[relation.units.pop()])
+        """Check if the relation is ready by checking that it has valid relation data.
+
+        The data of the provider unit with the lowest unit number is checked, without
+        mutating the units of the relation.
+        """
+        unit = min(
+            relation.units, key=lambda unit: int(unit.name.rsplit("/", 1)[-1]), default=None
+        )
+        if unit is None:
+            logger.debug("No remote unit in relation: %s", self.relationship_name)
+            return False
+        relation_data = _load_relation_data(relation.data[unit])
         if not self._relation_data_is_valid(relation_data):
             logger.warning("Provider relation data did not pass JSON Schema validation: ")
             return False
@@ -8,12 +8,53 @@ certificate-transfer interface. It supports both v0 and v1 of the interface.
 
 For requirers, they will set version 1 in their application databag as a hint to
 the provider. They will read the databag from the provider first as v1, and fallback
-to v0 if the format does not match.
+to v0 if the format does not match. With a v0 provider, the certificates published by all
+of its units are merged, so that requirers see the same set whichever unit changed last.
 
 For providers, they will check the version in the requirer's application databag,
 and send v1 if that version is set to 1, otherwise it will default to 0 for backwards
 compatibility.
 
+Requirers also advertise the payload encodings they can decode. Providers can opt in to
+compression: when the requirer supports one of the encodings, they then send the
+certificates as a compressed payload of their DER encodings instead of a list of PEM
+strings, which makes the relation data of large certificate bundles smaller. Providers
+send plain PEM strings otherwise, to requirers which don't advertise any encoding, and
+whenever one of the certificates can't be converted to DER. Requirers decode the payload
+transparently.
+
+Providers can also opt in to a sharded layout, for requirers advertising support for it.
+The certificates are then split into shards keyed by the prefix of their fingerprint, each
+stored under its own databag key, with a manifest holding the digest of every shard.
+Changing one certificate only rewrites and replicates its shard, and requirers only parse
+the shards whose digest changed.
+
+Both are off by default, as providers opting in rely on the encodings and layouts
+advertised by the requirer, which stay in its databag until a requirer using this library
+rewrites them. Rolling back a requirer charm to a version of this library which doesn't
+decode payloads or shards (before LIBPATCH 16) leaves them advertised: the provider keeps
+sending encoded certificates, and the rolled back requirer silently sees an empty set of
+certificates. Before such a rollback, remove the keys from the application databag of the
+requirer in each relation, for example with
+`juju exec --unit <leader unit> -- relation-set -r <relation ID> --app encodings= layouts=`.
+
+Providers can also plan changes with `plan_changes`, which returns the relations, keys and
+bytes a change would write without writing anything, and apply the plan with `apply_plan`.
+`apply_plan` raises `StalePlanError`, without writing anything, if relation data changed
+since the plan was made.
+
+Both the provider and the requirer accept a `metrics_callback`, which is called at the end
+of every hook with the `HookMetrics` of each relation they handled: databag reads and
+writes, bytes written, parse time, certificates added and removed, and events emitted or
+suppressed. The callback can log the metrics or forward them to a tracing or metrics
+exporter. Nothing is measured when no callback is given.
+
+Requirers can opt in to tracking changes, to report the added and removed certificates in
+`certificate_set_updated`. They then keep the certificates last delivered for each
+relation, in the charm's stored state by default, which grows with the size of the bundles
+and is saved on every change: charms receiving large bundles should pass a unit-local
+`snapshot_directory` instead.
+
 ## Getting Started
 From a charm directory, fetch the library using `charmcraft`:
 
@@ -80,7 +121,10 @@ class DummyCertificateTransferRequirerCharm(CharmBase):
 
     def _on_certificates_available(self, event: CertificatesAvailableEvent):
         logging.info(event.certificates)
+        logging.info(event.added)
+        logging.info(event.removed)
         logging.info(event.relation_id)
+        self.certificate_transfer.write_ca_bundle("/usr/local/share/ca-certificates/bundle.crt")
 
     def _on_certificates_removed(self, event: CertificatesRemovedEvent):
         logging.info(event.relation_id)
@@ -98,13 +142,45 @@ juju integrate <certificate_transfer provider charm> <certificate_transfer requi
 
 """
 
+import base64
+import contextlib
+import datetime
+import functools
+import hashlib
+import io
+import itertools
 import json
 import logging
-from typing import Dict, List, MutableMapping, Optional, Set
+import os
+import re
+import struct
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from types import MappingProxyType, SimpleNamespace
+from typing import (
+    AbstractSet,
+    BinaryIO,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
-import pydantic
 from ops import (
+    Application,
     CharmEvents,
+    Container,
     EventBase,
     EventSource,
     Handle,
@@ -112,9 +188,11 @@ from ops import (
     RelationBrokenEvent,
     RelationChangedEvent,
     RelationCreatedEvent,
+    Unit,
 )
 from ops.charm import CharmBase
-from ops.framework import Object
+from ops.framework import Object, StoredState
+from ops.pebble import APIError, FileType, PathError
 
 # The unique Charmhub library identifier, never change it
 LIBID = "3785165b24a743f2b0c60de52db25c8b"
@@ -124,13 +202,33 @@ LIBAPI = 1
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 15
+LIBPATCH = 16
 
 logger = logging.getLogger(__name__)
 
 PYDEPS = ["pydantic"]
 
-IS_PYDANTIC_V1 = int(pydantic.version.VERSION.split(".")[0]) < 2
+_PEM_CERTIFICATE_PATTERN = re.compile(
+    r"-----BEGIN CERTIFICATE-----(.*?)-----END CERTIFICATE-----", re.DOTALL
+)
+
+_ENCODING_ZLIB_DER = "zlib-der"
+"""Length-prefixed DER certificates, compressed with zlib and encoded in base64."""
+
+_SUPPORTED_ENCODINGS = (_ENCODING_ZLIB_DER,)
+"""Payload encodings supported by this library, most preferred first."""
+
+_LAYOUT_SHARDED = "sharded"
+"""Certificates split across databag keys by fingerprint prefix, listed in a manifest."""
+
+_SUPPORTED_LAYOUTS = (_LAYOUT_SHARDED,)
+"""Databag layouts supported by this library, besides the default single key."""
+
+_SHARD_KEY_PREFIX = "certificates-"
+_SHARD_FINGERPRINT_PREFIX_LENGTH = 1
+
+_PAYLOAD_CACHE_SIZE = 16
+"""Number of serialized databag contents kept by a provider for the rest of the hook."""
 
 
 class TLSCertificatesError(Exception):
@@ -141,184 +239,1585 @@ class DataValidationError(TLSCertificatesError):
     """Raised when data validation fails."""
 
 
-class DatabagModel(pydantic.BaseModel):
-    """Base databag model.
+class StalePlanError(TLSCertificatesError):
+    """Raised when applying a plan to relation data which changed since it was made."""
+
+
+_DIGEST_CHUNK_SIZE = 65536
+
+# Size of the chunks of base64 payloads decoded at a time, a multiple of 4
+_DECODE_CHUNK_SIZE = 65536
+
+_JSON_DECODER = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
 
-    Supports both pydantic v1 and v2.
+def _databag_digest(databag: Mapping[str, str]) -> str:
+    """Return a digest of the raw contents of a databag.
+
+    Values are encoded and hashed in chunks, so that large databags aren't copied whole.
+    """
+    digest = hashlib.sha256()
+    for key, value in sorted(databag.items()):
+        digest.update(struct.pack(">II", len(key), len(value)) + key.encode())
+        for start in range(0, len(value), _DIGEST_CHUNK_SIZE):
+            digest.update(value[start : start + _DIGEST_CHUNK_SIZE].encode())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=16384)
+def _certificate_fingerprint(certificate: str) -> str:
+    """Return the canonical SHA-256 fingerprint of a certificate.
+
+    The fingerprint is computed over the DER encoding of strings holding a single PEM
+    certificate, so that the same certificate is identified regardless of line endings,
+    line wrapping or surrounding whitespace. Strings holding a chain of PEM certificates
+    are fingerprinted on the DER encodings of all of them, so that a chain is never
+    identified with one of its certificates. Other strings are fingerprinted on their
+    text, with line endings and surrounding whitespace normalized.
     """
+    der = _certificate_der(certificate)
+    if der is not None:
+        return hashlib.sha256(der).hexdigest()
+    chain = _chain_der(certificate)
+    if chain is not None:
+        digest = hashlib.sha256(b"chain")
+        for block in chain:
+            digest.update(struct.pack(">I", len(block)) + block)
+        return digest.hexdigest()
+    text = "\n".join(line.strip() for line in certificate.strip().splitlines())
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _chain_der(certificate: str) -> Optional[List[bytes]]:
+    """Return the DER encodings of a string holding only a chain of PEM certificates.
+
+    Returns None when the string holds anything but PEM certificates and whitespace.
+    """
+    blocks = []
+    end = 0
+    for match in _PEM_CERTIFICATE_PATTERN.finditer(certificate):
+        if certificate[end : match.start()].strip():
+            return None
+        try:
+            blocks.append(base64.b64decode("".join(match.group(1).split()), validate=True))
+        except ValueError:
+            return None
+        end = match.end()
+    if not blocks or certificate[end:].strip():
+        return None
+    return blocks
 
-    if IS_PYDANTIC_V1:
 
-        class Config:
-            """Pydantic config."""
+def _certificate_der(certificate: str) -> Optional[bytes]:
+    """Return the DER encoding of a string holding exactly one PEM certificate.
 
-            # ignore any extra fields in the databag
-            extra = "ignore"
-            """Ignore any extra fields in the databag."""
-            allow_population_by_field_name = True
-            """Allow instantiating this class by field name (instead of forcing alias)."""
-
-        _NEST_UNDER = None
-
-    model_config = pydantic.ConfigDict(
-        # tolerate additional keys in databag
-        extra="ignore",
-        # Allow instantiating this class by field name (instead of forcing alias).
-        populate_by_name=True,
-        # Custom config key: whether to nest the whole datastructure (as json)
-        # under a field or spread it out at the toplevel.
-        _NEST_UNDER=None,
-    )  # type: ignore
-    """Pydantic config."""
-
-    @classmethod
-    def load(cls, databag: MutableMapping):
-        """Load this model from a Juju databag."""
-        if IS_PYDANTIC_V1:
-            return cls._load_v1(databag)
-        nest_under = cls.model_config.get("_NEST_UNDER")
-        if nest_under:
-            return cls.model_validate(json.loads(databag[nest_under]))
+    Returns None for any other string, as it can't be converted to DER without loss.
+    """
+    match = _PEM_CERTIFICATE_PATTERN.fullmatch(certificate.strip())
+    if not match:
+        return None
+    try:
+        return base64.b64decode("".join(match.group(1).split()), validate=True)
+    except ValueError:
+        return None
+
+
+def _der_to_pem(der: bytes) -> str:
+    """Return the PEM encoding of a DER certificate."""
+    body = base64.b64encode(der).decode()
+    lines = [body[index : index + 64] for index in range(0, len(body), 64)]
+    return "-----BEGIN CERTIFICATE-----\n" + "\n".join(lines) + "\n-----END CERTIFICATE-----\n"
+
+
+def _encode_certificates(encoding: str, certificates: Iterable[str]) -> Optional[str]:
+    """Encode certificates to a payload of the given encoding.
+
+    Returns None when one of the certificates can't be converted to DER.
+    """
+    if encoding != _ENCODING_ZLIB_DER:
+        raise ValueError(f"unsupported certificates encoding: {encoding}")
+    chunks = []
+    for certificate in sorted(certificates):
+        der = _certificate_der(certificate)
+        if der is None:
+            return None
+        chunks.append(struct.pack(">I", len(der)) + der)
+    return base64.b64encode(zlib.compress(b"".join(chunks), 9)).decode()
+
+
+def _decode_certificates(encoding: str, payload: str) -> Set[str]:
+    """Decode certificates from a payload of the given encoding.
+
+    Raises:
+        DataValidationError: If the encoding is not supported or the payload is invalid.
+    """
+    return {_der_to_pem(der) for der in _iter_encoded_ders(encoding, payload)}
 
+
+def _iter_encoded_ders(encoding: str, payload: str) -> Iterator[bytes]:
+    """Yield the DER certificates of a payload of the given encoding, one at a time.
+
+    The payload is decompressed in chunks, so that it is never held decompressed as a whole.
+
+    Raises:
+        DataValidationError: If the encoding is not supported or the payload is invalid.
+    """
+    if encoding != _ENCODING_ZLIB_DER:
+        raise DataValidationError(f"unsupported certificates encoding: {encoding}")
+    decompressor = zlib.decompressobj()
+    data = b""
+    for start in range(0, len(payload), _DECODE_CHUNK_SIZE):
         try:
-            data = {
-                k: json.loads(v)
-                for k, v in databag.items()
-                # Don't attempt to parse model-external values
-                if k in {(f.alias or n) for n, f in cls.model_fields.items()}
-            }
-        except json.JSONDecodeError as e:
-            msg = f"invalid databag contents: expecting json. {databag}"
-            logger.error(msg)
-            raise DataValidationError(msg) from e
+            chunk = base64.b64decode(payload[start : start + _DECODE_CHUNK_SIZE], validate=True)
+            data += decompressor.decompress(chunk)
+        except (ValueError, zlib.error) as e:
+            raise DataValidationError(f"invalid {encoding} certificates payload") from e
+        offset = 0
+        while offset + 4 <= len(data):
+            (length,) = struct.unpack_from(">I", data, offset)
+            if offset + 4 + length > len(data):
+                break
+            yield data[offset + 4 : offset + 4 + length]
+            offset += 4 + length
+        data = data[offset:]
+    if not decompressor.eof:
+        raise DataValidationError(f"invalid {encoding} certificates payload")
+    if data:
+        raise DataValidationError(f"truncated {encoding} certificates payload")
+
+
+def _skip_json_whitespace(value: str, index: int) -> int:
+    """Return the index of the first character from the given index which is not whitespace."""
+    match = _JSON_WHITESPACE.match(value, index)
+    return match.end() if match else index
+
+
+def _iter_json_strings(value: str) -> Iterator[str]:
+    """Yield the strings of a JSON array of strings, decoding them one at a time.
+
+    Raises:
+        DataValidationError: If the value is not a JSON array of strings.
+    """
+    message = "invalid certificates: expecting a JSON array of strings"
+    index = _skip_json_whitespace(value, 0)
+    if not value.startswith("[", index):
+        raise DataValidationError(message)
+    index = _skip_json_whitespace(value, index + 1)
+    if not value.startswith("]", index):
+        while True:
+            try:
+                item, index = _JSON_DECODER.raw_decode(value, index)
+            except json.JSONDecodeError as e:
+                raise DataValidationError(message) from e
+            if not isinstance(item, str):
+                raise DataValidationError(message)
+            yield item
+            index = _skip_json_whitespace(value, index)
+            if value.startswith("]", index):
+                break
+            if not value.startswith(",", index):
+                raise DataValidationError(message)
+            index = _skip_json_whitespace(value, index + 1)
+    if _skip_json_whitespace(value, index + 1) != len(value):
+        raise DataValidationError(message)
+
+
+def _shard_digest(value: str) -> str:
+    """Return the digest of the raw databag value of a shard, as listed in the manifest."""
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _serialize_shards(
+    encoding: Optional[str], certificates: Iterable[str]
+) -> Tuple[Optional[str], Dict[str, str]]:
+    """Split certificates into shards keyed by the prefix of their fingerprint.
+
+    Shards are encoded with the given payload encoding when all certificates can be
+    encoded, and hold plain PEM strings otherwise.
+
+    Returns:
+        The encoding used, and the raw databag value of each shard keyed by databag key.
+    """
+    groups: Dict[str, List[str]] = {}
+    for certificate in certificates:
+        prefix = _certificate_fingerprint(certificate)[:_SHARD_FINGERPRINT_PREFIX_LENGTH]
+        groups.setdefault(_SHARD_KEY_PREFIX + prefix, []).append(certificate)
+    if encoding is not None:
+        payloads = {key: _encode_certificates(encoding, group) for key, group in groups.items()}
+        if all(payload is not None for payload in payloads.values()):
+            return encoding, {key: json.dumps(payload) for key, payload in payloads.items()}
+    return None, {key: json.dumps(sorted(group)) for key, group in groups.items()}
+
+
+def _load_shards(
+    databag: Mapping[str, str],
+    manifest: Mapping[str, str],
+    encoding: Optional[str],
+    cache: MutableMapping[str, FrozenSet[str]],
+) -> FrozenSet[str]:
+    """Load the certificates of all shards listed in the manifest.
+
+    Shards are cached by digest, so that only shards whose contents changed are parsed.
+
+    Raises:
+        DataValidationError: If a shard is missing, does not match its digest in the
+            manifest, or is invalid.
+    """
+    certificates: Set[str] = set()
+    for key, digest in manifest.items():
+        value = databag.get(key)
+        if value is None or _shard_digest(value) != digest:
+            raise DataValidationError(f"certificates shard {key} does not match the manifest")
+        if digest not in cache:
+            cache[digest] = frozenset(_decode_shard(encoding, value))
+        certificates.update(cache[digest])
+    return frozenset(certificates)
+
+
+def _decode_shard(encoding: Optional[str], value: str) -> Set[str]:
+    """Decode the certificates of a shard from its raw databag value.
+
+    Raises:
+        DataValidationError: If the shard is invalid.
+    """
+    try:
+        decoded = json.loads(value)
+    except json.JSONDecodeError as e:
+        raise DataValidationError(f"invalid certificates shard: {value}") from e
+    if encoding is not None and isinstance(decoded, str):
+        return _decode_certificates(encoding, decoded)
+    if encoding is None and isinstance(decoded, list):
+        if all(isinstance(certificate, str) for certificate in decoded):
+            return set(decoded)
+    raise DataValidationError(f"invalid certificates shard: {value}")
+
+
+def _bundle_chunks(certificates: Iterable[str]) -> Iterator[bytes]:
+    """Yield the contents of a PEM bundle holding the given certificates, one at a time."""
+    for certificate in certificates:
+        yield certificate.encode()
+        if not certificate.endswith("\n"):
+            yield b"\n"
+
+
+class _ChunkReader(io.RawIOBase):
+    """Read-only binary file streaming the chunks yielded by an iterator."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        """Return whether the file is readable."""
+        return True
+
+    def readinto(self, buffer) -> int:  # type: ignore[override]
+        """Read the next bytes of the stream into the buffer."""
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _file_digest(file: BinaryIO) -> str:
+    """Return the SHA-256 digest of the contents of a file, read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in iter(functools.partial(file.read, 65536), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_file_atomically(
+    path: str, chunks: Iterable[bytes], permissions: int, durable: bool = True
+) -> None:
+    """Write chunks to a file, replacing it atomically.
+
+    The chunks are written to a temporary file in the same directory, which is renamed over
+    the file, so that readers never see a partially written file. When durable, the file
+    and the rename are also flushed to disk.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temporary_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+            if durable:
+                file.flush()
+                os.fsync(file.fileno())
+        os.chmod(temporary_path, permissions)
+        os.replace(temporary_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temporary_path)
+        raise
+    if not durable:
+        return
+    # Persist the rename itself
+    directory_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_fd)
+    finally:
+        os.close(directory_fd)
+
+
+_DER_CANONICAL_STRING_ENCODINGS = {
+    0x0C: "utf-8",  # UTF8String
+    0x13: "latin-1",  # PrintableString
+    0x14: "latin-1",  # T61String
+    0x16: "latin-1",  # IA5String
+    0x1A: "latin-1",  # VisibleString
+    0x1C: "utf-32-be",  # UniversalString
+    0x1E: "utf-16-be",  # BMPString
+}
+"""String types converted to UTF8String in the canonical encoding of OpenSSL names."""
+
+
+def _der_element(data: bytes, offset: int) -> Tuple[int, int, int]:
+    """Read the header of the DER element at the given offset.
+
+    Returns:
+        The tag of the element, and the start and end offsets of its contents.
+
+    Raises:
+        ValueError: If the element is invalid or truncated.
+    """
+    if offset + 2 > len(data):
+        raise ValueError("truncated DER element")
+    tag, length = data[offset], data[offset + 1]
+    if tag & 0x1F == 0x1F:
+        raise ValueError("unsupported DER tag")
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7F
+        if not 0 < count <= 4:
+            raise ValueError("unsupported DER length")
+        length = int.from_bytes(data[offset : offset + count], "big")
+        offset += count
+    if offset + length > len(data):
+        raise ValueError("truncated DER element")
+    return tag, offset, offset + length
+
+
+def _der_children(data: bytes, start: int, end: int) -> List[Tuple[int, int, int, int]]:
+    """Return the elements within the contents of a constructed DER element.
+
+    Returns:
+        The tag, start offset, contents start offset and end offset of each element.
+    """
+    children = []
+    offset = start
+    while offset < end:
+        tag, content_start, content_end = _der_element(data, offset)
+        children.append((tag, offset, content_start, content_end))
+        offset = content_end
+    return children
+
+
+def _der_encode(tag: int, contents: bytes) -> bytes:
+    """Return the DER encoding of an element."""
+    length = len(contents)
+    if length < 0x80:
+        return bytes((tag, length)) + contents
+    length_bytes = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes((tag, 0x80 | len(length_bytes))) + length_bytes + contents
+
+
+def _tbs_certificate_fields(der: bytes) -> List[Tuple[int, int, int, int]]:
+    """Return the fields of the TBSCertificate of a DER certificate, without the version.
+
+    The fields are, in order: serial number, signature algorithm, issuer, validity, subject
+    and subject public key info, followed by the optional unique identifiers and extensions.
+
+    Raises:
+        ValueError: If the certificate is invalid.
+    """
+    _, certificate_start, certificate_end = _der_element(der, 0)
+    _, tbs_start, tbs_end = _der_element(der, certificate_start)
+    fields = _der_children(der, tbs_start, tbs_end)
+    if fields and fields[0][0] == 0xA0:
+        fields = fields[1:]
+    if len(fields) < 6:
+        raise ValueError("invalid TBSCertificate")
+    return fields
+
+
+def _canonical_name(der: bytes, start: int, end: int) -> bytes:
+    """Return the OpenSSL canonical encoding of the contents of a DER Name.
+
+    As in OpenSSL's `x509_name_canon`, string attribute values are converted to UTF8String,
+    stripped of leading and trailing whitespace, with inner whitespace collapsed to single
+    spaces and ASCII letters lowercased. The relative distinguished names are encoded
+    without the enclosing SEQUENCE.
+    """
+    canonical = []
+    for _, _, set_start, set_end in _der_children(der, start, end):
+        attributes = []
+        for _, _, attribute_start, attribute_end in _der_children(der, set_start, set_end):
+            (_, oid_start, _, oid_end), (tag, value_start, content_start, value_end) = (
+                _der_children(der, attribute_start, attribute_end)
+            )
+            value = der[value_start:value_end]
+            encoding = _DER_CANONICAL_STRING_ENCODINGS.get(tag)
+            if encoding is not None:
+                text = der[content_start:value_end].decode(encoding).encode()
+                value = _der_encode(0x0C, b" ".join(text.split()).lower())
+            attributes.append(_der_encode(0x30, der[oid_start:oid_end] + value))
+        canonical.append(_der_encode(0x31, b"".join(sorted(attributes))))
+    return b"".join(canonical)
+
+
+def _openssl_subject_hash(der: bytes) -> str:
+    """Return the OpenSSL subject hash of a DER certificate, as printed by `c_rehash`.
+
+    Raises:
+        ValueError: If the certificate is invalid.
+    """
+    _, _, subject_start, subject_end = _tbs_certificate_fields(der)[4]
+    digest = hashlib.sha1(_canonical_name(der, subject_start, subject_end)).digest()
+    return f"{int.from_bytes(digest[:4], 'little'):08x}"
+
+
+_NAME_ATTRIBUTE_TYPES = {
+    "2.5.4.3": "CN",
+    "2.5.4.6": "C",
+    "2.5.4.7": "L",
+    "2.5.4.8": "ST",
+    "2.5.4.9": "STREET",
+    "2.5.4.10": "O",
+    "2.5.4.11": "OU",
+    "0.9.2342.19200300.100.1.1": "UID",
+    "0.9.2342.19200300.100.1.25": "DC",
+}
+"""Short names of the attribute types of distinguished names, as in RFC 4514."""
+
+_BASIC_CONSTRAINTS_OID = "2.5.29.19"
+
+
+def _der_oid(contents: bytes) -> str:
+    """Return the dotted string of the contents of a DER OBJECT IDENTIFIER."""
+    arcs: List[int] = []
+    value = 0
+    for byte in contents:
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            arcs.append(value)
+            value = 0
+    if not arcs:
+        raise ValueError("invalid DER object identifier")
+    first = min(arcs[0] // 40, 2)
+    return ".".join(str(arc) for arc in [first, arcs[0] - 40 * first, *arcs[1:]])
+
+
+def _der_time(tag: int, contents: bytes) -> datetime.datetime:
+    """Return the time of the contents of a DER UTCTime or GeneralizedTime."""
+    text = contents.decode("ascii")
+    if tag == 0x17:
+        year = int(text[:2])
+        # RFC 5280: UTCTime years from 50 are in the 20th century
+        text = ("19" if year >= 50 else "20") + text
+    elif tag != 0x18:
+        raise ValueError("invalid DER time")
+    return datetime.datetime.strptime(text, "%Y%m%d%H%M%SZ").replace(tzinfo=datetime.timezone.utc)
+
+
+def _escape_name_value(value: str) -> str:
+    """Escape an attribute value of a distinguished name as in RFC 4514."""
+    escaped = re.sub(r'([,+"\\<>;])', r"\\\1", value)
+    if escaped.startswith((" ", "#")):
+        escaped = "\\" + escaped
+    if escaped.endswith(" ") and not escaped.endswith("\\ "):
+        escaped = escaped[:-1] + "\\ "
+    return escaped
+
+
+def _name_string(der: bytes, start: int, end: int) -> str:
+    """Return the RFC 4514 string of the contents of a DER Name."""
+    relative_names = []
+    for _, _, set_start, set_end in _der_children(der, start, end):
+        attributes = []
+        for _, _, attribute_start, attribute_end in _der_children(der, set_start, set_end):
+            (_, _, oid_start, oid_end), (tag, value_start, content_start, value_end) = (
+                _der_children(der, attribute_start, attribute_end)
+            )
+            oid = _der_oid(der[oid_start:oid_end])
+            encoding = _DER_CANONICAL_STRING_ENCODINGS.get(tag)
+            if encoding is not None:
+                value = _escape_name_value(der[content_start:value_end].decode(encoding))
+            else:
+                value = "#" + der[value_start:value_end].hex()
+            attributes.append(f"{_NAME_ATTRIBUTE_TYPES.get(oid, oid)}={value}")
+        relative_names.append("+".join(attributes))
+    return ",".join(reversed(relative_names))
+
+
+def _is_ca(der: bytes, fields: List[Tuple[int, int, int, int]]) -> bool:
+    """Return whether the basic constraints extension of a certificate marks it as a CA."""
+    for tag, _, extensions_start, extensions_end in fields[6:]:
+        if tag != 0xA3:
+            continue
+        _, sequence_start, sequence_end = _der_element(der, extensions_start)
+        for _, _, extension_start, extension_end in _der_children(
+            der, sequence_start, sequence_end
+        ):
+            extension = _der_children(der, extension_start, extension_end)
+            if len(extension) < 2:
+                raise ValueError("invalid certificate extension")
+            _, _, oid_start, oid_end = extension[0]
+            if _der_oid(der[oid_start:oid_end]) != _BASIC_CONSTRAINTS_OID:
+                continue
+            _, _, value_start, value_end = extension[-1]
+            _, constraints_start, constraints_end = _der_element(der, value_start)
+            constraints = _der_children(der, constraints_start, constraints_end)
+            if constraints and constraints[0][0] == 0x01:
+                _, _, ca_start, ca_end = constraints[0]
+                return der[ca_start:ca_end] != b"\x00"
+            return False
+    return False
+
+
+class CertificateCollection:
+    """Compact set of certificates, deduplicated by canonical fingerprint.
+
+    PEM certificates are stored as their DER encoding, about three quarters of the size of
+    the PEM text, keyed by the binary SHA-256 digest of the DER encoding. Strings which are
+    not a single PEM certificate are stored as they are. The same certificate is stored
+    once, whatever its line endings or wrapping, so merging the certificates of many
+    relations in place with `update` keeps a single copy of each of them.
+
+    Iterating yields the certificates as PEM strings, built one at a time.
+    """
+
+    __slots__ = ("_entries",)
+
+    def __init__(self, certificates: Iterable[str] = ()):
+        self._entries: Dict[bytes, Union[bytes, str]] = {}
+        self.update(certificates)
+
+    @staticmethod
+    def _entry(certificate: str) -> Tuple[bytes, Union[bytes, str]]:
+        """Return the key and the stored value of a certificate."""
+        der = _certificate_der(certificate)
+        if der is None:
+            return bytes.fromhex(_certificate_fingerprint(certificate)), certificate
+        return hashlib.sha256(der).digest(), der
+
+    def add(self, certificate: str) -> None:
+        """Add a certificate, unless the collection already holds it."""
+        key, value = self._entry(certificate)
+        self._entries.setdefault(key, value)
+
+    def _add_der(self, der: bytes) -> None:
+        """Add a DER certificate, unless the collection already holds it."""
+        self._entries.setdefault(hashlib.sha256(der).digest(), der)
+
+    def update(self, certificates: Iterable[str]) -> None:
+        """Add certificates in place, skipping the ones the collection already holds."""
+        if isinstance(certificates, CertificateCollection):
+            for key, value in certificates._entries.items():
+                self._entries.setdefault(key, value)
+            return
+        for certificate in certificates:
+            self.add(certificate)
+
+    def fingerprints(self) -> FrozenSet[str]:
+        """Return the canonical fingerprints of the certificates, in hex."""
+        return frozenset(key.hex() for key in self._entries)
+
+    def __contains__(self, certificate: object) -> bool:
+        """Return whether the collection holds the given certificate."""
+        return isinstance(certificate, str) and self._entry(certificate)[0] in self._entries
+
+    def __len__(self) -> int:
+        """Return the number of certificates."""
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        """Yield the certificates as PEM strings, in insertion order."""
+        for value in self._entries.values():
+            yield value if isinstance(value, str) else _der_to_pem(value)
+
+
+class CertificateAggregate:
+    """Certificates of several relations, as returned by `aggregate_certificates`."""
+
+    __slots__ = ("certificates", "relations")
+
+    def __init__(self, certificates: List[str], relations: Optional[Dict[str, Set[int]]] = None):
+        self.certificates = certificates
+        """Certificates deduplicated by canonical fingerprint, by relation ID then PEM."""
+        self.relations = relations
+        """IDs of the relations which sent each certificate, if requested."""
+
+    def __repr__(self) -> str:
+        """Return a representation of the aggregate."""
+        return (
+            f"CertificateAggregate(certificates={self.certificates!r}, "
+            f"relations={self.relations!r})"
+        )
+
+
+class CertificateMetadata:
+    """Metadata of a certificate, as returned by `CertificateMetadataCache`."""
+
+    __slots__ = ("subject", "issuer", "not_after", "is_ca", "sha256")
+
+    def __init__(
+        self,
+        subject: str,
+        issuer: str,
+        not_after: datetime.datetime,
+        is_ca: bool,
+        sha256: str,
+    ):
+        self.subject = subject
+        """Subject distinguished name, as an RFC 4514 string."""
+        self.issuer = issuer
+        """Issuer distinguished name, as an RFC 4514 string."""
+        self.not_after = not_after
+        """End of the validity period, as a timezone-aware UTC datetime."""
+        self.is_ca = is_ca
+        """Whether the basic constraints extension marks the certificate as a CA."""
+        self.sha256 = sha256
+        """SHA-256 fingerprint of the DER encoding of the certificate, in hex."""
+
+    def __eq__(self, other: object) -> bool:
+        """Return whether both records hold the same metadata."""
+        if not isinstance(other, CertificateMetadata):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        """Return a representation of the record."""
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"CertificateMetadata({fields})"
+
+
+def _certificate_metadata(der: bytes) -> CertificateMetadata:
+    """Parse the metadata of a DER certificate.
+
+    Raises:
+        ValueError: If the certificate is invalid.
+    """
+    fields = _tbs_certificate_fields(der)
+    _, _, issuer_start, issuer_end = fields[2]
+    _, _, validity_start, validity_end = fields[3]
+    _, _, subject_start, subject_end = fields[4]
+    validity = _der_children(der, validity_start, validity_end)
+    if len(validity) != 2:
+        raise ValueError("invalid certificate validity")
+    tag, _, not_after_start, not_after_end = validity[1]
+    return CertificateMetadata(
+        subject=_name_string(der, subject_start, subject_end),
+        issuer=_name_string(der, issuer_start, issuer_end),
+        not_after=_der_time(tag, der[not_after_start:not_after_end]),
+        is_ca=_is_ca(der, fields),
+        sha256=hashlib.sha256(der).hexdigest(),
+    )
+
 
+class CertificateMetadataCache:
+    """Bounded LRU cache of certificate metadata, keyed by certificate fingerprint.
+
+    Each certificate is parsed once, and its metadata kept until it is among the least
+    recently used when the cache is full. When given a path, the cache is loaded from and
+    saved to a file, so that it survives across hooks. The file should be local to the
+    unit, for example in the charm directory.
+    """
+
+    def __init__(self, maxsize: int = 4096, path: Optional[Union[str, "os.PathLike[str]"]] = None):
+        self.maxsize = maxsize
+        self.path = os.fspath(path) if path is not None else None
+        self._entries: "OrderedDict[str, CertificateMetadata]" = OrderedDict()
+        self._dirty = False
+        if self.path is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        """Return the number of cached entries."""
+        return len(self._entries)
+
+    def get(self, certificate: str) -> Optional[CertificateMetadata]:
+        """Return the metadata of a PEM certificate, parsing it on a cache miss.
+
+        Returns None for strings which are not a single valid PEM certificate.
+        """
+        fingerprint = _certificate_fingerprint(certificate)
+        metadata = self._entries.get(fingerprint)
+        if metadata is not None:
+            self._entries.move_to_end(fingerprint)
+            return metadata
+        der = _certificate_der(certificate)
+        if der is None:
+            return None
         try:
-            return cls.model_validate_json(json.dumps(data))
-        except pydantic.ValidationError as e:
-            msg = f"failed to validate databag: {databag}"
-            logger.debug(msg, exc_info=True)
-            raise DataValidationError(msg) from e
-
-    @classmethod
-    def _load_v1(cls, databag: MutableMapping):
-        """Load implementation for pydantic v1."""
-        if cls._NEST_UNDER:
-            return cls.parse_obj(json.loads(databag[cls._NEST_UNDER]))
+            metadata = _certificate_metadata(der)
+        except (ValueError, IndexError) as e:
+            logger.debug("Failed to parse certificate metadata: %s", e)
+            return None
+        self._entries[fingerprint] = metadata
+        self._dirty = True
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return metadata
+
+    def save(self) -> None:
+        """Save the cache to its file, if it has one and changed since it was loaded."""
+        if self.path is None or not self._dirty:
+            return
+        entries = {
+            fingerprint: [
+                metadata.subject,
+                metadata.issuer,
+                metadata.not_after.isoformat(),
+                metadata.is_ca,
+            ]
+            for fingerprint, metadata in self._entries.items()
+        }
+        _write_file_atomically(self.path, [json.dumps(entries).encode()], 0o600, durable=False)
+        self._dirty = False
+
+    def _load(self) -> None:
+        """Load the cache from its file, starting empty if it is missing or invalid."""
+        assert self.path is not None
+        try:
+            with open(self.path) as file:
+                entries = json.load(file)
+            for fingerprint, (subject, issuer, not_after, is_ca) in entries.items():
+                self._entries[fingerprint] = CertificateMetadata(
+                    subject=subject,
+                    issuer=issuer,
+                    not_after=datetime.datetime.fromisoformat(not_after),
+                    is_ca=is_ca,
+                    sha256=fingerprint,
+                )
+        except FileNotFoundError:
+            return
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.debug("Ignoring invalid certificate metadata cache %s: %s", self.path, e)
+            self._entries.clear()
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class DatabagCache:
+    """Cache of the certificates parsed from provider databags, keyed by relation and entity.
+
+    Each entry holds a digest of the raw contents of a databag and refers to the
+    certificates parsed from it, so that the databag is only parsed again when its contents
+    change. Databags with the same contents in several relations refer to the same set of
+    certificates. When given a path, the cache is saved to a file and loaded from it on first
+    use, so that hooks reuse the certificates parsed by previous hooks. The file should be
+    local to the unit, for example in the charm directory.
+
+    The file holds a line of JSON listing the entries, the certificate sets as indexes of
+    certificates and the length of each certificate, followed by the text of each
+    certificate, stored once. Certificates are sliced out of the text by length, which is
+    much faster than decoding them from JSON strings.
+    """
 
+    def __init__(self, path: Optional[Union[str, "os.PathLike[str]"]] = None):
+        self.path = os.fspath(path) if path is not None else None
+        self._entries: Dict[Tuple[int, str], str] = {}
+        self._sets: Dict[str, AbstractSet[str]] = {}
+        self._dirty = False
+        self._loaded = self.path is None
+
+    def __len__(self) -> int:
+        """Return the number of cached entries."""
+        self._load()
+        return len(self._entries)
+
+    def get(self, relation_id: int, name: str, digest: str) -> Optional[AbstractSet[str]]:
+        """Return the certificates of the databag of an application or unit in a relation.
+
+        Returns None if the databag wasn't cached with the given digest.
+        """
+        self._load()
+        if self._entries.get((relation_id, name)) != digest:
+            return None
+        return self._sets.get(digest)
+
+    def set(
+        self, relation_id: int, name: str, digest: str, certificates: AbstractSet[str]
+    ) -> None:
+        """Cache the certificates of the databag of an application or unit in a relation."""
+        self._load()
+        self._entries[(relation_id, name)] = digest
+        self._sets[digest] = certificates
+        self._dirty = True
+
+    def remove_relation(self, relation_id: int) -> None:
+        """Remove the entries of a relation."""
+        self._load()
+        for key in [key for key in self._entries if key[0] == relation_id]:
+            del self._entries[key]
+            self._dirty = True
+
+    def save(self) -> None:
+        """Save the cache to its file, if it has one and changed since it was loaded.
+
+        Only the certificate sets referred to by an entry are saved.
+        """
+        if self.path is None or not self._dirty:
+            return
+        index: Dict[str, int] = {}
+        sets = {
+            digest: [
+                index.setdefault(certificate, len(index)) for certificate in sorted(certificates)
+            ]
+            for digest, certificates in sorted(self._sets.items())
+            if digest in self._entries.values()
+        }
+        header = {
+            "lengths": [len(certificate) for certificate in index],
+            "sets": sets,
+            "entries": [
+                [relation_id, name, digest]
+                for (relation_id, name), digest in sorted(self._entries.items())
+            ],
+        }
+        chunks = itertools.chain(
+            [json.dumps(header).encode(), b"\n"], (certificate.encode() for certificate in index)
+        )
+        _write_file_atomically(self.path, chunks, 0o600, durable=False)
+        self._dirty = False
+
+    def _load(self) -> None:
+        """Load the cache from its file once, starting empty if it is missing or invalid."""
+        if self._loaded:
+            return
+        self._loaded = True
+        assert self.path is not None
         try:
-            data = {
-                k: json.loads(v)
-                for k, v in databag.items()
-                # Don't attempt to parse model-external values
-                if k in {f.alias for f in cls.__fields__.values()}
+            with open(self.path, "rb") as file:
+                header = json.loads(file.readline())
+                text = file.read().decode()
+            certificates = []
+            start = 0
+            for length in header["lengths"]:
+                certificates.append(text[start : start + length])
+                start += length
+            if start != len(text):
+                raise ValueError("certificates don't match their lengths")
+            sets: Dict[str, AbstractSet[str]] = {
+                str(digest): frozenset({certificates[index] for index in indices})
+                for digest, indices in header["sets"].items()
             }
-        except json.JSONDecodeError as e:
-            msg = f"invalid databag contents: expecting json. {databag}"
-            logger.error(msg)
-            raise DataValidationError(msg) from e
+            entries = {}
+            for relation_id, name, digest in header["entries"]:
+                if not isinstance(relation_id, int) or digest not in sets:
+                    raise TypeError("invalid entry")
+                entries[(relation_id, str(name))] = digest
+        except FileNotFoundError:
+            return
+        except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
+            logger.debug("Ignoring invalid databag cache %s: %s", self.path, e)
+            return
+        self._entries = entries
+        self._sets = sets
+
+
+_HASHED_DIRECTORY_MANIFEST = ".certificate-transfer-manifest.json"
+_HASHED_FILE_NAME_PATTERN = re.compile(r"([0-9a-f]{8})\.(\d+)")
+
+
+class LocalDirectoryWriter:
+    """Writer of the files of a hashed certificate directory on the local filesystem.
+
+    Writers for other filesystems, such as `ContainerDirectoryWriter`, implement the same
+    methods.
+    """
+
+    def __init__(self, path: Union[str, "os.PathLike[str]"]):
+        self.path = os.fspath(path)
 
+    def list_files(self) -> List[str]:
+        """Return the names of the files in the directory."""
         try:
-            return cls.parse_raw(json.dumps(data))  # type: ignore
-        except pydantic.ValidationError as e:
-            msg = f"failed to validate databag: {databag}"
-            logger.debug(msg, exc_info=True)
-            raise DataValidationError(msg) from e
+            return [entry.name for entry in os.scandir(self.path) if entry.is_file()]
+        except FileNotFoundError:
+            return []
 
-    def dump(self, databag: Optional[MutableMapping] = None, clear: bool = True):
-        """Write the contents of this model to Juju databag.
+    def read(self, name: str) -> Optional[str]:
+        """Return the contents of a file, or None if it doesn't exist."""
+        try:
+            with open(os.path.join(self.path, name)) as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
 
-        Args:
-            databag: The databag to write to.
-            clear: Whether to clear the databag before writing.
+    def write(self, name: str, content: str, durable: bool = False) -> None:
+        """Atomically write a file, flushing it to disk if durable."""
+        path = os.path.join(self.path, name)
+        _write_file_atomically(path, [content.encode()], 0o644, durable=durable)
 
-        Returns:
-            MutableMapping: The databag.
+    def remove(self, name: str) -> None:
+        """Remove a file."""
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(os.path.join(self.path, name))
+
+
+class ContainerDirectoryWriter:
+    """Writer of the files of a hashed certificate directory in a Pebble container."""
+
+    def __init__(self, container: Container, path: str):
+        self.container = container
+        self.path = path.rstrip("/")
+
+    def list_files(self) -> List[str]:
+        """Return the names of the files in the directory."""
+        try:
+            files = self.container.list_files(self.path)
+        except APIError as e:
+            if e.code == 404:
+                return []
+            raise
+        return [file.name for file in files if file.type == FileType.FILE]
+
+    def read(self, name: str) -> Optional[str]:
+        """Return the contents of a file, or None if it doesn't exist."""
+        try:
+            with self.container.pull(f"{self.path}/{name}") as file:
+                return file.read()
+        except PathError:
+            return None
+
+    def write(self, name: str, content: str, durable: bool = False) -> None:
+        """Write a file. Pebble replaces files atomically."""
+        self.container.push(f"{self.path}/{name}", content, make_dirs=True, permissions=0o644)
+
+    def remove(self, name: str) -> None:
+        """Remove a file."""
+        with contextlib.suppress(PathError):
+            self.container.remove_path(f"{self.path}/{name}")
+
+
+DirectoryWriter = Union[LocalDirectoryWriter, ContainerDirectoryWriter]
+
+
+def _read_hashed_directory(writer: DirectoryWriter) -> Dict[str, Optional[str]]:
+    """Return the fingerprint of the certificate in each hashed file of a directory.
+
+    Fingerprints are read from the manifest written by the last sync. They are None for
+    hashed files missing from the manifest, whose contents are unknown.
+    """
+    manifest: Dict[str, str] = {}
+    content = writer.read(_HASHED_DIRECTORY_MANIFEST)
+    if content is not None:
+        try:
+            manifest = dict(json.loads(content)["files"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Invalid hashed directory manifest, rewriting all certificates")
+    return {
+        name: manifest.get(name)
+        for name in writer.list_files()
+        if _HASHED_FILE_NAME_PATTERN.fullmatch(name)
+    }
+
+
+def _hashed_certificates(certificates: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+    """Return the subject hash and normalized PEM of certificates, keyed by fingerprint.
+
+    Certificates which are not in PEM format are skipped.
+    """
+    hashed: Dict[str, Tuple[str, str]] = {}
+    for certificate in certificates:
+        der = _certificate_der(certificate)
+        try:
+            if der is None:
+                raise ValueError("not a PEM certificate")
+            subject_hash = _openssl_subject_hash(der)
+        except (ValueError, IndexError) as e:
+            logger.warning("Skipping certificate for the hashed directory: %s", e)
+            continue
+        hashed[hashlib.sha256(der).hexdigest()] = (subject_hash, _der_to_pem(der))
+    return hashed
+
+
+def _assign_hashed_files(
+    current: Mapping[str, Optional[str]], desired: Mapping[str, Tuple[str, str]]
+) -> Dict[str, str]:
+    """Assign a `<subject hash>.<n>` file name to each desired certificate.
+
+    Certificates already in a file keep its name, unless it would leave a gap in the
+    indexes of their subject hash, which OpenSSL lookups stop at.
+
+    Returns:
+        The fingerprint of the certificate of each file, keyed by file name.
+    """
+    kept: Dict[str, Dict[int, str]] = {}
+    placed: Set[str] = set()
+    for name, fingerprint in sorted(current.items()):
+        subject_hash, index = name.split(".")
+        if fingerprint is not None and fingerprint in desired and fingerprint not in placed:
+            if desired[fingerprint][0] == subject_hash:
+                kept.setdefault(subject_hash, {})[int(index)] = fingerprint
+                placed.add(fingerprint)
+    pending: Dict[str, List[str]] = {}
+    for fingerprint, (subject_hash, _) in sorted(desired.items()):
+        if fingerprint not in placed:
+            pending.setdefault(subject_hash, []).append(fingerprint)
+
+    files: Dict[str, str] = {}
+    for subject_hash in sorted(kept.keys() | pending.keys()):
+        indexed = kept.get(subject_hash, {})
+        count = len(indexed) + len(pending.get(subject_hash, []))
+        # Certificates beyond the new count move to the gaps, to keep the indexes contiguous
+        moved = [fingerprint for index, fingerprint in sorted(indexed.items()) if index >= count]
+        for index, fingerprint in indexed.items():
+            if index < count:
+                files[f"{subject_hash}.{index}"] = fingerprint
+        free = sorted(set(range(count)) - indexed.keys())
+        for index, fingerprint in zip(free, pending.get(subject_hash, []) + moved):
+            files[f"{subject_hash}.{index}"] = fingerprint
+    return files
+
+
+def _sync_hashed_directory(
+    writer: DirectoryWriter, certificates: Iterable[str]
+) -> Tuple[List[str], List[str]]:
+    """Sync a hashed certificate directory with the given certificates.
+
+    Every certificate is stored in a `<subject hash>.<n>` file, where the n of the
+    certificates with the same subject hash are contiguous from 0, as expected by OpenSSL
+    lookups. Only the files whose certificate changed are written or removed. A manifest
+    of the fingerprint of each file is kept in the directory, so that the files don't have
+    to be read back.
+
+    Returns:
+        The names of the files written and the names of the files removed.
+    """
+    desired = _hashed_certificates(certificates)
+    current = _read_hashed_directory(writer)
+    files = _assign_hashed_files(current, desired)
+    written = sorted(
+        name for name, fingerprint in files.items() if current.get(name) != fingerprint
+    )
+    removed = sorted(name for name in current if name not in files)
+    for name in written:
+        writer.write(name, desired[files[name]][1])
+    for name in removed:
+        writer.remove(name)
+    if written or removed:
+        manifest = json.dumps({"files": files}, sort_keys=True)
+        writer.write(_HASHED_DIRECTORY_MANIFEST, manifest, durable=True)
+    return written, removed
+
+
+def _unit_number(unit: Unit) -> int:
+    """Return the number of the given unit, used to order units deterministically."""
+    return int(unit.name.rsplit("/", 1)[-1])
+
+
+def _index_certificates(certificates: Iterable[str]) -> Dict[str, str]:
+    """Return the given certificates indexed by their canonical fingerprint."""
+    return {_certificate_fingerprint(certificate): certificate for certificate in certificates}
+
+
+@functools.lru_cache(maxsize=None)
+def _models() -> SimpleNamespace:  # noqa: C901
+    """Import pydantic and build the databag models.
+
+    This is done on first use rather than on import, so that hooks which never load
+    or dump a databag don't pay for importing pydantic.
+    """
+    import pydantic
+
+    IS_PYDANTIC_V1 = int(pydantic.version.VERSION.split(".")[0]) < 2  # noqa: N806
+
+    class DatabagModel(pydantic.BaseModel):
+        """Base databag model.
+
+        Supports both pydantic v1 and v2.
         """
+
         if IS_PYDANTIC_V1:
-            return self._dump_v1(databag, clear)
-        if clear and databag:
-            databag.clear()
-
-        if databag is None:
-            databag = {}
-        nest_under = self.model_config.get("_NEST_UNDER")
-        if nest_under:
-            databag[nest_under] = self.model_dump_json(
-                by_alias=True,
-                # skip keys whose values are default
-                exclude_defaults=True,
+
+            class Config:
+                """Pydantic config."""
+
+                # ignore any extra fields in the databag
+                extra = "ignore"
+                """Ignore any extra fields in the databag."""
+                allow_population_by_field_name = True
+                """Allow instantiating this class by field name (instead of forcing alias)."""
+
+            _NEST_UNDER = None
+
+        else:
+            model_config = pydantic.ConfigDict(
+                # tolerate additional keys in databag
+                extra="ignore",
+                # Allow instantiating this class by field name (instead of forcing alias).
+                populate_by_name=True,
+                # Custom config key: whether to nest the whole datastructure (as json)
+                # under a field or spread it out at the toplevel.
+                _NEST_UNDER=None,
+            )  # type: ignore
+            """Pydantic config."""
+
+        @classmethod
+        def load(cls, databag: MutableMapping):
+            """Load this model from a Juju databag."""
+            if IS_PYDANTIC_V1:
+                return cls._load_v1(databag)
+            nest_under = cls.model_config.get("_NEST_UNDER")
+            if nest_under:
+                return cls.model_validate(json.loads(databag[nest_under]))
+
+            keys = {(f.alias or n) for n, f in cls.model_fields.items()}
+            try:
+                data = {
+                    k: json.loads(v)
+                    for k, v in databag.items()
+                    # Don't attempt to parse model-external values
+                    if k in keys
+                }
+            except json.JSONDecodeError as e:
+                msg = f"invalid databag contents: expecting json. {databag}"
+                logger.error(msg)
+                raise DataValidationError(msg) from e
+
+            try:
+                # Validate the decoded values directly rather than re-encoding them to JSON
+                return cls.model_validate(data)
+            except pydantic.ValidationError as e:
+                msg = f"failed to validate databag: {databag}"
+                logger.debug(msg, exc_info=True)
+                raise DataValidationError(msg) from e
+
+        @classmethod
+        def _load_v1(cls, databag: MutableMapping):
+            """Load implementation for pydantic v1."""
+            if cls._NEST_UNDER:
+                return cls.parse_obj(json.loads(databag[cls._NEST_UNDER]))
+
+            keys = {f.alias for f in cls.__fields__.values()}
+            try:
+                data = {
+                    k: json.loads(v)
+                    for k, v in databag.items()
+                    # Don't attempt to parse model-external values
+                    if k in keys
+                }
+            except json.JSONDecodeError as e:
+                msg = f"invalid databag contents: expecting json. {databag}"
+                logger.error(msg)
+                raise DataValidationError(msg) from e
+
+            try:
+                return cls.parse_obj(data)  # type: ignore
+            except pydantic.ValidationError as e:
+                msg = f"failed to validate databag: {databag}"
+                logger.debug(msg, exc_info=True)
+                raise DataValidationError(msg) from e
+
+        def dump(self, databag: Optional[MutableMapping] = None, clear: bool = True):
+            """Write the contents of this model to Juju databag.
+
+            Args:
+                databag: The databag to write to.
+                clear: Whether to clear the databag before writing.
+
+            Returns:
+                MutableMapping: The databag.
+            """
+            if IS_PYDANTIC_V1:
+                return self._dump_v1(databag, clear)
+            if clear and databag:
+                databag.clear()
+
+            if databag is None:
+                databag = {}
+            nest_under = self.model_config.get("_NEST_UNDER")
+            if nest_under:
+                databag[nest_under] = self.model_dump_json(
+                    by_alias=True,
+                    # skip keys whose values are default
+                    exclude_defaults=True,
+                )
+                return databag
+
+            dct = self.model_dump(
+                mode="json", by_alias=True, exclude_defaults=False, exclude_none=True
             )
+            databag.update({k: self._dump_value(k, v) for k, v in dct.items()})
             return databag
 
-        dct = self.model_dump(mode="json", by_alias=True, exclude_defaults=False)
-        databag.update({k: json.dumps(v) for k, v in dct.items()})
-        return databag
+        def _dump_value(self, key: str, value: object) -> str:
+            """Encode a field value to JSON, sorting sets so that the output is canonical.
+
+            Sets would otherwise be dumped in iteration order, which depends on the hash
+            seed of the process, so the same contents could be written as different bytes.
+            """
+            if isinstance(getattr(self, key, None), (set, frozenset)):
+                value = sorted(cast(List[str], value))
+            return json.dumps(value)
+
+        def _dump_v1(self, databag: Optional[MutableMapping] = None, clear: bool = True):
+            """Dump implementation for pydantic v1."""
+            if clear and databag:
+                databag.clear()
 
-    def _dump_v1(self, databag: Optional[MutableMapping] = None, clear: bool = True):
-        """Dump implementation for pydantic v1."""
-        if clear and databag:
-            databag.clear()
+            if databag is None:
+                databag = {}
 
-        if databag is None:
-            databag = {}
+            if self._NEST_UNDER:
+                databag[self._NEST_UNDER] = self.json(by_alias=True, exclude_defaults=False)
+                return databag
+
+            dct = json.loads(self.json(by_alias=True, exclude_defaults=False, exclude_none=True))
+            databag.update({k: self._dump_value(k, v) for k, v in dct.items()})
 
-        if self._NEST_UNDER:
-            databag[self._NEST_UNDER] = self.json(by_alias=True, exclude_defaults=False)
             return databag
 
-        dct = json.loads(self.json(by_alias=True, exclude_defaults=False))
-        databag.update({k: json.dumps(v) for k, v in dct.items()})
+    class ProviderApplicationData(DatabagModel):
+        """Provider App databag model."""
 
-        return databag
+        if IS_PYDANTIC_V1:
+            certificates: Set[str] = pydantic.Field(
+                description="The set of certificates that will be transferred to a requirer",
+                default_factory=set,
+            )
+        else:
+            certificates: Set[str] = pydantic.Field(
+                description="The set of certificates that will be transferred to a requirer",
+                default=set(),
+            )
+        version: int = pydantic.Field(
+            description="Version of the interface used in this databag",
+            default=1,
+        )
+        encoding: Optional[str] = pydantic.Field(
+            description="Encoding of compressed_certificates, unset when sending plain PEM",
+            default=None,
+        )
+        compressed_certificates: Optional[str] = pydantic.Field(
+            description="The certificates, encoded with the payload encoding",
+            default=None,
+        )
+        manifest: Optional[Dict[str, str]] = pydantic.Field(
+            description="Digest of each certificates shard keyed by databag key, "
+            "unset when the certificates are not sharded",
+            default=None,
+        )
 
+        def get_certificates(self) -> Set[str]:
+            """Return the certificates, decoding them if they were sent with an encoding.
+
+            Raises:
+                DataValidationError: If the encoded certificates are invalid.
+            """
+            if self.encoding is None:
+                return self.certificates
+            return _decode_certificates(self.encoding, self.compressed_certificates or "")
+
+    class ProviderUnitDataV0(DatabagModel):
+        """Provider Unit databag v0 model."""
+
+        ca: str
+        certificate: str
+        chain: Optional[List[str]] = None
+        version: int = pydantic.Field(
+            description="Version of the interface used in this databag",
+            default=0,
+        )
 
-class ProviderApplicationData(DatabagModel):
-    """Provider App databag model."""
+    class RequirerApplicationData(DatabagModel):
+        """Requirer App databag model."""
 
-    if int(pydantic.version.VERSION.split(".")[0]) < 2:
-        certificates: Set[str] = pydantic.Field(
-            description="The set of certificates that will be transferred to a requirer",
-            default_factory=set,
+        version: int = pydantic.Field(
+            description="Version of the interface supported by this requirer",
+            default=1,
         )
-    else:
-        certificates: Set[str] = pydantic.Field(
-            description="The set of certificates that will be transferred to a requirer",
-            default=set(),
+        encodings: List[str] = pydantic.Field(
+            description="Payload encodings of the certificates supported by this requirer",
+            default_factory=list,
+        )
+        layouts: List[str] = pydantic.Field(
+            description="Databag layouts supported by this requirer, besides the default one",
+            default_factory=list,
         )
-    version: int = pydantic.Field(
-        description="Version of the interface used in this databag",
-        default=1,
-    )
 
+    for model in (
+        DatabagModel,
+        ProviderApplicationData,
+        ProviderUnitDataV0,
+        RequirerApplicationData,
+    ):
+        model.__qualname__ = model.__name__
+    return SimpleNamespace(
+        pydantic=pydantic,
+        IS_PYDANTIC_V1=IS_PYDANTIC_V1,
+        DatabagModel=DatabagModel,
+        ProviderApplicationData=ProviderApplicationData,
+        ProviderUnitDataV0=ProviderUnitDataV0,
+        RequirerApplicationData=RequirerApplicationData,
+    )
 
-class ProviderUnitDataV0(DatabagModel):
-    """Provider Unit databag v0 model."""
 
-    ca: str
-    certificate: str
-    chain: Optional[List[str]] = None
-    version: int = pydantic.Field(
-        description="Version of the interface used in this databag",
-        default=0,
+_LAZY_ATTRIBUTES = {
+    "pydantic",
+    "IS_PYDANTIC_V1",
+    "DatabagModel",
+    "ProviderApplicationData",
+    "ProviderUnitDataV0",
+    "RequirerApplicationData",
+}
+
+
+def __getattr__(name: str):
+    """Build the databag models when one of them is first accessed from this module."""
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(_models(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class RelationChange:
+    """Planned change of the relation data of one relation, as part of a `ChangePlan`."""
+
+    __slots__ = (
+        "relation_id",
+        "version",
+        "added",
+        "removed",
+        "payload",
+        "changed_keys",
+        "payload_size",
+        "bytes_written",
+        "databag_digest",
+        "_relation",
     )
 
+    def __init__(
+        self,
+        relation: Relation,
+        version: int,
+        added: FrozenSet[str],
+        removed: FrozenSet[str],
+        payload: Optional[Mapping[str, str]],
+        changed_keys: FrozenSet[str],
+        databag_digest: Optional[str] = None,
+    ):
+        self._relation = relation
+        self.relation_id = relation.id
+        """Juju relation ID."""
+        self.version = version
+        """Interface version of the requirer: 1 writes to the application databag, 0 to the
+        unit databag."""
+        self.added = added
+        """Certificates added to the relation."""
+        self.removed = removed
+        """Certificates removed from the relation."""
+        self.payload = payload
+        """Read-only databag contents after the change, or None if nothing is written."""
+        self.changed_keys = changed_keys
+        """Databag keys written or deleted by the change."""
+        self.payload_size = sum(len(value) for value in (payload or {}).values())
+        """Size of the databag values after the change, in bytes."""
+        self.bytes_written = sum(len((payload or {}).get(key, "")) for key in changed_keys)
+        """Size of the databag values written by the change, in bytes."""
+        self.databag_digest = databag_digest
+        """Digest of the databag contents the change was planned against."""
+
+    def __repr__(self) -> str:
+        """Return a representation of the record."""
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}" for name in self.__slots__ if name[0] != "_"
+        )
+        return f"RelationChange({fields})"
+
 
-class RequirerApplicationData(DatabagModel):
-    """Requirer App databag model."""
+class ChangePlan:
+    """Certificate changes planned by `CertificateTransferProvides.plan_changes`.
+
+    A plan is only valid during the hook in which it was made.
+    """
 
-    version: int = pydantic.Field(
-        description="Version of the interface supported by this requirer",
-        default=1,
+    __slots__ = ("changes", "expired")
+
+    def __init__(self, changes: List[RelationChange], expired: FrozenSet[str]):
+        self.changes = changes
+        """Planned change of each relation."""
+        self.expired = expired
+        """Expired certificates dropped from relation data."""
+
+    @property
+    def changed_relations(self) -> List[int]:
+        """IDs of the relations whose databag is written by the plan."""
+        return [change.relation_id for change in self.changes if change.changed_keys]
+
+    @property
+    def bytes_written(self) -> int:
+        """Size of the databag values written by the plan, in bytes."""
+        return sum(change.bytes_written for change in self.changes)
+
+    def __repr__(self) -> str:
+        """Return a representation of the plan."""
+        return f"ChangePlan(changes={self.changes!r}, expired={self.expired!r})"
+
+
+class HookMetrics:
+    """Metrics of the relation data handled in one relation during a hook."""
+
+    __slots__ = (
+        "relation_id",
+        "databag_reads",
+        "databag_writes",
+        "bytes_serialized",
+        "parse_time",
+        "certificates_added",
+        "certificates_removed",
+        "events_emitted",
+        "events_suppressed",
     )
 
+    def __init__(self, relation_id: int):
+        self.relation_id = relation_id
+        """Juju relation ID."""
+        self.databag_reads = 0
+        """Number of databags read."""
+        self.databag_writes = 0
+        """Number of databag keys written or deleted."""
+        self.bytes_serialized = 0
+        """Size of the values written to databags, in bytes."""
+        self.parse_time = 0.0
+        """Time spent parsing and validating databags, in seconds."""
+        self.certificates_added = 0
+        """Number of certificates added to the relation."""
+        self.certificates_removed = 0
+        """Number of certificates removed from the relation."""
+        self.events_emitted = 0
+        """Number of certificate_set_updated events emitted."""
+        self.events_suppressed = 0
+        """Number of certificate_set_updated events suppressed because nothing changed."""
+
+    def __eq__(self, other: object) -> bool:
+        """Return whether both records hold the same metrics."""
+        if not isinstance(other, HookMetrics):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        """Return a representation of the record."""
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"HookMetrics({fields})"
+
+
+class _HookInstrumentation:
+    """Collect the metrics of each relation during a hook and report them to a callback.
+
+    Nothing is collected when there is no callback.
+    """
+
+    def __init__(self, callback: Optional[Callable[[HookMetrics], None]]):
+        self.callback = callback
+        self._metrics: Dict[int, HookMetrics] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """Whether metrics are collected."""
+        return self.callback is not None
+
+    def add(self, relation_id: int, **counts: float) -> None:
+        """Add the given counts to the metrics of a relation."""
+        if self.callback is None:
+            return
+        metrics = self._metrics.get(relation_id)
+        if metrics is None:
+            metrics = self._metrics[relation_id] = HookMetrics(relation_id)
+        for name, count in counts.items():
+            setattr(metrics, name, getattr(metrics, name) + count)
+
+    @contextlib.contextmanager
+    def parsing(self, relation_id: int) -> Iterator[None]:
+        """Add the time spent in the context to the parse time of a relation."""
+        if self.callback is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(relation_id, parse_time=time.perf_counter() - start)
+
+    def report(self) -> None:
+        """Pass the metrics of each relation to the callback, and start over."""
+        metrics, self._metrics = self._metrics, {}
+        if self.callback is None:
+            return
+        for relation_id in sorted(metrics):
+            try:
+                self.callback(metrics[relation_id])
+            except Exception:
+                logger.warning("Metrics callback failed", exc_info=True)
+
+
+_PayloadKey = Tuple[bool, Optional[str], bool, FrozenSet[str]]
+"""Interface version 1, payload encoding, sharded layout and certificates of a payload."""
+
 
 class CertificateTransferProvides(Object):
     """Certificate Transfer provider class to be instantiated by charms sending certificates."""
 
-    def __init__(self, charm: CharmBase, relationship_name: str):
+    def __init__(
+        self,
+        charm: CharmBase,
+        relationship_name: str,
+        compressed: bool = False,
+        sharded: bool = False,
+        prune_expired_certificates: bool = False,
+        metadata_cache: Optional[CertificateMetadataCache] = None,
+        metrics_callback: Optional[Callable[[HookMetrics], None]] = None,
+    ):
+        """Create the provider.
+
+        Args:
+            charm: Charm object
+            relationship_name: Juju relation name
+            compressed: Whether to send the certificates as a compressed payload to
+                requirers supporting it, which makes the relation data smaller.
+            sharded: Whether to split the certificates into shards across databag keys for
+                requirers supporting it, so that changing a certificate only rewrites the
+                shard holding it.
+            prune_expired_certificates: Whether to drop expired certificates from relation
+                data whenever certificates are added or removed.
+            metadata_cache: Cache of the expiry times of certificates, for example one
+                persisted to a file. Defaults to an in-memory cache.
+            metrics_callback: Called at the end of each hook with the metrics of every
+                relation handled during the hook.
+        """
         super().__init__(charm, relationship_name + "_v1")
         self.charm = charm
         self.relationship_name = relationship_name
+        self.compressed = compressed
+        self.sharded = sharded
+        self.prune_expired_certificates = prune_expired_certificates
+        self.metadata_cache = (
+            metadata_cache if metadata_cache is not None else CertificateMetadataCache()
+        )
+        self.skipped_writes = 0
+        """Number of databag writes skipped in this hook because the contents were unchanged."""
+        # Serialized databag contents and parsed relation data, kept for the rest of the hook
+        # so that relations holding the same certificate set are only handled once
+        self._payloads: "OrderedDict[_PayloadKey, Optional[Mapping[str, str]]]" = OrderedDict()
+        self._parsed_databags: Dict[Tuple[bool, str], FrozenSet[str]] = {}
+        self._parsed_shards: Dict[str, FrozenSet[str]] = {}
+        self._instrumentation = _HookInstrumentation(metrics_callback)
+        if metrics_callback is not None:
+            self.framework.observe(self.framework.on.commit, self._on_commit)
+
+    def _on_commit(self, _: EventBase) -> None:
+        """Report the metrics of the hook."""
+        self._instrumentation.report()
 
     def add_certificates(self, certificates: Set[str], relation_id: Optional[int] = None) -> None:
         """Add certificates from a set to relation data.
@@ -332,27 +1831,10 @@ class CertificateTransferProvides(Object):
         Returns:
             None
         """
-        if not self.charm.unit.is_leader():
-            logger.warning("Only the leader unit can add certificates to this relation")
-            return
-        relations = self._get_active_relations(relation_id)
-        if not relations:
-            if relation_id is not None:
-                logger.debug(
-                    "At least 1 matching relation ID not found with the relation name '%s'",
-                    self.relationship_name,
-                )
-            else:
-                logger.debug(
-                    "No active relations found with the relation name '%s'",
-                    self.relationship_name,
-                )
-            return
-
-        for relation in relations:
-            existing_data = self._get_relation_data(relation)
-            existing_data.update(certificates)
-            self._set_relation_data(relation, existing_data)
+        self.apply_changes(
+            add=certificates,
+            relation_ids=[relation_id] if relation_id is not None else None,
+        )
 
     def remove_all_certificates(self, relation_id: Optional[int] = None) -> None:
         """Remove all certificates from relation data.
@@ -365,25 +1847,10 @@ class CertificateTransferProvides(Object):
         Returns:
             None
         """
-        if not self.charm.unit.is_leader():
-            logger.warning("Only the leader unit can add certificates to this relation")
-            return
-        relations = self._get_active_relations(relation_id)
-        if not relations:
-            if relation_id is not None:
-                logger.debug(
-                    "At least 1 matching relation ID not found with the relation name '%s'",
-                    self.relationship_name,
-                )
-            else:
-                logger.debug(
-                    "No active relations found with the relation name '%s'",
-                    self.relationship_name,
-                )
-            return
-
-        for relation in relations:
-            self._set_relation_data(relation, set())
+        self.apply_changes(
+            relation_ids=[relation_id] if relation_id is not None else None,
+            remove_all=True,
+        )
 
     def remove_certificate(
         self,
@@ -401,12 +1868,250 @@ class CertificateTransferProvides(Object):
         Returns:
             None
         """
+        self.apply_changes(
+            remove={certificate},
+            relation_ids=[relation_id] if relation_id is not None else None,
+        )
+
+    def apply_changes(
+        self,
+        add: Optional[Set[str]] = None,
+        remove: Optional[Set[str]] = None,
+        relation_ids: Optional[List[int]] = None,
+        remove_all: bool = False,
+    ) -> None:
+        """Apply a batch of certificate additions and removals to relation data.
+
+        Expired certificates are also dropped if prune_expired_certificates is enabled.
+
+        Removals are applied before additions, so a certificate that is both added and
+        removed ends up in the relation data. Each databag is read and written at most once,
+        and each distinct resulting certificate set is serialized only once per interface
+        version, however many relations share it.
+
+        Certificates are matched on their canonical fingerprint rather than on their exact
+        PEM string, so a certificate is removed, or not added twice, even when it is given
+        with different line endings or whitespace than the one in the relation data.
+
+        Applies the changes to all relations if relation_ids is not provided.
+
+        Args:
+            add (Set[str]): Certificates in PEM format to add
+            remove (Set[str]): Certificates in PEM format to remove
+            relation_ids (List[int]): Juju relation IDs
+            remove_all (bool): Whether to remove all existing certificates before adding
+
+        Returns:
+            None
+        """
+        self._apply_changes(
+            add, remove, relation_ids, remove_all, drop_expired=self.prune_expired_certificates
+        )
+
+    def plan_changes(
+        self,
+        add: Optional[Set[str]] = None,
+        remove: Optional[Set[str]] = None,
+        relation_ids: Optional[List[int]] = None,
+        remove_all: bool = False,
+    ) -> ChangePlan:
+        """Plan a batch of certificate additions and removals without writing relation data.
+
+        Takes the same arguments as apply_changes. Each databag is read and parsed once, and
+        the plan holds, for each relation, the certificates added and removed, the databag
+        the requirer's interface version routes them to, and the keys and bytes written.
+        The plan can then be applied with apply_plan, which doesn't parse relation data
+        again, as long as relation data doesn't change in the meantime.
+
+        Args:
+            add (Set[str]): Certificates in PEM format to add
+            remove (Set[str]): Certificates in PEM format to remove
+            relation_ids (List[int]): Juju relation IDs
+            remove_all (bool): Whether to remove all existing certificates before adding
+
+        Returns:
+            The planned changes. The plan is empty if the unit isn't the leader.
+        """
+        return self._plan_changes(
+            add,
+            remove,
+            relation_ids,
+            remove_all,
+            self.prune_expired_certificates,
+            read=True,
+            check=True,
+        )
+
+    def apply_plan(self, plan: ChangePlan) -> None:
+        """Write the relation data of a plan made by plan_changes during the same hook.
+
+        Nothing is written if the databag of one of the relations changed since the plan
+        was made, for example by add_certificates, as the plan would discard that change.
+
+        Args:
+            plan: The planned changes.
+
+        Returns:
+            None
+
+        Raises:
+            StalePlanError: If the databag of one of the relations changed since the plan
+                was made.
+        """
+        for change in plan.changes:
+            if change.databag_digest is None:
+                continue
+            databag = change._relation.data[self.model.app if change.version else self.model.unit]
+            if _databag_digest(databag) != change.databag_digest:
+                raise StalePlanError(
+                    f"relation {change.relation_id} data changed since the plan was made"
+                )
+        self._write_plan(plan)
+
+    def _write_plan(self, plan: ChangePlan) -> None:
+        """Write the relation data of a plan, without checking that it is up to date."""
+        # Expiry times parsed while planning are only persisted once the plan is applied
+        self.metadata_cache.save()
+        for change in plan.changes:
+            self._set_relation_data(change)
+            self._instrumentation.add(
+                change.relation_id,
+                certificates_added=len(change.added),
+                certificates_removed=len(change.removed),
+            )
+        if plan.expired:
+            logger.info("Removed %d expired certificates from relation data", len(plan.expired))
+
+    def prune_expired(self, relation_id: Optional[int] = None) -> Set[str]:
+        """Remove expired certificates from relation data.
+
+        Removes expired certificates from all relations if relation_id is not provided.
+        The expiry time of each certificate is parsed once and kept in the metadata cache.
+
+        Args:
+            relation_id (int): Juju relation ID
+
+        Returns:
+            The expired certificates which were removed.
+        """
+        return self._apply_changes(
+            relation_ids=[relation_id] if relation_id is not None else None, drop_expired=True
+        )
+
+    def next_expiry(self, relation_id: Optional[int] = None) -> Optional[datetime.datetime]:
+        """Get the time at which the next certificate in relation data expires.
+
+        Charms can use it to schedule a single reconciliation, for example with
+        prune_expired, rather than polling. Certificates which are already expired, or
+        which can't be parsed, are not taken into account.
+
+        Args:
+            relation_id (int): Juju relation ID
+
+        Returns:
+            The earliest expiry time of the certificates which are not expired yet, as a
+            timezone-aware UTC datetime, or None if there is no such certificate.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expiry_times = [
+            metadata.not_after
+            for relation in self._get_active_relations(relation_id)
+            for certificate in self._get_relation_data(relation)
+            if (metadata := self.metadata_cache.get(certificate)) and metadata.not_after > now
+        ]
+        self.metadata_cache.save()
+        return min(expiry_times, default=None)
+
+    def _apply_changes(
+        self,
+        add: Optional[Set[str]] = None,
+        remove: Optional[Set[str]] = None,
+        relation_ids: Optional[List[int]] = None,
+        remove_all: bool = False,
+        drop_expired: bool = False,
+    ) -> Set[str]:
+        """Apply certificate changes to relation data, returning the expired ones dropped."""
+        # Relation data is only needed to remove all certificates when measuring removals
+        read = not remove_all or self._instrumentation.enabled
+        plan = self._plan_changes(add, remove, relation_ids, remove_all, drop_expired, read)
+        self._write_plan(plan)
+        return set(plan.expired)
+
+    def _plan_changes(
+        self,
+        add: Optional[Set[str]],
+        remove: Optional[Set[str]],
+        relation_ids: Optional[List[int]],
+        remove_all: bool,
+        drop_expired: bool,
+        read: bool,
+        check: bool = False,
+    ) -> ChangePlan:
+        """Plan certificate changes, reading the certificates of each relation if `read`.
+
+        When the certificates aren't read, which is only allowed with `remove_all`, the
+        planned changes don't list the removed certificates. When `check` is True, the
+        planned changes hold the digest of each databag, for apply_plan to check it.
+        """
         if not self.charm.unit.is_leader():
             logger.warning("Only the leader unit can add certificates to this relation")
-            return
-        relations = self._get_active_relations(relation_id)
+            return ChangePlan([], frozenset())
+        relations = self._get_target_relations(relation_ids)
+        if not relations:
+            return ChangePlan([], frozenset())
+
+        removed = _index_certificates(remove or ())
+        added = _index_certificates(add or ())
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expired: Set[str] = set()
+        changes = []
+        for relation in relations:
+            current = _index_certificates(self._get_relation_data(relation)) if read else {}
+            index = {} if remove_all else dict(current)
+            for fingerprint in removed:
+                index.pop(fingerprint, None)
+            for fingerprint, certificate in added.items():
+                # Keep the existing encoding of a certificate to avoid rewriting the databag
+                index.setdefault(fingerprint, certificate)
+            if drop_expired:
+                expired.update(self._drop_expired(index, now))
+            v1 = self._requirer_supports_v1(relation)
+            encoding, sharded = self._negotiate_format(relation) if v1 else (None, False)
+            key = (v1, encoding, sharded, frozenset(index.values()))
+            payload = self._get_payload(key)
+            databag = relation.data[self.model.app if v1 else self.model.unit]
+            changed_keys: FrozenSet[str] = frozenset()
+            if payload is not None:
+                changed_keys = frozenset(
+                    name
+                    for name in databag.keys() | payload.keys()
+                    if databag.get(name) != payload.get(name)
+                )
+            changes.append(
+                RelationChange(
+                    relation,
+                    version=1 if v1 else 0,
+                    added=frozenset(index[fp] for fp in index.keys() - current.keys()),
+                    removed=frozenset(current[fp] for fp in current.keys() - index.keys()),
+                    payload=payload,
+                    changed_keys=changed_keys,
+                    databag_digest=_databag_digest(databag) if check else None,
+                )
+            )
+        return ChangePlan(changes, frozenset(expired))
+
+    def _get_target_relations(self, relation_ids: Optional[List[int]]) -> List[Relation]:
+        """Get the active relations with the given IDs, or all active relations if None."""
+        if relation_ids is None:
+            relations = self._get_active_relations()
+        else:
+            relations = [
+                relation
+                for relation_id in dict.fromkeys(relation_ids)
+                for relation in self._get_active_relations(relation_id)
+            ]
         if not relations:
-            if relation_id is not None:
+            if relation_ids is not None:
                 logger.debug(
                     "At least 1 matching relation ID not found with the relation name '%s'",
                     self.relationship_name,
@@ -416,12 +2121,19 @@ class CertificateTransferProvides(Object):
                     "No active relations found with the relation name '%s'",
                     self.relationship_name,
                 )
-            return
+        return relations
 
-        for relation in relations:
-            existing_data = self._get_relation_data(relation)
-            existing_data.discard(certificate)
-            self._set_relation_data(relation, existing_data)
+    def _drop_expired(self, index: Dict[str, str], now: datetime.datetime) -> Set[str]:
+        """Remove the certificates expired at the given time from an index, returning them.
+
+        Certificates which can't be parsed are kept.
+        """
+        expired = set()
+        for fingerprint, certificate in list(index.items()):
+            metadata = self.metadata_cache.get(certificate)
+            if metadata is not None and metadata.not_after <= now:
+                expired.add(index.pop(fingerprint))
+        return expired
 
     def _get_active_relations(self, relation_id: Optional[int] = None) -> List[Relation]:
         """Get the relation if relation_id is given and the relation is active, all active relations otherwise."""
@@ -439,90 +2151,207 @@ class CertificateTransferProvides(Object):
             if relation.active
         ]
 
-    def _set_relation_data(self, relation: Relation, data: Set[str]) -> None:
-        """Set the given relation data."""
-        if relation.data.get(relation.app, {}).get("version", "0") == "1":
+    @staticmethod
+    def _requirer_supports_v1(relation: Relation) -> bool:
+        """Return whether the requirer advertises version 1 of the interface."""
+        return relation.data.get(relation.app, {}).get("version", "0") == "1"
+
+    def _negotiate_format(self, relation: Relation) -> Tuple[Optional[str], bool]:
+        """Return the payload encoding and layout to use with a v1 requirer.
+
+        Returns:
+            The preferred payload encoding supported by the requirer, if compression is
+            enabled, and whether to use the sharded layout.
+        """
+        if not self.compressed and not self.sharded:
+            return None, False
+        try:
+            data = _models().RequirerApplicationData.load(relation.data.get(relation.app, {}))
+        except DataValidationError:
+            return None, False
+        encoding = None
+        if self.compressed:
+            encoding = next((e for e in _SUPPORTED_ENCODINGS if e in data.encodings), None)
+        return encoding, self.sharded and _LAYOUT_SHARDED in data.layouts
+
+    def _get_payload(self, key: _PayloadKey) -> Optional[Mapping[str, str]]:
+        """Return the serialized databag contents for the given key.
+
+        Contents are cached for the rest of the hook, so that each distinct certificate set
+        is serialized only once per interface version, encoding and layout, however many
+        relations and calls share it.
+        """
+        if key in self._payloads:
+            self._payloads.move_to_end(key)
+            return self._payloads[key]
+        serialized = self._serialize_relation_data(*key)
+        # Contents are shared by all the relations and plans using them, so they are exposed
+        # read-only
+        payload = self._payloads[key] = (
+            MappingProxyType(serialized) if serialized is not None else None
+        )
+        if len(self._payloads) > _PAYLOAD_CACHE_SIZE:
+            self._payloads.popitem(last=False)
+        return payload
+
+    @staticmethod
+    def _serialize_relation_data(
+        v1: bool, encoding: Optional[str], sharded: bool, certificates: FrozenSet[str]
+    ) -> Optional[Mapping[str, str]]:
+        """Serialize a certificate set to databag contents for the given interface version.
+
+        v1 certificates are sent with the given payload encoding when all of them can be
+        encoded, and as plain PEM strings otherwise.
+
+        Returns None when there is nothing to write, as the v0 unit databag can't hold an
+        empty certificate set.
+        """
+        models = _models()
+        if v1 and sharded:
+            encoding, shards = _serialize_shards(encoding, certificates)
+            manifest = {key: _shard_digest(value) for key, value in shards.items()}
+            databag = models.ProviderApplicationData(encoding=encoding, manifest=manifest).dump()
+            databag.update(shards)
+            return databag
+        if v1:
+            if encoding is not None:
+                payload = _encode_certificates(encoding, certificates)
+                if payload is not None:
+                    data = models.ProviderApplicationData(
+                        encoding=encoding, compressed_certificates=payload
+                    )
+                    return data.dump()
+            return models.ProviderApplicationData(certificates=set(certificates)).dump()
+        if not certificates:
+            return None
+        chain = sorted(certificates)
+        return models.ProviderUnitDataV0(ca=chain[0], certificate=chain[0], chain=chain).dump()
+
+    def _set_relation_data(self, change: RelationChange) -> None:
+        """Write the planned contents to the databag matching the requirer's version.
+
+        Only keys whose value changed are written, and the write is skipped entirely when
+        the databag already holds the same contents, so that no `relation-changed` event
+        is triggered on the remote units.
+        """
+        relation = change._relation
+        if change.version == 1:
             databag = relation.data[self.model.app]
-            ProviderApplicationData(certificates=data).dump(databag, True)
         else:
             if "version" in relation.data.get(relation.app, {}):
                 logger.warning(
-                    (
-                        "Requirer in relation %d is using version %s of the interface,",
-                        "defaulting to version 0.",
-                        "This is deprecated, please consider upgrading the requirer",
-                        "to version 1 of the library.",
-                    ),
+                    "Requirer in relation %d is using version %s of the interface, "
+                    "defaulting to version 0. "
+                    "This is deprecated, please consider upgrading the requirer "
+                    "to version 1 of the library.",
                     relation.id,
                     relation.data[relation.app]["version"],
                 )
             else:
                 logger.warning(
-                    (
-                        "Requirer in relation %d did not provide version field,",
-                        "defaulting to version 0.",
-                        "This is deprecated, please consider upgrading the requirer",
-                        "to version 1 of the library.",
-                    ),
+                    "Requirer in relation %d did not provide version field, "
+                    "defaulting to version 0. "
+                    "This is deprecated, please consider upgrading the requirer "
+                    "to version 1 of the library.",
                     relation.id,
                 )
 
             databag = relation.data[self.model.unit]
-            if data:
-                certificates = list(data)
-                ProviderUnitDataV0(
-                    ca=certificates[0], certificate=certificates[0], chain=certificates
-                ).dump(databag, True)
-
-    def _get_relation_data(self, relation: Relation) -> Set[str]:
-        """Get the given relation data."""
+        payload = change.payload
+        if payload is None:
+            return
+        if not change.changed_keys:
+            self.skipped_writes += 1
+            logger.debug("Relation data unchanged in relation %d, skipping write", relation.id)
+            return
+        # Setting a key to an empty string deletes it, so a single relation-set is needed
+        databag.update({key: payload.get(key, "") for key in change.changed_keys})
+        self._instrumentation.add(
+            relation.id,
+            databag_writes=len(change.changed_keys),
+            bytes_serialized=change.bytes_written,
+        )
+
+    def _get_relation_data(self, relation: Relation) -> FrozenSet[str]:
+        """Get the given relation data.
+
+        Parsed certificates are cached for the rest of the hook, keyed by interface version
+        and a digest of the raw databag contents, so that relations holding the same
+        contents are only parsed once.
+        """
+        self._instrumentation.add(relation.id, databag_reads=1)
+        v1 = self._requirer_supports_v1(relation)
+        databag = relation.data[self.model.app if v1 else self.model.unit]
+        key = (v1, _databag_digest(databag))
+        cached = self._parsed_databags.get(key)
+        if cached is not None:
+            return cached
         try:
-            if relation.data.get(relation.app, {}).get("version", "0") == "1":
-                databag = relation.data[self.model.app]
-                return ProviderApplicationData().load(databag).certificates
-            else:
-                databag = relation.data[self.model.unit]
-                certs = ProviderUnitDataV0.load(databag).chain
-                if certs is None:
-                    return set()
-                return set(certs)
+            with self._instrumentation.parsing(relation.id):
+                if v1:
+                    data = _models().ProviderApplicationData().load(databag)
+                    if data.manifest is not None:
+                        certificates = _load_shards(
+                            databag, data.manifest, data.encoding, self._parsed_shards
+                        )
+                    else:
+                        certificates = frozenset(data.get_certificates())
+                else:
+                    certificates = frozenset(
+                        _models().ProviderUnitDataV0.load(databag).chain or ()
+                    )
         except DataValidationError as e:
             logger.error(
-                (
-                    "Error parsing relation databag: %s. ",
-                    "Make sure not to interact with the databags "
-                    "except using the public methods in the provider library "
-                    "and use version V1.",
-                ),
-                e.args,
+                "Error parsing relation databag: %s. "
+                "Make sure not to interact with the databags "
+                "except using the public methods in the provider library "
+                "and use version V1.",
+                e,
             )
-            return set()
+            return frozenset()
+        self._parsed_databags[key] = certificates
+        return certificates
 
 
 class CertificatesAvailableEvent(EventBase):
-    """Charm Event triggered when the set of provided certificates is updated."""
+    """Charm Event triggered when the set of provided certificates is updated.
+
+    Besides the full set of certificates, the event carries the certificates added and
+    removed since the last event for the same relation, so that handlers can update their
+    trust store incrementally. Both are empty when the set did not change, and None unless
+    the requirer tracks changes.
+    """
 
     def __init__(
         self,
         handle: Handle,
         certificates: Set[str],
         relation_id: int,
+        added: Optional[Set[str]] = None,
+        removed: Optional[Set[str]] = None,
     ):
         super().__init__(handle)
         self.certificates = certificates
         self.relation_id = relation_id
+        self.added = added
+        self.removed = removed
 
     def snapshot(self) -> dict:
         """Return snapshot."""
         return {
             "certificates": self.certificates,
             "relation_id": self.relation_id,
+            "added": self.added,
+            "removed": self.removed,
         }
 
     def restore(self, snapshot: dict):
         """Restores snapshot."""
         self.certificates = snapshot["certificates"]
         self.relation_id = snapshot["relation_id"]
+        # Events deferred by an older version of the library have no delta
+        self.added = snapshot.get("added")
+        self.removed = snapshot.get("removed")
 
 
 class CertificatesRemovedEvent(EventBase):
@@ -552,21 +2381,74 @@ class CertificateTransferRequires(Object):
     """Certificate transfer requirer class to be instantiated by charms expecting certificates."""
 
     on = CertificateTransferRequirerCharmEvents()  # type: ignore
+    _stored = StoredState()
 
     def __init__(
         self,
         charm: CharmBase,
         relationship_name: str,
+        track_changes: bool = False,
+        suppress_unchanged_events: bool = False,
+        metadata_cache: Optional[CertificateMetadataCache] = None,
+        metrics_callback: Optional[Callable[[HookMetrics], None]] = None,
+        databag_cache: Optional[DatabagCache] = None,
+        snapshot_directory: Optional[Union[str, "os.PathLike[str]"]] = None,
     ):
         """Observe events related to the relation.
 
+        When tracking changes, the certificates last delivered for each relation are kept
+        to compute the added and removed certificates of certificate_set_updated. By default
+        they are kept in the charm's stored state, which holds the full PEM strings of every
+        relation, about 5 MB per relation for a bundle of 3000 certificates, and is saved on
+        every change. With Juju-backed charm state, large bundles can exceed the size limit
+        of the controller and fail the hook: use `snapshot_directory` for them.
+
         Args:
             charm: Charm object
             relationship_name: Juju relation name
+            track_changes: Whether to report the certificates added and removed since the
+                last certificate_set_updated of the relation. They are None otherwise.
+            suppress_unchanged_events: Whether to skip emitting certificate_set_updated
+                when the certificate set of the relation did not change since the last
+                event, for example when relation-changed was triggered by unrelated keys.
+                Implies `track_changes`.
+            metadata_cache: Cache used by get_certificates_metadata, for example one
+                persisted to a file. Defaults to an in-memory cache.
+            metrics_callback: Called at the end of each hook with the metrics of every
+                relation handled during the hook.
+            databag_cache: Cache of the certificates parsed from provider databags, for
+                example one persisted to a file, which is then saved at the end of each
+                hook. Defaults to an in-memory cache.
+            snapshot_directory: Unit-local directory, for example in the charm directory,
+                in which the certificates last delivered for each relation are kept instead
+                of the stored state. Files are written at the end of successful hooks.
         """
         super().__init__(charm, relationship_name + "_v1")
         self.relationship_name = relationship_name
         self.charm = charm
+        self.track_changes = track_changes or suppress_unchanged_events
+        self.suppress_unchanged_events = suppress_unchanged_events
+        self.metadata_cache = (
+            metadata_cache if metadata_cache is not None else CertificateMetadataCache()
+        )
+        self.databag_cache = databag_cache if databag_cache is not None else DatabagCache()
+        self.snapshot_directory = (
+            os.fspath(snapshot_directory) if snapshot_directory is not None else None
+        )
+        # Snapshots to write to, or remove from, the snapshot directory at the end of the hook
+        self._pending_snapshots: Dict[int, Optional[List[str]]] = {}
+        self._parsed_shards: Dict[str, FrozenSet[str]] = {}
+        self._merged_units: Dict[
+            int, Tuple[tuple, AbstractSet[str], Dict[str, FrozenSet[str]]]
+        ] = {}
+        # Certificates of each parsed databag, shared by all relations
+        self._parsed_databags: Dict[Tuple[bool, str], AbstractSet[str]] = {}
+        # Digest of each databag read during the hook, with the items it was computed on
+        self._digests: Dict[Tuple[int, str], Tuple[tuple, str]] = {}
+        self._digests_by_shape: Dict[tuple, List[Tuple[tuple, str]]] = {}
+        # Certificates last delivered for each relation, keyed by relation ID, unless they
+        # are kept in the snapshot directory
+        self._stored.set_default(certificates={}, suppressed_events=0)
         self.framework.observe(
             charm.on[relationship_name].relation_changed, self._on_relation_changed
         )
@@ -576,6 +2458,21 @@ class CertificateTransferRequires(Object):
         self.framework.observe(
             charm.on[relationship_name].relation_created, self._on_relation_created
         )
+        self._instrumentation = _HookInstrumentation(metrics_callback)
+        if (
+            metrics_callback is not None
+            or self.databag_cache.path is not None
+            or self.snapshot_directory is not None
+        ):
+            self.framework.observe(self.framework.on.commit, self._on_commit)
+
+    @property
+    def suppressed_events(self) -> int:
+        """Number of certificate_set_updated events suppressed since the unit was deployed.
+
+        Only counts when suppress_unchanged_events is enabled.
+        """
+        return self._stored.suppressed_events
 
     def _on_relation_changed(self, event: RelationChangedEvent) -> None:
         """Emit certificate set updated event.
@@ -586,12 +2483,106 @@ class CertificateTransferRequires(Object):
         Returns:
             None
         """
+        if self.model.unit.is_leader():
+            # Relations created by an older version of the library don't advertise encodings
+            self._publish_requirer_data(event.relation)
         remote_unit_relation_data = self.get_all_certificates(event.relation.id)
+        if not self.track_changes:
+            # Forget the certificates kept while changes were tracked, if they were
+            self._stored.certificates.pop(str(event.relation.id), None)
+            self._instrumentation.add(event.relation.id, events_emitted=1)
+            self.on.certificate_set_updated.emit(
+                certificates=remote_unit_relation_data, relation_id=event.relation.id
+            )
+            return
+        current = _index_certificates(remote_unit_relation_data)
+        delivered = self._get_delivered_certificates(event.relation.id)
+        previous = _index_certificates(delivered or ())
+        added = {current[fingerprint] for fingerprint in current.keys() - previous.keys()}
+        removed = {previous[fingerprint] for fingerprint in previous.keys() - current.keys()}
+        if added or removed or delivered is None:
+            self._set_delivered_certificates(event.relation.id, sorted(remote_unit_relation_data))
+        elif self.suppress_unchanged_events:
+            self._stored.suppressed_events += 1
+            self._instrumentation.add(event.relation.id, events_suppressed=1)
+            logger.debug(
+                "Certificates unchanged in relation %d, not emitting certificate_set_updated",
+                event.relation.id,
+            )
+            return
+        self._instrumentation.add(
+            event.relation.id,
+            certificates_added=len(added),
+            certificates_removed=len(removed),
+            events_emitted=1,
+        )
         self.on.certificate_set_updated.emit(
             certificates=remote_unit_relation_data,
             relation_id=event.relation.id,
+            added=added,
+            removed=removed,
         )
 
+    def _on_commit(self, _: EventBase) -> None:
+        """Save the databag cache and snapshots, and report the metrics of the hook."""
+        self.databag_cache.save()
+        self._save_snapshots()
+        self._instrumentation.report()
+
+    def _snapshot_path(self, relation_id: int) -> str:
+        """Return the path of the snapshot of a relation in the snapshot directory."""
+        assert self.snapshot_directory is not None
+        return os.path.join(self.snapshot_directory, f"{relation_id}.json")
+
+    def _get_delivered_certificates(self, relation_id: int) -> Optional[List[str]]:
+        """Return the certificates last delivered for a relation, or None if none were.
+
+        Snapshots missing from the snapshot directory are read from the stored state,
+        where they were kept by earlier versions of the library.
+        """
+        if relation_id in self._pending_snapshots:
+            return self._pending_snapshots[relation_id]
+        if self.snapshot_directory is not None:
+            try:
+                with open(self._snapshot_path(relation_id)) as file:
+                    certificates = json.load(file)
+                if isinstance(certificates, list) and all(
+                    isinstance(certificate, str) for certificate in certificates
+                ):
+                    return certificates
+                logger.debug("Ignoring invalid snapshot of relation %d", relation_id)
+            except FileNotFoundError:
+                pass
+            except ValueError as e:
+                logger.debug("Ignoring invalid snapshot of relation %d: %s", relation_id, e)
+        return self._stored.certificates.get(str(relation_id))
+
+    def _set_delivered_certificates(
+        self, relation_id: int, certificates: Optional[List[str]]
+    ) -> None:
+        """Keep the certificates delivered for a relation, or forget them if None."""
+        if self.snapshot_directory is None:
+            if certificates is None:
+                self._stored.certificates.pop(str(relation_id), None)
+            else:
+                self._stored.certificates[str(relation_id)] = certificates
+            return
+        self._stored.certificates.pop(str(relation_id), None)
+        self._pending_snapshots[relation_id] = certificates
+
+    def _save_snapshots(self) -> None:
+        """Write the snapshots changed during the hook to the snapshot directory."""
+        for relation_id, certificates in self._pending_snapshots.items():
+            path = self._snapshot_path(relation_id)
+            if certificates is None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+            else:
+                _write_file_atomically(
+                    path, [json.dumps(certificates).encode()], 0o600, durable=False
+                )
+        self._pending_snapshots.clear()
+
     def _on_relation_broken(self, event: RelationBrokenEvent) -> None:
         """Handle relation broken event.
 
@@ -601,6 +2592,8 @@ class CertificateTransferRequires(Object):
         Returns:
             None
         """
+        self._set_delivered_certificates(event.relation.id, None)
+        self.databag_cache.remove_relation(event.relation.id)
         self.on.certificates_removed.emit(relation_id=event.relation.id)
 
     def _on_relation_created(self, event: RelationCreatedEvent) -> None:
@@ -615,14 +2608,33 @@ class CertificateTransferRequires(Object):
         if not self.model.unit.is_leader():
             logger.debug("Only leader unit sets the version number in the app databag")
             return
-        databag = event.relation.data[self.model.app]
-        RequirerApplicationData().dump(databag, False)
+        self._publish_requirer_data(event.relation)
+
+    def _publish_requirer_data(self, relation: Relation) -> None:
+        """Advertise the interface version, payload encodings and layouts of this requirer.
+
+        The databag is only written when the advertised encodings or layouts changed.
+        """
+        databag = relation.data[self.model.app]
+        data = _models().RequirerApplicationData(
+            encodings=list(_SUPPORTED_ENCODINGS), layouts=list(_SUPPORTED_LAYOUTS)
+        )
+        advertised = (databag.get("encodings"), databag.get("layouts"))
+        if advertised != (json.dumps(data.encodings), json.dumps(data.layouts)):
+            written = data.dump()
+            databag.update(written)
+            self._instrumentation.add(
+                relation.id,
+                databag_writes=len(written),
+                bytes_serialized=sum(len(value) for value in written.values()),
+            )
 
     def get_all_certificates(self, relation_id: Optional[int] = None) -> Set[str]:
         """Get transferred certificates.
 
         If no relation id is given, certificates from all relations will be
-        provided in a concatenated list.
+        provided in a concatenated list. Certificates are deduplicated on their PEM
+        contents; use aggregate_certificates to deduplicate them by canonical fingerprint.
 
         Args:
             relation_id: The id of the relation to get the certificates from.
@@ -630,10 +2642,72 @@ class CertificateTransferRequires(Object):
         relations = self._get_active_relations(relation_id)
         result = set()
         for relation in relations:
-            data = self._get_relation_data(relation)
-            result = result.union(data)
+            result.update(self._get_relation_data(relation))
         return result
 
+    def get_certificate_collection(
+        self, relation_id: Optional[int] = None
+    ) -> CertificateCollection:
+        """Get transferred certificates as a compact collection.
+
+        The collection stores each certificate once, as DER, and uses less memory than the
+        set of PEM strings returned by get_all_certificates, which matters for very large
+        trust bundles. Certificates are decoded from the databags straight into the
+        collection, one at a time, and are not kept for the rest of the hook. Relations with
+        the same databag contents are only merged once, and certificates already parsed
+        during the hook are reused.
+
+        Args:
+            relation_id: If provided, only certificates of this relation are returned.
+        """
+        collection = CertificateCollection()
+        merged: Set[str] = set()
+        for relation in self._get_active_relations(relation_id):
+            try:
+                self._collect_relation(relation, collection, merged)
+            except DataValidationError as e:
+                self._log_invalid_databag(e)
+        return collection
+
+    def aggregate_certificates(
+        self, relation_id: Optional[int] = None, with_relations: bool = False
+    ) -> CertificateAggregate:
+        """Aggregate the transferred certificates of all relations in a single pass.
+
+        Each relation is parsed once, and its certificates are merged in place,
+        deduplicated by canonical fingerprint so that the same certificate sent with
+        different line endings or wrapping is only returned once. Certificates are ordered
+        by relation ID, then by PEM within a relation, and the first PEM of each of them is
+        kept. Relations with the same databag contents are only merged once.
+
+        Unlike get_all_certificates, this fingerprints every certificate, which is slower
+        for large certificate sets seen for the first time in the hook.
+
+        Args:
+            relation_id: If provided, only certificates of this relation are returned.
+            with_relations: Whether to also return the IDs of the relations which sent each
+                certificate.
+        """
+        # Relations with the same databag contents share the same parsed certificates
+        groups: Dict[int, Tuple[AbstractSet[str], List[int]]] = {}
+        for relation in sorted(self._get_active_relations(relation_id), key=lambda r: r.id):
+            certificates = self._get_relation_data(relation)
+            groups.setdefault(id(certificates), (certificates, []))[1].append(relation.id)
+        index: Dict[str, str] = {}
+        relations: Dict[str, Set[int]] = {}
+        for certificates, relation_ids in groups.values():
+            for certificate in sorted(certificates):
+                fingerprint = _certificate_fingerprint(certificate)
+                index.setdefault(fingerprint, certificate)
+                if with_relations:
+                    relations.setdefault(fingerprint, set()).update(relation_ids)
+        if not with_relations:
+            return CertificateAggregate(list(index.values()))
+        return CertificateAggregate(
+            list(index.values()),
+            {index[fingerprint]: ids for fingerprint, ids in relations.items()},
+        )
+
     def get_all_certificates_by_relation(
         self, relation_id: Optional[int] = None
     ) -> Dict[int, List[str]]:
@@ -655,38 +2729,344 @@ class CertificateTransferRequires(Object):
             result[relation.id] = certificates
         return result
 
+    def get_certificate_sources(self, relation_id: Optional[int] = None) -> Dict[str, Set[str]]:
+        """Get the provider application or units which published each certificate.
+
+        Certificates of a v1 provider are published by its application. Certificates of a
+        v0 provider are published by each of its units, and are listed with the names of
+        all the units which published them.
+
+        Args:
+            relation_id: If provided, only certificates of this relation are returned.
+
+        Returns:
+            The names of the applications or units which published each certificate,
+            keyed by certificate.
+        """
+        result: Dict[str, Set[str]] = {}
+        for relation in self._get_active_relations(relation_id):
+            for certificate, sources in self._get_relation_sources(relation).items():
+                result.setdefault(certificate, set()).update(sources)
+        return result
+
+    def get_certificates_metadata(
+        self, relation_id: Optional[int] = None
+    ) -> Dict[str, CertificateMetadata]:
+        """Get the metadata of the transferred certificates.
+
+        Certificates are parsed once and their metadata cached by fingerprint in the
+        metadata cache, which is saved if it is persisted to a file. Certificates which
+        can't be parsed are left out.
+
+        Args:
+            relation_id: If provided, only certificates of this relation are returned.
+
+        Returns:
+            The metadata of each certificate, keyed by certificate.
+        """
+        result = {}
+        for certificate in self.get_all_certificates(relation_id):
+            metadata = self.metadata_cache.get(certificate)
+            if metadata is not None:
+                result[certificate] = metadata
+        self.metadata_cache.save()
+        return result
+
+    def write_ca_bundle(
+        self,
+        path: Union[str, "os.PathLike[str]"],
+        container: Optional[Container] = None,
+        relation_id: Optional[int] = None,
+        permissions: int = 0o644,
+    ) -> bool:
+        """Write the transferred certificates to a PEM bundle file.
+
+        The certificates are written in the deterministic order of `aggregate_certificates`:
+        by relation ID, then by PEM, leaving out certificates already written for a
+        previous relation. They are streamed to the file one at a time rather
+        than joined in memory.
+
+        On the local filesystem, the bundle is written to a temporary file which is flushed
+        to disk and atomically renamed over the bundle. In a container, it is pushed through
+        Pebble, which replaces the file atomically too. The write is skipped when the bundle
+        already has the same contents, so that services watching it are not reloaded.
+
+        Args:
+            path: Path of the bundle, in the container if one is given.
+            container: Container to write the bundle to, instead of the local filesystem.
+            relation_id: If provided, only certificates of this relation are written.
+            permissions: Permissions of the bundle file.
+
+        Returns:
+            Whether the bundle was written.
+        """
+        path = os.fspath(path)
+        certificates = self.aggregate_certificates(relation_id).certificates
+        digest = hashlib.sha256()
+        for chunk in _bundle_chunks(certificates):
+            digest.update(chunk)
+        if self._bundle_digest(path, container) == digest.hexdigest():
+            logger.debug("CA bundle %s unchanged, skipping write", path)
+            return False
+        if container is None:
+            _write_file_atomically(path, _bundle_chunks(certificates), permissions)
+        else:
+            source = cast(BinaryIO, io.BufferedReader(_ChunkReader(_bundle_chunks(certificates))))
+            container.push(path, source, make_dirs=True, permissions=permissions)
+        return True
+
+    @staticmethod
+    def _bundle_digest(path: str, container: Optional[Container]) -> Optional[str]:
+        """Return the digest of the current contents of a bundle, if it exists."""
+        try:
+            if container is None:
+                with open(path, "rb") as file:
+                    return _file_digest(file)
+            with container.pull(path, encoding=None) as file:
+                return _file_digest(file)
+        except (FileNotFoundError, PathError):
+            return None
+
+    def sync_hashed_directory(
+        self, writer: DirectoryWriter, relation_id: Optional[int] = None
+    ) -> Tuple[List[str], List[str]]:
+        """Sync a directory of certificates named by subject hash with the transferred ones.
+
+        The directory is laid out like the ones of OpenSSL's `c_rehash`, for services which
+        expect a CA directory rather than a bundle: each certificate is stored in a
+        `<subject hash>.<n>` file. As Pebble can't create symlinks, these are regular files.
+        The transferred certificates are the ground truth, and only the files whose
+        certificate changed are written or removed. Certificates which are not in PEM
+        format are skipped.
+
+        Args:
+            writer: Writer of the directory, a `LocalDirectoryWriter` for the local
+                filesystem or a `ContainerDirectoryWriter` for a Pebble container.
+            relation_id: If provided, only certificates of this relation are synced.
+
+        Returns:
+            The names of the files written and the names of the files removed.
+        """
+        return _sync_hashed_directory(writer, self.get_all_certificates(relation_id))
+
     def is_ready(self, relation: Relation) -> bool:
         """Check if the relation is ready by checking that it has valid relation data."""
-        databag = relation.data[relation.app]
         try:
-            ProviderApplicationData().load(databag)
+            self._load_certificates(relation, relation.app)
             return True
         except DataValidationError:
             return False
 
-    def _get_relation_data(self, relation: Relation) -> Set[str]:
-        """Get the given relation data."""
+    def _get_relation_data(self, relation: Relation, store: bool = True) -> AbstractSet[str]:
+        """Get the given relation data.
+
+        Parsed certificates are kept for the rest of the hook unless `store` is False.
+        """
+        return self._load_relation(relation, store)[0]
+
+    def _get_relation_sources(self, relation: Relation) -> Mapping[str, FrozenSet[str]]:
+        """Get the certificates of the given relation and the entities which published them."""
+        certificates, unit_sources = self._load_relation(relation)
+        if unit_sources is None:
+            return dict.fromkeys(certificates, frozenset({relation.app.name}))
+        return unit_sources
+
+    def _load_relation(
+        self, relation: Relation, store: bool = True
+    ) -> Tuple[AbstractSet[str], Optional[Mapping[str, FrozenSet[str]]]]:
+        """Load the certificates of the given relation.
+
+        The application databag of the provider is read first, and the v0 unit databags of
+        all the provider units when it holds no certificates.
+
+        Returns:
+            The certificates, and the names of the units which published each of them if
+            they were read from unit databags.
+        """
         try:
-            databag = relation.data[relation.app]
-            certificates = ProviderApplicationData().load(databag).certificates
-            if not certificates and relation.units:
-                databag = relation.data.get(relation.units.pop(), {})
-                certs = ProviderUnitDataV0.load(databag).chain
-                if certs is None:
-                    return set()
-                return set(certs)
-            return certificates
+            certificates = self._load_certificates(relation, relation.app, store)
+            if certificates:
+                return certificates, None
+            return self._merge_unit_certificates(relation, store)
         except DataValidationError as e:
-            logger.error(
-                (
-                    "Error parsing relation databag: %s. ",
-                    "Make sure not to interact with the databags "
-                    "except using the public methods in the provider library "
-                    "and use version V1.",
-                ),
-                e.args,
+            self._log_invalid_databag(e)
+            return frozenset(), {}
+
+    @staticmethod
+    def _log_invalid_databag(error: DataValidationError) -> None:
+        """Log that the databag of a relation is invalid."""
+        logger.error(
+            "Error parsing relation databag: %s. "
+            "Make sure not to interact with the databags "
+            "except using the public methods in the provider library "
+            "and use version V1.",
+            error,
+        )
+
+    def _collect_relation(
+        self, relation: Relation, collection: CertificateCollection, merged: Set[str]
+    ) -> None:
+        """Merge the certificates of the given relation into a collection.
+
+        Certificates of the application databag are decoded straight into the collection,
+        unless they were already parsed during the hook, and the v0 unit databags of all
+        the provider units are merged when it holds no certificates. The digests of the
+        application databags already merged are kept in `merged`, so that databags with
+        the same contents in several relations are only merged once.
+
+        Raises:
+            DataValidationError: If the application databag contents are invalid.
+        """
+        databag = relation.data.get(relation.app, {})
+        self._instrumentation.add(relation.id, databag_reads=1)
+        digest = self._get_databag_digest(relation, relation.app, databag)
+        if digest in merged:
+            return
+        certificates = self.databag_cache.get(relation.id, relation.app.name, digest)
+        if certificates is None:
+            certificates = self._parsed_databags.get((True, digest))
+        if certificates is None:
+            # Decode the relation into its own collection, so that nothing is merged when
+            # the databag is invalid
+            certificates = CertificateCollection()
+            with self._instrumentation.parsing(relation.id):
+                self._decode_application_databag(databag, certificates)
+        if not certificates:
+            collection.update(self._merge_unit_certificates(relation, store=False)[0])
+            return
+        collection.update(certificates)
+        merged.add(digest)
+
+    def _decode_application_databag(
+        self, databag: Mapping[str, str], collection: CertificateCollection
+    ) -> None:
+        """Decode the certificates of a v1 application databag into a collection.
+
+        Unlike `_parse_certificates`, the certificates are decoded one at a time, so that
+        they are never all held as PEM strings.
+
+        Raises:
+            DataValidationError: If the databag contents are invalid.
+        """
+        plain = databag.get("certificates")
+        # The other fields are small, and validated by the model
+        others = {key: value for key, value in databag.items() if key != "certificates"}
+        data = _models().ProviderApplicationData.load(others)
+        if data.manifest is not None:
+            collection.update(
+                _load_shards(databag, data.manifest, data.encoding, self._parsed_shards)
             )
-            return set()
+        elif data.encoding is not None:
+            for der in _iter_encoded_ders(data.encoding, data.compressed_certificates or ""):
+                collection._add_der(der)
+        if plain is not None:
+            # Plain certificates are only validated when the databag holds encoded ones
+            keep = data.manifest is None and data.encoding is None
+            for certificate in _iter_json_strings(plain):
+                if keep:
+                    collection.add(certificate)
+
+    def _merge_unit_certificates(
+        self, relation: Relation, store: bool = True
+    ) -> Tuple[AbstractSet[str], Dict[str, FrozenSet[str]]]:
+        """Merge the certificates of the v0 unit databags of all the provider units.
+
+        Certificates are deduplicated by fingerprint, keeping the PEM of the lowest-numbered
+        unit which published them. Units whose databag is invalid are skipped, so that one
+        misbehaving unit doesn't hide the certificates of the others. Unless `store` is
+        False, the merge is cached for the rest of the hook and only done again when one of
+        the unit databags changes.
+
+        Returns:
+            The certificates, and the names of the units which published each of them.
+        """
+        loaded = []
+        for unit in sorted(relation.units, key=_unit_number):
+            try:
+                loaded.append((unit.name, self._load_certificates(relation, unit, store)))
+            except DataValidationError as e:
+                logger.warning("Ignoring invalid v0 databag of unit %s: %s", unit.name, e)
+        key = tuple(loaded)
+        cached = self._merged_units.get(relation.id)
+        if cached and cached[0] == key:
+            return cached[1], cached[2]
+        merged: Dict[str, Tuple[str, Set[str]]] = {}
+        for unit_name, certificates in loaded:
+            for certificate in certificates:
+                fingerprint = _certificate_fingerprint(certificate)
+                merged.setdefault(fingerprint, (certificate, set()))[1].add(unit_name)
+        sources = {certificate: frozenset(units) for certificate, units in merged.values()}
+        result = frozenset(sources)
+        if store:
+            self._merged_units[relation.id] = (key, result, sources)
+        return result, sources
+
+    def _load_certificates(
+        self, relation: Relation, entity: Union[Application, Unit], store: bool = True
+    ) -> AbstractSet[str]:
+        """Load the certificates from the provider databag of the given application or unit.
+
+        The application databag is read as v1 and unit databags as v0. Parsed certificates
+        are kept in the databag cache, keyed by relation ID and a digest of the raw databag
+        contents, so they are only parsed again when the databag changes. Databags with the
+        same contents in several relations, and shards of sharded databags, are also cached
+        by digest for the rest of the hook, so they are only parsed once. When `store` is
+        False, the caches are only read.
+
+        Raises:
+            DataValidationError: If the databag contents are invalid.
+        """
+        databag = relation.data.get(entity, {})
+        self._instrumentation.add(relation.id, databag_reads=1)
+        digest = self._get_databag_digest(relation, entity, databag)
+        cached = self.databag_cache.get(relation.id, entity.name, digest)
+        if cached is not None:
+            return cached
+        # Databags with the same contents in other relations are only parsed once
+        key = (isinstance(entity, Application), digest)
+        certificates = self._parsed_databags.get(key)
+        if certificates is None:
+            with self._instrumentation.parsing(relation.id):
+                certificates = self._parse_certificates(databag, entity)
+            if store:
+                self._parsed_databags[key] = certificates
+        if store:
+            self.databag_cache.set(relation.id, entity.name, digest, certificates)
+        return certificates
+
+    def _get_databag_digest(
+        self, relation: Relation, entity: Union[Application, Unit], databag: Mapping[str, str]
+    ) -> str:
+        """Return the digest of a databag, only computed again when its contents change.
+
+        Unchanged databags hold the same value objects, which compare by identity.
+        """
+        items = tuple(databag.items())
+        cached = self._digests.get((relation.id, entity.name))
+        if cached is not None and cached[0] == items:
+            return cached[1]
+        # Databags with the same contents in other relations are only hashed once: comparing
+        # the values of databags with the same value lengths is much cheaper than hashing them
+        shape = tuple((key, len(value)) for key, value in items)
+        for other_items, digest in self._digests_by_shape.get(shape, ()):
+            if other_items == items:
+                break
+        else:
+            digest = _databag_digest(databag)
+            self._digests_by_shape.setdefault(shape, []).append((items, digest))
+        self._digests[(relation.id, entity.name)] = (items, digest)
+        return digest
+
+    def _parse_certificates(
+        self, databag: Mapping[str, str], entity: Union[Application, Unit]
+    ) -> AbstractSet[str]:
+        """Parse the certificates of a v1 application databag or a v0 unit databag."""
+        if isinstance(entity, Application):
+            data = _models().ProviderApplicationData.load(databag)
+            if data.manifest is not None:
+                return _load_shards(databag, data.manifest, data.encoding, self._parsed_shards)
+            return data.get_certificates()
+        return frozenset(_models().ProviderUnitDataV0.load(databag).chain or ())
 
     def _get_active_relations(self, relation_id: Optional[int] = None) -> List[Relation]:
         """Get the active relation if relation_id is given, all active relations otherwise."""
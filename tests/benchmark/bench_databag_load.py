@@ -0,0 +1,75 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmark loading v1 provider databags.
+
+Compares `DatabagModel.load`, which validates the decoded databag values directly,
+with the previous implementation, which encoded them back to JSON before validating.
+
+Run from the repository root:
+
+    PYTHONPATH=lib python tests/benchmark/bench_databag_load.py
+"""
+
+import argparse
+import json
+import timeit
+from typing import Callable, Dict, MutableMapping
+
+from charms.certificate_transfer_interface.v1.certificate_transfer import (
+    IS_PYDANTIC_V1,
+    ProviderApplicationData,
+)
+
+CERTIFICATE_COUNTS = (1, 100, 2000)
+
+
+def generate_certificate(index: int) -> str:
+    """Return a PEM-shaped string of realistic size, unique for the given index."""
+    body = f"{index:08d}".ljust(64, "A")
+    return "-----BEGIN CERTIFICATE-----\n" + f"{body}\n" * 20 + "-----END CERTIFICATE-----\n"
+
+
+def generate_databag(certificate_count: int) -> Dict[str, str]:
+    """Return a v1 provider application databag holding the given number of certificates."""
+    certificates = [generate_certificate(index) for index in range(certificate_count)]
+    return {"certificates": json.dumps(certificates), "version": "1"}
+
+
+def legacy_load(databag: MutableMapping):
+    """Load the databag the way `DatabagModel.load` did before the single-pass path."""
+    if IS_PYDANTIC_V1:
+        keys = {f.alias for f in ProviderApplicationData.__fields__.values()}
+        data = {k: json.loads(v) for k, v in databag.items() if k in keys}
+        return ProviderApplicationData.parse_raw(json.dumps(data))  # type: ignore
+    keys = {(f.alias or n) for n, f in ProviderApplicationData.model_fields.items()}
+    data = {k: json.loads(v) for k, v in databag.items() if k in keys}
+    return ProviderApplicationData.model_validate_json(json.dumps(data))
+
+
+def measure(function: Callable[[], object], repeat: int) -> float:
+    """Return the best time of a single call to the function, in seconds."""
+    number = 10
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timing runs")
+    args = parser.parse_args()
+
+    print(f"{'certificates':>12} {'legacy (ms)':>12} {'current (ms)':>13} {'speedup':>8}")
+    for certificate_count in CERTIFICATE_COUNTS:
+        databag = generate_databag(certificate_count)
+        assert legacy_load(databag) == ProviderApplicationData.load(databag)
+        legacy = measure(lambda: legacy_load(databag), args.repeat)
+        current = measure(lambda: ProviderApplicationData.load(databag), args.repeat)
+        print(
+            f"{certificate_count:>12} {legacy * 1000:>12.3f} {current * 1000:>13.3f} "
+            f"{legacy / current:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
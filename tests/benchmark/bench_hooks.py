@@ -0,0 +1,376 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmark hooks of charms using the certificate_transfer libraries.
+
+Drives provider and requirer charms of both library versions through `ops.testing`
+contexts, for a range of relation counts and certificate set sizes, and reports for
+each hook:
+
+- the wall time of the hook (median of several runs);
+- the peak memory allocated while the hook runs, as traced by tracemalloc;
+- the number of databag writes, as the local databag keys changed by the hook.
+
+The pydantic version in use is recorded with the results, run the `benchmark` and
+`benchmark-pydantic-v1` tox environments to cover both. Results can be written as JSON
+and compared between commits with `compare.py`.
+
+Run from the repository root:
+
+    PYTHONPATH=lib python tests/benchmark/bench_hooks.py --output results.json
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from importlib.metadata import version
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set
+
+import ops
+from charms.certificate_transfer_interface.v0 import certificate_transfer as v0
+from charms.certificate_transfer_interface.v1 import certificate_transfer as v1
+from ops import testing
+
+RELATION_COUNTS = (1, 10, 100, 1000)
+CERTIFICATE_COUNTS = (1, 100, 1000, 5000)
+ENDPOINT = "certificates"
+INTERFACE = "certificate_transfer"
+
+
+def generate_certificate(index: int) -> str:
+    """Return a PEM certificate of realistic size, unique for the given index."""
+    body = f"{index:08d}".ljust(64, "A")
+    return "-----BEGIN CERTIFICATE-----\n" + f"{body}\n" * 20 + "-----END CERTIFICATE-----\n"
+
+
+class V1ProviderCharm(ops.CharmBase):
+    """Provider charm rotating one certificate on update-status."""
+
+    added: Set[str] = set()
+    removed: Set[str] = set()
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.certificate_transfer = v1.CertificateTransferProvides(self, ENDPOINT)
+        framework.observe(self.on.update_status, self._on_update_status)
+
+    def _on_update_status(self, _: ops.EventBase):
+        self.certificate_transfer.apply_changes(add=self.added, remove=self.removed)
+
+
+class V1ShardedProviderCharm(V1ProviderCharm):
+    """Provider charm rotating one certificate on update-status, with the sharded layout."""
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.certificate_transfer.sharded = True
+
+
+class V1RequirerCharm(ops.CharmBase):
+    """Requirer charm reading all certificates on update-status."""
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.certificate_transfer = v1.CertificateTransferRequires(self, ENDPOINT)
+        framework.observe(self.certificate_transfer.on.certificate_set_updated, self._on_updated)
+        framework.observe(self.on.update_status, self._on_update_status)
+
+    def _on_updated(self, _: ops.EventBase):
+        pass
+
+    def _on_update_status(self, _: ops.EventBase):
+        self.certificate_transfer.get_all_certificates()
+
+
+class V0ProviderCharm(ops.CharmBase):
+    """Provider charm setting the certificate chain of every relation on update-status."""
+
+    chain: List[str] = []
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.certificate_transfer = v0.CertificateTransferProvides(self, ENDPOINT)
+        framework.observe(self.on.update_status, self._on_update_status)
+
+    def _on_update_status(self, _: ops.EventBase):
+        for relation in self.model.relations[ENDPOINT]:
+            self.certificate_transfer.set_certificate(
+                certificate=self.chain[0],
+                ca=self.chain[0],
+                chain=self.chain,
+                relation_id=relation.id,
+            )
+
+
+class V0RequirerCharm(ops.CharmBase):
+    """Requirer charm observing the certificate_available event."""
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.certificate_transfer = v0.CertificateTransferRequires(self, ENDPOINT)
+        framework.observe(
+            self.certificate_transfer.on.certificate_available, self._on_certificate_available
+        )
+
+    def _on_certificate_available(self, _: ops.EventBase):
+        pass
+
+
+class Case(NamedTuple):
+    """A hook to benchmark, built for a given relation count and certificate count."""
+
+    charm_type: type
+    role: str
+    per_relation: bool
+    """Whether the hook cost depends on the number of relations."""
+    build: Callable[[testing.Context, int, List[str]], Any]
+    """Return the event and the state to run it on."""
+
+
+def _v1_provider_rotation(requirer_version: str, sharded: bool = False):
+    def build(ctx: testing.Context, relation_count: int, certificates: List[str]):
+        V1ProviderCharm.added = {generate_certificate(len(certificates))}
+        V1ProviderCharm.removed = {certificates[0]}
+        remote_app_data = {"version": requirer_version}
+        if sharded:
+            remote_app_data["layouts"] = json.dumps(["sharded"])
+            databag = v1.CertificateTransferProvides._serialize_relation_data(
+                True, None, True, frozenset(certificates)
+            )
+            local_data = {"local_app_data": dict(databag or {})}
+        elif requirer_version == "1":
+            local_data = {"local_app_data": {"certificates": json.dumps(certificates)}}
+        else:
+            local_data = {
+                "local_unit_data": {
+                    "ca": json.dumps(certificates[0]),
+                    "certificate": json.dumps(certificates[0]),
+                    "chain": json.dumps(certificates),
+                }
+            }
+        relations = [
+            testing.Relation(
+                endpoint=ENDPOINT,
+                interface=INTERFACE,
+                remote_app_data=remote_app_data,
+                **local_data,
+            )
+            for _ in range(relation_count)
+        ]
+        return ctx.on.update_status(), testing.State(leader=True, relations=relations)
+
+    return build
+
+
+# Remote unit 0 is not recognised as explicitly passed by the consistency checker
+def _v1_requirer_relation_changed(
+    ctx: testing.Context, relation_count: int, certificates: List[str]
+):
+    relation = testing.Relation(
+        endpoint=ENDPOINT,
+        interface=INTERFACE,
+        local_app_data={"version": "1"},
+        remote_app_data={"certificates": json.dumps(certificates), "version": "1"},
+        remote_units_data={1: {}},
+    )
+    return ctx.on.relation_changed(relation, remote_unit=1), testing.State(relations=[relation])
+
+
+def _v1_requirer_get_all_certificates(
+    ctx: testing.Context, relation_count: int, certificates: List[str]
+):
+    relations = [
+        testing.Relation(
+            endpoint=ENDPOINT,
+            interface=INTERFACE,
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(certificates), "version": "1"},
+        )
+        for _ in range(relation_count)
+    ]
+    return ctx.on.update_status(), testing.State(relations=relations)
+
+
+def _v0_provider_set_certificate(
+    ctx: testing.Context, relation_count: int, certificates: List[str]
+):
+    V0ProviderCharm.chain = certificates
+    relations = [
+        testing.Relation(endpoint=ENDPOINT, interface=INTERFACE) for _ in range(relation_count)
+    ]
+    return ctx.on.update_status(), testing.State(leader=True, relations=relations)
+
+
+def _v0_requirer_relation_changed(
+    ctx: testing.Context, relation_count: int, certificates: List[str]
+):
+    relation = testing.Relation(
+        endpoint=ENDPOINT,
+        interface=INTERFACE,
+        remote_units_data={
+            1: {
+                "certificate": certificates[0],
+                "ca": certificates[0],
+                "chain": json.dumps(certificates),
+                "version": "0",
+            }
+        },
+    )
+    return ctx.on.relation_changed(relation, remote_unit=1), testing.State(relations=[relation])
+
+
+CASES = {
+    "v1-provider-rotation-v1-requirers": Case(
+        V1ProviderCharm, "provides", True, _v1_provider_rotation("1")
+    ),
+    "v1-provider-rotation-v0-requirers": Case(
+        V1ProviderCharm, "provides", True, _v1_provider_rotation("0")
+    ),
+    "v1-provider-rotation-sharded": Case(
+        V1ShardedProviderCharm, "provides", True, _v1_provider_rotation("1", sharded=True)
+    ),
+    "v1-requirer-relation-changed": Case(
+        V1RequirerCharm, "requires", False, _v1_requirer_relation_changed
+    ),
+    "v1-requirer-get-all-certificates": Case(
+        V1RequirerCharm, "requires", True, _v1_requirer_get_all_certificates
+    ),
+    "v0-provider-set-certificate": Case(
+        V0ProviderCharm, "provides", True, _v0_provider_set_certificate
+    ),
+    "v0-requirer-relation-changed": Case(
+        V0RequirerCharm, "requires", False, _v0_requirer_relation_changed
+    ),
+}
+
+
+def count_databag_writes(state_in: testing.State, state_out: testing.State) -> int:
+    """Return the number of local databag keys set or deleted between two states."""
+    writes = 0
+    for relation in state_in.relations:
+        relation_out = state_out.get_relation(relation.id)
+        for before, after in (
+            (relation.local_app_data, relation_out.local_app_data),
+            (relation.local_unit_data, relation_out.local_unit_data),
+        ):
+            writes += sum(
+                before.get(key) != after.get(key) for key in before.keys() | after.keys()
+            )
+    return writes
+
+
+def run_hook(case: Case, relation_count: int, certificates: List[str], trace: bool) -> Dict:
+    """Run the hook of a case once, returning its wall time, peak memory and write count."""
+    ctx = testing.Context(
+        charm_type=case.charm_type,
+        meta={"name": "benchmark", case.role: {ENDPOINT: {"interface": INTERFACE}}},
+    )
+    event, state = case.build(ctx, relation_count, certificates)
+    with ctx(event, state) as manager:
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        state_out = manager.run()
+        wall_time = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace else 0
+        tracemalloc.stop()
+    return {
+        "wall_time": wall_time,
+        "peak_memory": peak_memory,
+        "databag_writes": count_databag_writes(state, state_out),
+    }
+
+
+def run_case(case: Case, relation_count: int, certificate_count: int, repeat: int) -> Dict:
+    """Benchmark a case, returning the median wall time over several runs."""
+    certificates = [generate_certificate(index) for index in range(certificate_count)]
+    # Warm up, so that one-off costs like lazy imports are not counted
+    run_hook(case, relation_count, certificates[:1], trace=False)
+    runs = [run_hook(case, relation_count, certificates, trace=False) for _ in range(repeat)]
+    traced = run_hook(case, relation_count, certificates, trace=True)
+    return {
+        "wall_time_ms": statistics.median(run["wall_time"] for run in runs) * 1000,
+        "peak_memory_kib": traced["peak_memory"] / 1024,
+        "databag_writes": runs[0]["databag_writes"],
+    }
+
+
+def git_commit() -> Optional[str]:
+    """Return the commit being benchmarked, if running from a git checkout."""
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def metadata() -> Dict:
+    """Return the environment the benchmark ran in."""
+    return {
+        "commit": git_commit(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        **{package: version(package) for package in ("ops", "pydantic", "jsonschema")},
+    }
+
+
+def main() -> None:
+    """Run the benchmark and print or save the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="Path of the JSON file to write the results to")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per hook")
+    parser.add_argument(
+        "--cases", nargs="+", choices=sorted(CASES), default=sorted(CASES), help="Cases to run"
+    )
+    parser.add_argument("--relations", nargs="+", type=int, default=RELATION_COUNTS)
+    parser.add_argument("--certificates", nargs="+", type=int, default=CERTIFICATE_COUNTS)
+    parser.add_argument(
+        "--max-total-certificates",
+        type=int,
+        default=100_000,
+        help="Skip combinations holding more certificates than this across all relations",
+    )
+    args = parser.parse_args()
+
+    results = []
+    print(
+        f"{'case':<36} {'relations':>9} {'certificates':>12} {'wall (ms)':>10} "
+        f"{'peak (KiB)':>11} {'writes':>7}",
+        file=sys.stderr,
+    )
+    for name in args.cases:
+        case = CASES[name]
+        relation_counts = args.relations if case.per_relation else [1]
+        for relation_count in relation_counts:
+            for certificate_count in args.certificates:
+                if relation_count * certificate_count > args.max_total_certificates:
+                    continue
+                result = {
+                    "case": name,
+                    "relations": relation_count,
+                    "certificates": certificate_count,
+                    **run_case(case, relation_count, certificate_count, args.repeat),
+                }
+                results.append(result)
+                print(
+                    f"{name:<36} {relation_count:>9} {certificate_count:>12} "
+                    f"{result['wall_time_ms']:>10.1f} {result['peak_memory_kib']:>11.0f} "
+                    f"{result['databag_writes']:>7}",
+                    file=sys.stderr,
+                )
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"metadata": metadata(), "results": results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
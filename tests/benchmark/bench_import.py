@@ -0,0 +1,98 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmark the startup cost of the certificate_transfer libraries.
+
+Every Juju hook runs in a fresh Python process, so the libraries are imported on every
+dispatch. For each library version this measures, in fresh interpreters with `ops`
+already imported (as it is by any charm):
+
+- the time to import the library;
+- the time of the first use of its heavy dependencies (pydantic models for v1,
+  JSON schema validator for v0), which is only paid by hooks that touch the relation data;
+- the `python -X importtime` breakdown of the modules imported by both steps.
+
+Run from the repository root:
+
+    PYTHONPATH=lib python tests/benchmark/bench_import.py
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+LIBRARIES = {
+    "v0": (
+        "charms.certificate_transfer_interface.v0.certificate_transfer",
+        "_provider_validator()",
+    ),
+    "v1": (
+        "charms.certificate_transfer_interface.v1.certificate_transfer",
+        "_models()",
+    ),
+}
+
+MARKER = "-- ops imported --"
+
+SCRIPT = """
+import json, sys, time
+import ops
+sys.stderr.write("{marker}\\n")
+start = time.perf_counter()
+import {module} as lib
+imported = time.perf_counter()
+lib.{first_use}
+used = time.perf_counter()
+print(json.dumps([imported - start, used - imported]))
+"""
+
+
+def run(module: str, first_use: str, importtime: bool = False) -> Tuple[List[float], str]:
+    """Import the library and use it in a fresh interpreter, returning timings and stderr."""
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", SCRIPT.format(module=module, first_use=first_use, marker=MARKER)]
+    result = subprocess.run(
+        command, capture_output=True, text=True, check=True, env=dict(os.environ)
+    )
+    return json.loads(result.stdout), result.stderr
+
+
+def importtime_breakdown(stderr: str, top: int) -> List[Tuple[str, int]]:
+    """Return the modules with the highest cumulative import time, in microseconds."""
+    entries: Dict[str, int] = {}
+    # Only keep the modules imported after ops, i.e. by the library
+    for line in stderr.split(MARKER, 1)[-1].splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        entries[name.strip()] = int(cumulative)
+    return sorted(entries.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="Number of fresh interpreters")
+    parser.add_argument("--top", type=int, default=10, help="Number of modules to list")
+    args = parser.parse_args()
+
+    for version, (module, first_use) in LIBRARIES.items():
+        timings = [run(module, first_use)[0] for _ in range(args.runs)]
+        import_time = statistics.median(timing[0] for timing in timings)
+        first_use_time = statistics.median(timing[1] for timing in timings)
+        print(
+            f"{version}: import {import_time * 1000:.1f} ms, first use {first_use_time * 1000:.1f} ms"
+        )
+        _, stderr = run(module, first_use, importtime=True)
+        for name, cumulative in importtime_breakdown(stderr, args.top):
+            print(f"    {cumulative / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
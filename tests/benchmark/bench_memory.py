@@ -0,0 +1,136 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Benchmark the peak memory of aggregating large trust bundles in the v1 requirer.
+
+The bundle of CA certificates is either held by every relation, as with a CA hub
+providing its bundle to many requirers, or split across the relations. For each layout
+and relation count, this measures with `tracemalloc` the peak memory allocated while
+aggregating the certificates of all relations:
+
+- the legacy aggregation, which parsed each relation separately and built a new set with
+  `set.union` for each relation;
+- `get_all_certificates`, which parses databags with the same contents once and merges
+  the sets in place;
+- `get_certificate_collection`, which decodes the certificates straight into a collection
+  storing each of them once as DER.
+
+The returned certificates are kept alive while measuring, as a charm would do.
+
+Run from the repository root:
+
+    PYTHONPATH=lib python tests/benchmark/bench_memory.py
+"""
+
+import argparse
+import json
+import tracemalloc
+from typing import Any, Callable, Dict, List, Set
+
+import ops
+from charms.certificate_transfer_interface.v1.certificate_transfer import (
+    CertificateTransferRequires,
+    ProviderApplicationData,
+)
+from ops import testing
+
+ENDPOINT = "certificates"
+INTERFACE = "certificate_transfer"
+RELATION_COUNTS = (1, 5, 20)
+LAYOUTS = ("identical", "split")
+
+
+class RequirerCharm(ops.CharmBase):
+    """Charm using the v1 requirer."""
+
+    def __init__(self, framework: ops.Framework):
+        super().__init__(framework)
+        self.certificate_transfer = CertificateTransferRequires(self, ENDPOINT)
+
+
+def generate_certificate(index: int) -> str:
+    """Return a PEM certificate of realistic size, unique for the given index."""
+    body = f"{index:08d}".ljust(64, "A")
+    return "-----BEGIN CERTIFICATE-----\n" + f"{body}\n" * 20 + "-----END CERTIFICATE-----\n"
+
+
+def legacy_get_all_certificates(charm: RequirerCharm) -> Set[str]:
+    """Aggregate the certificates the way `get_all_certificates` did before."""
+    result: Set[str] = set()
+    for relation in charm.model.relations[ENDPOINT]:
+        data = ProviderApplicationData.load(relation.data[relation.app]).certificates
+        result = result.union(data)
+    return result
+
+
+def measure(charm: RequirerCharm, function: Callable[[RequirerCharm], Any]) -> float:
+    """Return the peak memory allocated by the function, in KiB."""
+    tracemalloc.start()
+    result = function(charm)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return peak / 1024
+
+
+def run(relation_count: int, certificates: List[str], layout: str) -> Dict[str, float]:
+    """Measure the peak memory of each aggregation, each in a fresh hook."""
+    functions: Dict[str, Callable[[RequirerCharm], Any]] = {
+        "legacy": legacy_get_all_certificates,
+        "get_all_certificates": lambda charm: charm.certificate_transfer.get_all_certificates(),
+        "get_certificate_collection": (
+            lambda charm: charm.certificate_transfer.get_certificate_collection()
+        ),
+    }
+    ctx = testing.Context(
+        charm_type=RequirerCharm,
+        meta={"name": "benchmark", "requires": {ENDPOINT: {"interface": INTERFACE}}},
+    )
+    if layout == "identical":
+        bundles = [certificates] * relation_count
+    else:
+        bundles = [certificates[index::relation_count] for index in range(relation_count)]
+    relations = [
+        testing.Relation(
+            endpoint=ENDPOINT,
+            interface=INTERFACE,
+            remote_app_data={"certificates": json.dumps(bundle), "version": "1"},
+        )
+        for bundle in bundles
+    ]
+    state = testing.State(relations=relations)
+    results = {}
+    for name, function in functions.items():
+        with ctx(ctx.on.update_status(), state) as manager:
+            # Load the relation data from the model backend before measuring
+            for relation in manager.charm.model.relations[ENDPOINT]:
+                dict(relation.data[relation.app])
+            results[name] = measure(manager.charm, function)
+    return results
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--certificates", type=int, default=5000, help="Number of certificates in the bundle"
+    )
+    args = parser.parse_args()
+
+    certificates = [generate_certificate(index) for index in range(args.certificates)]
+    print(
+        f"{'layout':<10} {'relations':>9} {'legacy (KiB)':>13} {'all (KiB)':>10} "
+        f"{'collection (KiB)':>17}"
+    )
+    for layout in LAYOUTS:
+        for relation_count in RELATION_COUNTS:
+            results = run(relation_count, certificates, layout)
+            print(
+                f"{layout:<10} {relation_count:>9} {results['legacy']:>13.0f} "
+                f"{results['get_all_certificates']:>10.0f} "
+                f"{results['get_certificate_collection']:>17.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
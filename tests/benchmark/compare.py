@@ -0,0 +1,78 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Compare two result files of `bench_hooks.py`.
+
+Prints, for every hook measured in both files, the ratio of the candidate results to the
+baseline results, and exits with a non-zero status when the candidate regresses:
+
+- the wall time or the peak memory grows by more than the threshold;
+- the number of databag writes grows at all.
+
+Run from the repository root:
+
+    python tests/benchmark/compare.py baseline.json candidate.json
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+Key = Tuple[str, int, int]
+
+
+def load(path: str) -> Dict[Key, Dict]:
+    """Return the results of a file, keyed by case, relation count and certificate count."""
+    with open(path) as results_file:
+        results = json.load(results_file)["results"]
+    return {
+        (result["case"], result["relations"], result["certificates"]): result for result in results
+    }
+
+
+def ratio(baseline: float, candidate: float) -> float:
+    """Return the candidate value relative to the baseline one."""
+    if baseline == 0:
+        return 1.0 if candidate == 0 else float("inf")
+    return candidate / baseline
+
+
+def main() -> None:
+    """Compare the result files and exit with status 1 on regressions."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", help="Results of the reference commit")
+    parser.add_argument("candidate", help="Results of the commit to check")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative growth of wall time or peak memory considered a regression",
+    )
+    args = parser.parse_args()
+
+    baseline = load(args.baseline)
+    candidate = load(args.candidate)
+    regressions = []
+    print(f"{'case':<36} {'relations':>9} {'certificates':>12} {'wall':>7} {'peak':>7} writes")
+    for key in sorted(baseline.keys() & candidate.keys()):
+        before, after = baseline[key], candidate[key]
+        wall = ratio(before["wall_time_ms"], after["wall_time_ms"])
+        peak = ratio(before["peak_memory_kib"], after["peak_memory_kib"])
+        writes = f"{before['databag_writes']} -> {after['databag_writes']}"
+        case, relations, certificates = key
+        print(f"{case:<36} {relations:>9} {certificates:>12} {wall:>6.2f}x {peak:>6.2f}x {writes}")
+        if wall > 1 + args.threshold:
+            regressions.append(f"{key}: wall time grew {wall:.2f}x")
+        if peak > 1 + args.threshold:
+            regressions.append(f"{key}: peak memory grew {peak:.2f}x")
+        if after["databag_writes"] > before["databag_writes"]:
+            regressions.append(f"{key}: databag writes grew from {writes}")
+
+    if regressions:
+        print("\nRegressions:", *regressions, sep="\n  ", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
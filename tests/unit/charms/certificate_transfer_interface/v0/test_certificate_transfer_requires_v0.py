@@ -4,6 +4,7 @@
 import json
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
 import pytest
 import yaml
@@ -12,6 +13,7 @@ from ops.testing import Context, JujuLogLine, Relation, State
 from lib.charms.certificate_transfer_interface.v0.certificate_transfer import (
     CertificateAvailableEvent,
     CertificateRemovedEvent,
+    _provider_validator,
 )
 from tests.unit.charms.certificate_transfer_interface.v0.dummy_requirer_charm.src.charm import (
     DummyCertificateTransferRequirerCharm,
@@ -191,3 +193,74 @@ class TestCertificateTransferRequiresV0(unittest.TestCase):
 
         assert self.ctx.action_results
         assert self.ctx.action_results["ready"]
+
+    def test_given_multiple_units_when_is_ready_twice_then_same_result_is_returned(self):
+        relation = Relation(
+            endpoint=ENDPOINT,
+            interface=INTERFACE,
+            remote_units_data={2: {"certificate": "whatever cert"}, 5: {"banana": "whatever"}},
+        )
+        state_in = State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            model_relation = manager.charm.model.get_relation(ENDPOINT, relation.id)
+            assert model_relation
+            certificate_transfer = manager.charm.certificate_transfer
+            results = [certificate_transfer.is_ready(model_relation) for _ in range(3)]
+            unit_count = len(model_relation.units)
+
+        assert results == [True, True, True]
+        assert unit_count == 2
+
+    def test_given_no_remote_units_when_is_ready_then_false_is_returned(self):
+        relation = Relation(endpoint=ENDPOINT, interface=INTERFACE, remote_units_data={})
+        state_in = State(leader=True, relations=[relation])
+
+        self.ctx.run(
+            self.ctx.on.action("is-ready", params={"relation-id": str(relation.id)}), state_in
+        )
+
+        assert self.ctx.action_results
+        assert not self.ctx.action_results["ready"]
+
+    def test_given_well_formed_relation_data_when_relation_changed_then_json_schema_validator_not_used(
+        self,
+    ):
+        key_values = {
+            "certificate": "whatever certificate",
+            "ca": "whatever CA certificate",
+            "chain": json.dumps(["cert1", "cert2"]),
+            "version": "0",
+        }
+        relation = Relation(
+            endpoint=ENDPOINT, interface=INTERFACE, remote_units_data={0: key_values}
+        )
+        state_in = State(leader=True, relations=[relation])
+
+        with patch(f"{BASE_LIB_DIR}._provider_validator") as patched_validator:
+            self.ctx.run(self.ctx.on.relation_changed(relation), state_in)
+
+        patched_validator.assert_not_called()
+        assert isinstance(self.ctx.emitted_events[-1], CertificateAvailableEvent)
+
+    def test_given_relation_data_not_well_formed_when_relation_changed_then_json_schema_validator_used(
+        self,
+    ):
+        key_values = {"certificate": "whatever certificate", "version": "0.0"}
+        relation = Relation(
+            endpoint=ENDPOINT, interface=INTERFACE, remote_units_data={0: key_values}
+        )
+        state_in = State(leader=True, relations=[relation])
+
+        with patch(
+            f"{BASE_LIB_DIR}._provider_validator", wraps=_provider_validator
+        ) as patched_validator:
+            self.ctx.run(self.ctx.on.relation_changed(relation), state_in)
+
+        patched_validator.assert_called_once()
+        assert isinstance(self.ctx.emitted_events[-1], CertificateAvailableEvent)
+
+    def test_given_validator_already_built_when_provider_validator_then_same_validator_returned(
+        self,
+    ):
+        assert _provider_validator() is _provider_validator()
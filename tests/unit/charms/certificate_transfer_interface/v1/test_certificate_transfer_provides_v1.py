@@ -1,17 +1,74 @@
 # Copyright 2024 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import datetime
 import json
-from typing import Any
+from pathlib import Path
+from typing import Any, List
+from unittest.mock import patch
 
 import pytest
 import scenario
 from ops.charm import ActionEvent, CharmBase
 
 from lib.charms.certificate_transfer_interface.v1.certificate_transfer import (
+    CertificateMetadataCache,
     CertificateTransferProvides,
+    HookMetrics,
+    ProviderApplicationData,
+    StalePlanError,
+    _decode_certificates,
 )
 
+CERTIFICATE = """-----BEGIN CERTIFICATE-----
+AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8gISIjJCUmJygpKissLS4v
+MDEyMzQ1Njc4OTo7PD0+P0BBQkNERUZHSElKS0xNTk9QUVJTVFVWV1hZWltcXV5f
+YGFiY2RlZmdoaWprbG1ub3BxcnN0dXZ3
+-----END CERTIFICATE-----
+"""
+
+# Self-signed CA, expires on 2036-10-15 09:28:23 UTC
+ROOT_CA_CERTIFICATE = """-----BEGIN CERTIFICATE-----
+MIICYDCCAcmgAwIBAgIUdf9TeXuZfX+VSnxdBu04Uu4qMLkwDQYJKoZIhvcNAQEL
+BQAwQjELMAkGA1UEBhMCR0IxGzAZBgNVBAoMEiAgQ2Fub25pY2FsICAgTHRkIDEW
+MBQGA1UEAwwNVGVzdCAgUm9vdCBDQTAeFw0yNjEwMTgwOTI4MjNaFw0zNjEwMTUw
+OTI4MjNaMEIxCzAJBgNVBAYTAkdCMRswGQYDVQQKDBIgIENhbm9uaWNhbCAgIEx0
+ZCAxFjAUBgNVBAMMDVRlc3QgIFJvb3QgQ0EwgZ8wDQYJKoZIhvcNAQEBBQADgY0A
+MIGJAoGBAMr+v2UsLLShwR3nQ0pwW2J5m8TpW6nAEqO+FjTE+K3GH+kxvSeucdEJ
+mXIln7pPzGxYhJeFJlz9bAmhKmQVl05X12FPaEuoSfzJfkdU5dt3sybPo67bUjnI
+6XugzpReLp5nUSyh+DHIYUd29ZtQnEOiDfq1BytMCTB3hvJDxSupAgMBAAGjUzBR
+MB0GA1UdDgQWBBRm9eRuiKImonnk+MWGjGjhpORidzAfBgNVHSMEGDAWgBRm9eRu
+iKImonnk+MWGjGjhpORidzAPBgNVHRMBAf8EBTADAQH/MA0GCSqGSIb3DQEBCwUA
+A4GBAFAbfYC+I4lw000Tapnys+EjhVfe9KFlng3dDmJdVoxBeg2EiSG+mUZ98D0d
+/9kf42t536zca6iKsK1OZEfh9Ukx5m5QWrm4w11g8SnT2sSem/2bEBQDvycVhvvN
+abGZbnfuPzckmhkqZ0Y9AT8gVYa6H2llj95RR5F6ZkLhZY0o
+-----END CERTIFICATE-----
+"""
+
+# Issued by ROOT_CA_CERTIFICATE, expired on 2021-01-01 00:00:00 UTC
+EXPIRED_CERTIFICATE = """-----BEGIN CERTIFICATE-----
+MIIBzzCCATgCAQEwDQYJKoZIhvcNAQELBQAwQjELMAkGA1UEBhMCR0IxGzAZBgNV
+BAoMEiAgQ2Fub25pY2FsICAgTHRkIDEWMBQGA1UEAwwNVGVzdCAgUm9vdCBDQTAe
+Fw0yMDAxMDEwMDAwMDBaFw0yMTAxMDEwMDAwMDBaMB4xHDAaBgNVBAMME2V4cGly
+ZWQuZXhhbXBsZS5jb20wgZ8wDQYJKoZIhvcNAQEBBQADgY0AMIGJAoGBALLh9BfM
+y/kYqUxCzClNvN5LAIOO6NCnvRnAFJH5QIN4KiWElAz0DqibsWpyUjmEwwhYwP9V
+hd92rHYylx5bWyPBLyWtDqN2EgrYD8ibeFCEIWgDWby5Peri4TpMdZ9wBnjIkP1Y
+HHZovP6CTowOm1tosuW0qE3dQDPZsPrSvVJxAgMBAAEwDQYJKoZIhvcNAQELBQAD
+gYEAiLd0ptE7AR3HuLshaoV+ovoKlKsjhHcw3DvL1qb/KXeRug2uGfJP0nDV6qHd
+yduOFoX46MvYkW1z7DeaREHdlD6cSacTlicr6h+LE52kUJ10DrXBgK5baHPljSep
+zjsotNPkhXk1oDgNo6LVhvBr57pfoPPn7g29JY6iCQ92WZI=
+-----END CERTIFICATE-----
+"""
+
+
+# Basic certificate whose only extension is an empty SEQUENCE
+MALFORMED_EXTENSION_CERTIFICATE = """-----BEGIN CERTIFICATE-----
+MIGHMHOgAwIBAgIBATANBgkqhkiG9w0BAQsFADAPMQ0wCwYDVQQDDARUZXN0MB4X
+DTI2MDEwMTAwMDAwMFoXDTM2MDEwMTAwMDAwMFowDzENMAsGA1UEAwwEVGVzdDAS
+MA0GCSqGSIb3DQEBCwUAAwEAowQwAjAAMA0GCSqGSIb3DQEBCwUAAwEA
+-----END CERTIFICATE-----
+"""
+
 
 class DummyCertificateTransferProviderCharm(CharmBase):
     def __init__(self, *args: Any):
@@ -49,6 +106,53 @@ class DummyCertificateTransferProviderCharm(CharmBase):
         )
 
 
+class DummyCompressingProviderCharm(CharmBase):
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferProvides(
+            self, "certificate_transfer", compressed=True
+        )
+
+
+class DummyShardedProviderCharm(CharmBase):
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferProvides(
+            self, "certificate_transfer", sharded=True
+        )
+
+
+class DummyPruningProviderCharm(CharmBase):
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferProvides(
+            self, "certificate_transfer", prune_expired_certificates=True
+        )
+
+
+class DummyPersistentPruningProviderCharm(CharmBase):
+    metadata_cache_path = ""
+
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferProvides(
+            self,
+            "certificate_transfer",
+            prune_expired_certificates=True,
+            metadata_cache=CertificateMetadataCache(path=self.metadata_cache_path),
+        )
+
+
+class DummyInstrumentedProviderCharm(CharmBase):
+    metrics: List[HookMetrics] = []
+
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferProvides(
+            self, "certificate_transfer", metrics_callback=self.metrics.append
+        )
+
+
 class TestCertificateTransferProvidesV1:
     @pytest.fixture(autouse=True)
     def context(self):
@@ -127,15 +231,15 @@ class TestCertificateTransferProvidesV1:
         [
             (
                 '"some string"',
-                """('Error parsing relation databag: ('failed to validate databag: \
-{\\'certificates\\': \\'"some string"\\'}',). ', 'Make sure not to interact with the\
- databags except using the public methods in the provider library and use version V1.')""",
+                """Error parsing relation databag: failed to validate databag: \
+{'certificates': '"some string"'}. Make sure not to interact with the databags except using \
+the public methods in the provider library and use version V1.""",
             ),
             (
                 "unloadable",
-                """('Error parsing relation databag: ("invalid databag contents: \
-expecting json. {'certificates': 'unloadable'}",). ', 'Make sure not to interact with \
-the databags except using the public methods in the provider library and use version V1.')""",
+                """Error parsing relation databag: invalid databag contents: \
+expecting json. {'certificates': 'unloadable'}. Make sure not to interact with the databags \
+except using the public methods in the provider library and use version V1.""",
             ),
         ],
     )
@@ -294,13 +398,11 @@ the databags except using the public methods in the provider library and use ver
         assert len(relation_3_databag) == 2
         assert relation_3_databag == {"certificate1", "certificate2"}
         logs = [(record.levelname, record.module, record.message) for record in caplog.records]
-        expected_msg = str(
-            (
-                f"Requirer in relation {relation_3.id} is using version 0 of the interface,",
-                "defaulting to version 0.",
-                "This is deprecated, please consider upgrading the requirer",
-                "to version 1 of the library.",
-            )
+        expected_msg = (
+            f"Requirer in relation {relation_3.id} is using version 0 of the interface, "
+            "defaulting to version 0. "
+            "This is deprecated, please consider upgrading the requirer "
+            "to version 1 of the library."
         )
         assert (
             "WARNING",
@@ -347,13 +449,11 @@ the databags except using the public methods in the provider library and use ver
         assert len(relation_3_databag) == 2
         assert relation_3_databag == {"certificate1", "certificate2"}
         logs = [(record.levelname, record.module, record.message) for record in caplog.records]
-        expected_msg = str(
-            (
-                f"Requirer in relation {relation_3.id} did not provide version field,",
-                "defaulting to version 0.",
-                "This is deprecated, please consider upgrading the requirer",
-                "to version 1 of the library.",
-            )
+        expected_msg = (
+            f"Requirer in relation {relation_3.id} did not provide version field, "
+            "defaulting to version 0. "
+            "This is deprecated, please consider upgrading the requirer "
+            "to version 1 of the library."
         )
         assert (
             "WARNING",
@@ -722,3 +822,745 @@ the databags except using the public methods in the provider library and use ver
             "certificate1",
             "certificate2",
         }
+
+    def test_given_multiple_relations_when_apply_changes_then_additions_and_removals_applied_to_all_relations(
+        self,
+    ):
+        relation_1 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps(["certificate1", "certificate2"])},
+        )
+        relation_2 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "0"},
+            local_unit_data={
+                "certificate": json.dumps("certificate1"),
+                "ca": json.dumps("certificate1"),
+                "chain": json.dumps(["certificate1", "certificate2"]),
+                "version": json.dumps(0),
+            },
+        )
+        state_in = scenario.State(leader=True, relations=[relation_1, relation_2])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.apply_changes(
+                add={"certificate3", "certificate4"},
+                remove={"certificate1", "certificate4"},
+            )
+            state_out = manager.run()
+
+        certificates_relation_1 = state_out.get_relation(relation_1.id).local_app_data[
+            "certificates"
+        ]
+        certificates_relation_2 = state_out.get_relation(relation_2.id).local_unit_data["chain"]
+        expected = {"certificate2", "certificate3", "certificate4"}
+        assert set(json.loads(certificates_relation_1)) == expected
+        assert set(json.loads(certificates_relation_2)) == expected
+
+    def test_given_multiple_relations_with_same_certificates_when_apply_changes_then_certificates_serialized_once(
+        self,
+    ):
+        relations = [
+            scenario.Relation(
+                endpoint="certificate_transfer",
+                interface="certificate_transfer",
+                remote_app_data={"version": "1"},
+                local_app_data={"certificates": json.dumps(["certificate1"])},
+            )
+            for _ in range(3)
+        ]
+        state_in = scenario.State(leader=True, relations=relations)
+
+        with patch.object(
+            ProviderApplicationData,
+            "dump",
+            autospec=True,
+            side_effect=ProviderApplicationData.dump,
+        ) as mock_dump:
+            with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+                manager.charm.certificate_transfer.apply_changes(
+                    add={"certificate2"}, remove_all=True
+                )
+                state_out = manager.run()
+
+        assert mock_dump.call_count == 1
+        for relation in relations:
+            certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+            assert set(json.loads(certificates)) == {"certificate2"}
+
+    def test_given_unrelated_relation_ids_when_apply_changes_then_error_is_logged(
+        self, caplog: pytest.LogCaptureFixture
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer", interface="certificate_transfer"
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.apply_changes(
+                add={"certificate"}, relation_ids=[relation.id + 1]
+            )
+            state_out = manager.run()
+
+        assert state_out.get_relation(relation.id).local_app_data == {}
+        logs = [(record.levelname, record.module, record.message) for record in caplog.records]
+        assert (
+            "DEBUG",
+            "certificate_transfer",
+            "At least 1 matching relation ID not found with the relation name 'certificate_transfer'",
+        ) in logs
+
+    def test_given_certificates_already_in_relation_data_when_add_certificates_then_write_is_skipped(
+        self,
+    ):
+        relation_1 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps(["certificate1"]), "version": "1"},
+        )
+        relation_2 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation_1, relation_2])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates({"certificate1"})
+            skipped_writes = manager.charm.certificate_transfer.skipped_writes
+            state_out = manager.run()
+
+        assert skipped_writes == 1
+        assert state_out.get_relation(relation_1.id).local_app_data == {
+            "certificates": json.dumps(["certificate1"]),
+            "version": "1",
+        }
+        assert state_out.get_relation(relation_2.id).local_app_data == {
+            "certificates": json.dumps(["certificate1"]),
+            "version": "1",
+        }
+
+    def test_given_certificate_with_different_encoding_in_relation_data_when_remove_certificate_then_certificate_removed(
+        self,
+    ):
+        reencoded_certificate = CERTIFICATE.replace("\n", "\r\n").rstrip() + "  "
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps([CERTIFICATE, "certificate2"])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.remove_certificate(reencoded_certificate)
+            state_out = manager.run()
+
+        certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert json.loads(certificates) == ["certificate2"]
+
+    def test_given_certificate_with_different_encoding_in_relation_data_when_add_certificates_then_certificate_not_duplicated(
+        self,
+    ):
+        reencoded_certificate = CERTIFICATE.replace("\n", "\r\n")
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps([CERTIFICATE])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates({reencoded_certificate})
+            state_out = manager.run()
+
+        certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert json.loads(certificates) == [CERTIFICATE]
+
+    def test_given_chain_holding_certificate_in_relation_data_when_add_certificate_then_certificate_is_added(
+        self,
+    ):
+        chain = CERTIFICATE + ROOT_CA_CERTIFICATE
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps([chain])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates({CERTIFICATE})
+            state_out = manager.run()
+
+        certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert json.loads(certificates) == [CERTIFICATE, chain]
+
+    def test_given_chain_holding_certificate_in_relation_data_when_remove_certificate_then_chain_is_kept(
+        self,
+    ):
+        chain = CERTIFICATE + ROOT_CA_CERTIFICATE
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps([CERTIFICATE, chain])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.remove_certificate(CERTIFICATE)
+            state_out = manager.run()
+
+        certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert json.loads(certificates) == [chain]
+
+    def test_given_compressing_provider_and_requirer_supports_zlib_der_encoding_when_add_certificates_then_certificates_are_compressed(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyCompressingProviderCharm,
+            meta={
+                "name": "certificate-transfer-provider",
+                "provides": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1", "encodings": json.dumps(["zlib-der"])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates({CERTIFICATE})
+            state_out = manager.run()
+
+        local_app_data = state_out.get_relation(relation.id).local_app_data
+        assert local_app_data["encoding"] == json.dumps("zlib-der")
+        assert json.loads(local_app_data["certificates"]) == []
+        compressed_certificates = json.loads(local_app_data["compressed_certificates"])
+        assert _decode_certificates("zlib-der", compressed_certificates) == {CERTIFICATE}
+
+    def test_given_requirer_supports_zlib_der_encoding_when_add_certificates_then_certificates_are_sent_as_plain_text(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1", "encodings": json.dumps(["zlib-der"])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates({CERTIFICATE})
+            state_out = manager.run()
+
+        local_app_data = state_out.get_relation(relation.id).local_app_data
+        assert "encoding" not in local_app_data
+        assert json.loads(local_app_data["certificates"]) == [CERTIFICATE]
+
+    def test_given_compressing_provider_and_requirer_supports_zlib_der_encoding_and_certificate_not_in_pem_format_when_add_certificates_then_certificates_are_sent_as_plain_text(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyCompressingProviderCharm,
+            meta={
+                "name": "certificate-transfer-provider",
+                "provides": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1", "encodings": json.dumps(["zlib-der"])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates({CERTIFICATE, "certificate2"})
+            state_out = manager.run()
+
+        local_app_data = state_out.get_relation(relation.id).local_app_data
+        assert "encoding" not in local_app_data
+        assert set(json.loads(local_app_data["certificates"])) == {CERTIFICATE, "certificate2"}
+
+    def test_given_sharded_provider_and_requirer_supports_sharded_layout_when_remove_certificate_then_only_its_shard_and_manifest_change(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyShardedProviderCharm,
+            meta={
+                "name": "certificate-transfer-provider",
+                "provides": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        certificates = {f"certificate{index}" for index in range(20)}
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1", "layouts": json.dumps(["sharded"])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates(certificates)
+            state_out = manager.run()
+        databag_before = dict(state_out.get_relation(relation.id).local_app_data)
+
+        with ctx(ctx.on.update_status(), state_out) as manager:
+            manager.charm.certificate_transfer.remove_certificate("certificate0")
+            state_out = manager.run()
+        databag_after = dict(state_out.get_relation(relation.id).local_app_data)
+
+        manifest = json.loads(databag_before["manifest"])
+        assert len(manifest) > 1
+        assert json.loads(databag_before["certificates"]) == []
+        shard = next(key for key in manifest if "certificate0" in json.loads(databag_before[key]))
+        changed_keys = {
+            key
+            for key in databag_before.keys() | databag_after.keys()
+            if databag_before.get(key) != databag_after.get(key)
+        }
+        assert changed_keys == {"manifest", shard}
+        assert "certificate0" not in json.loads(databag_after.get(shard, "[]"))
+
+    def test_given_sharded_provider_and_requirer_does_not_support_sharded_layout_when_add_certificates_then_certificates_are_not_sharded(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyShardedProviderCharm,
+            meta={
+                "name": "certificate-transfer-provider",
+                "provides": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates({"certificate1"})
+            state_out = manager.run()
+
+        assert state_out.get_relation(relation.id).local_app_data == {
+            "certificates": json.dumps(["certificate1"]),
+            "version": "1",
+        }
+
+    def test_given_prune_expired_certificates_when_add_certificates_then_expired_certificates_are_not_added(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyPruningProviderCharm,
+            meta={
+                "name": "certificate-transfer-provider",
+                "provides": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates(
+                {ROOT_CA_CERTIFICATE, EXPIRED_CERTIFICATE}
+            )
+            state_out = manager.run()
+
+        certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert json.loads(certificates) == [ROOT_CA_CERTIFICATE]
+
+    def test_given_expired_certificates_in_relation_data_when_prune_expired_then_expired_certificates_are_removed(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={
+                "certificates": json.dumps(
+                    [ROOT_CA_CERTIFICATE, EXPIRED_CERTIFICATE, "certificate1"]
+                ),
+            },
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            pruned = manager.charm.certificate_transfer.prune_expired()
+            state_out = manager.run()
+
+        assert pruned == {EXPIRED_CERTIFICATE}
+        certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert set(json.loads(certificates)) == {ROOT_CA_CERTIFICATE, "certificate1"}
+
+    def test_given_prune_expired_certificates_and_malformed_certificate_when_add_certificates_then_malformed_certificate_is_kept(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyPruningProviderCharm,
+            meta={
+                "name": "certificate-transfer-provider",
+                "provides": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates(
+                {MALFORMED_EXTENSION_CERTIFICATE, EXPIRED_CERTIFICATE}
+            )
+            pruned = manager.charm.certificate_transfer.prune_expired()
+            state_out = manager.run()
+
+        assert pruned == set()
+        certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert json.loads(certificates) == [MALFORMED_EXTENSION_CERTIFICATE]
+
+    def test_given_certificates_in_relation_data_when_next_expiry_then_earliest_future_expiry_is_returned(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={
+                "certificates": json.dumps([ROOT_CA_CERTIFICATE, EXPIRED_CERTIFICATE]),
+            },
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            next_expiry = manager.charm.certificate_transfer.next_expiry()
+
+        assert next_expiry == datetime.datetime(
+            2036, 10, 15, 9, 28, 23, tzinfo=datetime.timezone.utc
+        )
+
+    def test_given_metrics_callback_when_add_certificates_then_metrics_are_reported_on_commit(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(DummyInstrumentedProviderCharm, "metrics", [])
+        ctx = scenario.Context(
+            charm_type=DummyInstrumentedProviderCharm,
+            meta={
+                "name": "certificate-transfer-provider",
+                "provides": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps(["certificate1", "certificate2"])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            certificate_transfer.add_certificates({"certificate3"})
+            certificate_transfer.remove_certificate("certificate1")
+            assert DummyInstrumentedProviderCharm.metrics == []
+            state_out = manager.run()
+
+        [metrics] = DummyInstrumentedProviderCharm.metrics
+        payload = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert metrics.relation_id == relation.id
+        assert metrics.databag_reads == 2
+        assert metrics.databag_writes == 3
+        assert metrics.bytes_serialized > len(payload)
+        assert metrics.parse_time > 0
+        assert metrics.certificates_added == 1
+        assert metrics.certificates_removed == 1
+        assert metrics.events_emitted == metrics.events_suppressed == 0
+
+    def test_given_no_metrics_callback_when_add_certificates_then_nothing_is_measured(self):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            with patch(
+                "lib.charms.certificate_transfer_interface.v1.certificate_transfer.time.perf_counter"
+            ) as mock_perf_counter:
+                manager.charm.certificate_transfer.add_certificates({"certificate1"})
+
+        mock_perf_counter.assert_not_called()
+
+    def test_given_v0_and_v1_requirers_when_plan_changes_then_plan_is_returned_without_writing(
+        self,
+    ):
+        relation_v1 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps(["certificate1"]), "version": "1"},
+        )
+        relation_v0 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+        )
+        state_in = scenario.State(leader=True, relations=[relation_v1, relation_v0])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            plan = manager.charm.certificate_transfer.plan_changes(
+                add={"certificate2"}, remove={"certificate1"}
+            )
+            state_out = manager.run()
+
+        assert state_out.get_relation(relation_v1.id).local_app_data == {
+            "certificates": json.dumps(["certificate1"]),
+            "version": "1",
+        }
+        assert state_out.get_relation(relation_v0.id).local_unit_data == (
+            relation_v0.local_unit_data
+        )
+        change_v1, change_v0 = sorted(
+            plan.changes, key=lambda change: change.version, reverse=True
+        )
+        assert change_v1.relation_id == relation_v1.id
+        assert change_v1.added == {"certificate2"}
+        assert change_v1.removed == {"certificate1"}
+        assert change_v1.changed_keys == {"certificates"}
+        assert change_v1.bytes_written == len(json.dumps(["certificate2"]))
+        assert change_v0.relation_id == relation_v0.id
+        assert change_v0.version == 0
+        assert change_v0.added == {"certificate2"}
+        assert change_v0.removed == frozenset()
+        assert {"ca", "certificate", "chain", "version"} <= change_v0.changed_keys
+        assert change_v0.payload_size == change_v0.bytes_written
+        assert sorted(plan.changed_relations) == sorted([relation_v1.id, relation_v0.id])
+        assert plan.bytes_written == change_v1.bytes_written + change_v0.bytes_written
+
+    def test_given_plan_when_apply_plan_then_relation_data_is_written_without_parsing_again(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps(["certificate1"]), "version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            plan = certificate_transfer.plan_changes(add={"certificate2"})
+            with patch.object(
+                ProviderApplicationData, "load", side_effect=AssertionError
+            ) as mock_load:
+                certificate_transfer.apply_plan(plan)
+            state_out = manager.run()
+
+        mock_load.assert_not_called()
+        certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert set(json.loads(certificates)) == {"certificate1", "certificate2"}
+
+    def test_given_relation_data_changed_after_plan_when_apply_plan_then_stale_plan_error_is_raised(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps(["certificate1"]), "version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            plan = certificate_transfer.plan_changes(add={"certificate2"})
+            certificate_transfer.add_certificates({"certificate3"})
+            with pytest.raises(StalePlanError):
+                certificate_transfer.apply_plan(plan)
+            state_out = manager.run()
+
+        certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+        assert set(json.loads(certificates)) == {"certificate1", "certificate3"}
+
+    def test_given_certificates_already_in_relation_data_when_plan_changes_then_no_relation_is_changed(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+            local_app_data={"certificates": json.dumps(["certificate1"]), "version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            plan = certificate_transfer.plan_changes(add={"certificate1"})
+            certificate_transfer.apply_plan(plan)
+            skipped_writes = certificate_transfer.skipped_writes
+
+        [change] = plan.changes
+        assert change.changed_keys == frozenset()
+        assert plan.changed_relations == []
+        assert plan.bytes_written == 0
+        assert skipped_writes == 1
+
+    def test_given_non_leader_when_plan_changes_then_plan_is_empty(self):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+        )
+        state_in = scenario.State(leader=False, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            plan = manager.charm.certificate_transfer.plan_changes(add={"certificate1"})
+
+        assert plan.changes == []
+        assert plan.expired == frozenset()
+
+    def test_given_relations_with_same_certificates_when_add_certificates_then_databags_are_parsed_and_serialized_once(
+        self,
+    ):
+        relations = [
+            scenario.Relation(
+                endpoint="certificate_transfer",
+                interface="certificate_transfer",
+                remote_app_data={"version": "1"},
+                local_app_data={"certificates": json.dumps(["certificate1"]), "version": "1"},
+            )
+            for _ in range(5)
+        ]
+        state_in = scenario.State(leader=True, relations=relations)
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            with (
+                patch.object(
+                    ProviderApplicationData, "load", wraps=ProviderApplicationData.load
+                ) as mock_load,
+                patch.object(
+                    CertificateTransferProvides,
+                    "_serialize_relation_data",
+                    wraps=CertificateTransferProvides._serialize_relation_data,
+                ) as mock_serialize,
+            ):
+                manager.charm.certificate_transfer.add_certificates({"certificate2"})
+            state_out = manager.run()
+
+        assert mock_load.call_count == 1
+        assert mock_serialize.call_count == 1
+        for relation in relations:
+            certificates = state_out.get_relation(relation.id).local_app_data["certificates"]
+            assert set(json.loads(certificates)) == {"certificate1", "certificate2"}
+
+    def test_given_payload_serialized_in_hook_when_same_certificates_are_planned_again_then_payload_is_reused(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            with patch.object(
+                CertificateTransferProvides,
+                "_serialize_relation_data",
+                wraps=CertificateTransferProvides._serialize_relation_data,
+            ) as mock_serialize:
+                first_plan = certificate_transfer.plan_changes(add={"certificate1"})
+                second_plan = certificate_transfer.plan_changes(add={"certificate1"})
+
+        assert mock_serialize.call_count == 1
+        assert first_plan.changes[0].payload is second_plan.changes[0].payload
+
+    def test_given_certificate_set_when_provider_application_data_dumped_then_certificates_are_sorted(
+        self,
+    ):
+        certificates = {f"certificate{index}" for index in range(50)}
+
+        databag = ProviderApplicationData(certificates=certificates).dump()
+
+        assert databag["certificates"] == json.dumps(sorted(certificates))
+
+    def test_given_v0_requirer_when_add_certificates_then_chain_is_sorted_and_ca_is_first(self):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+        certificates = {f"certificate{index}" for index in range(50)}
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.add_certificates(certificates)
+            state_out = manager.run()
+
+        local_unit_data = state_out.get_relation(relation.id).local_unit_data
+        assert local_unit_data["chain"] == json.dumps(sorted(certificates))
+        assert json.loads(local_unit_data["ca"]) == min(certificates)
+        assert json.loads(local_unit_data["certificate"]) == min(certificates)
+
+    def test_given_prune_expired_certificates_when_plan_changes_then_metadata_cache_is_only_saved_when_plan_is_applied(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        cache_path = tmp_path / "metadata-cache.json"
+        monkeypatch.setattr(
+            DummyPersistentPruningProviderCharm, "metadata_cache_path", str(cache_path)
+        )
+        ctx = scenario.Context(
+            charm_type=DummyPersistentPruningProviderCharm,
+            meta={
+                "name": "certificate-transfer-provider",
+                "provides": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            plan = certificate_transfer.plan_changes(
+                add={ROOT_CA_CERTIFICATE, EXPIRED_CERTIFICATE}
+            )
+            saved_when_planned = cache_path.exists()
+            certificate_transfer.apply_plan(plan)
+
+        assert plan.expired == {EXPIRED_CERTIFICATE}
+        assert not saved_when_planned
+        assert cache_path.exists()
+
+    def test_given_plan_when_payload_is_modified_then_type_error_is_raised(self):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            remote_app_data={"version": "1"},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            plan = manager.charm.certificate_transfer.plan_changes(add={"certificate1"})
+
+        payload = plan.changes[0].payload
+        assert payload is not None
+        with pytest.raises(TypeError):
+            payload["certificates"] = json.dumps([])  # type: ignore[index]
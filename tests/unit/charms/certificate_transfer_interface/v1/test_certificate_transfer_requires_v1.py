@@ -1,19 +1,136 @@
 # Copyright 2024 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import dataclasses
+import datetime
+import hashlib
 import json
-from typing import Any
+from pathlib import Path
+from typing import Any, List
+from unittest.mock import patch
 
 import ops
 import pytest
 import scenario
 
 from lib.charms.certificate_transfer_interface.v1.certificate_transfer import (
+    CertificateCollection,
+    CertificateMetadata,
+    CertificateMetadataCache,
     CertificatesAvailableEvent,
     CertificatesRemovedEvent,
+    CertificateTransferProvides,
     CertificateTransferRequires,
+    ContainerDirectoryWriter,
+    DatabagCache,
+    HookMetrics,
+    LocalDirectoryWriter,
+    ProviderApplicationData,
+    _certificate_der,
+    _certificate_metadata,
+    _decode_shard,
+    _encode_certificates,
+    _openssl_subject_hash,
 )
 
+CERTIFICATE = """-----BEGIN CERTIFICATE-----
+AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8gISIjJCUmJygpKissLS4v
+MDEyMzQ1Njc4OTo7PD0+P0BBQkNERUZHSElKS0xNTk9QUVJTVFVWV1hZWltcXV5f
+YGFiY2RlZmdoaWprbG1ub3BxcnN0dXZ3
+-----END CERTIFICATE-----
+"""
+
+# Subject "/C=GB/O=  Canonical   Ltd /CN=Test  Root CA", OpenSSL subject hash 748cda89
+ROOT_CA_CERTIFICATE = """-----BEGIN CERTIFICATE-----
+MIICYDCCAcmgAwIBAgIUdf9TeXuZfX+VSnxdBu04Uu4qMLkwDQYJKoZIhvcNAQEL
+BQAwQjELMAkGA1UEBhMCR0IxGzAZBgNVBAoMEiAgQ2Fub25pY2FsICAgTHRkIDEW
+MBQGA1UEAwwNVGVzdCAgUm9vdCBDQTAeFw0yNjEwMTgwOTI4MjNaFw0zNjEwMTUw
+OTI4MjNaMEIxCzAJBgNVBAYTAkdCMRswGQYDVQQKDBIgIENhbm9uaWNhbCAgIEx0
+ZCAxFjAUBgNVBAMMDVRlc3QgIFJvb3QgQ0EwgZ8wDQYJKoZIhvcNAQEBBQADgY0A
+MIGJAoGBAMr+v2UsLLShwR3nQ0pwW2J5m8TpW6nAEqO+FjTE+K3GH+kxvSeucdEJ
+mXIln7pPzGxYhJeFJlz9bAmhKmQVl05X12FPaEuoSfzJfkdU5dt3sybPo67bUjnI
+6XugzpReLp5nUSyh+DHIYUd29ZtQnEOiDfq1BytMCTB3hvJDxSupAgMBAAGjUzBR
+MB0GA1UdDgQWBBRm9eRuiKImonnk+MWGjGjhpORidzAfBgNVHSMEGDAWgBRm9eRu
+iKImonnk+MWGjGjhpORidzAPBgNVHRMBAf8EBTADAQH/MA0GCSqGSIb3DQEBCwUA
+A4GBAFAbfYC+I4lw000Tapnys+EjhVfe9KFlng3dDmJdVoxBeg2EiSG+mUZ98D0d
+/9kf42t536zca6iKsK1OZEfh9Ukx5m5QWrm4w11g8SnT2sSem/2bEBQDvycVhvvN
+abGZbnfuPzckmhkqZ0Y9AT8gVYa6H2llj95RR5F6ZkLhZY0o
+-----END CERTIFICATE-----
+"""
+
+# Subject "/C=GB/O=Canonical Ltd/CN=test root ca", same OpenSSL subject hash as above
+OTHER_ROOT_CA_CERTIFICATE = """-----BEGIN CERTIFICATE-----
+MIICVDCCAb2gAwIBAgIUdaS+ia14hBw32kXvuvnw+SNy4wkwDQYJKoZIhvcNAQEL
+BQAwPDELMAkGA1UEBhMCR0IxFjAUBgNVBAoMDUNhbm9uaWNhbCBMdGQxFTATBgNV
+BAMMDHRlc3Qgcm9vdCBjYTAeFw0yNjEwMTgwOTMwMzJaFw0zNjEwMTUwOTMwMzJa
+MDwxCzAJBgNVBAYTAkdCMRYwFAYDVQQKDA1DYW5vbmljYWwgTHRkMRUwEwYDVQQD
+DAx0ZXN0IHJvb3QgY2EwgZ8wDQYJKoZIhvcNAQEBBQADgY0AMIGJAoGBANWK34Yt
+z9kfT0EF7FNYoCj86LUWS1RFTq+OQM3wioUFVgDf5E1nYkFhWg8Hoh4Tmxe4DMiT
+2vBKuZx2le98nbdotbb1/ooat3P4XntB4MAWXOD4u9L1VnQVOi+mcfANLa1Zo9KD
+X/BGzj9pr0xMsNRTPdZD3FHEhN+ULrVgxULjAgMBAAGjUzBRMB0GA1UdDgQWBBS4
+50c6ozN9UzWt+cwkysefGmbq3jAfBgNVHSMEGDAWgBS450c6ozN9UzWt+cwkysef
+Gmbq3jAPBgNVHRMBAf8EBTADAQH/MA0GCSqGSIb3DQEBCwUAA4GBAAjXvdT2T77T
+TJ8MaGhsmif28ys1qJ4mdgf1UK5yGzkauOP56G9PevPcbqlJJhDwqS7/8oomhiDF
+bfncVR36bONwr4PPl8Sifd3BbOF71XYZ6AJwEwfEMqSl4xKhCH4H/LvhZkEN56DX
+uzgIeGYtMMTz3Q190cKo7q4PKbB8HiOp
+-----END CERTIFICATE-----
+"""
+
+# Subject "/CN=Émile Intermediate/OU=ÉQUIPE" in UTF8String, OpenSSL subject hash 221035a0
+INTERMEDIATE_CA_CERTIFICATE = """-----BEGIN CERTIFICATE-----
+MIICPDCCAaWgAwIBAgIURfav2nEo79SAIVCMnqQWYbk1UqAwDQYJKoZIhvcNAQEL
+BQAwMDEcMBoGA1UEAwwTw4ltaWxlIEludGVybWVkaWF0ZTEQMA4GA1UECwwHw4lR
+VUlQRTAeFw0yNjEwMTgwOTI4MjNaFw0zNjEwMTUwOTI4MjNaMDAxHDAaBgNVBAMM
+E8OJbWlsZSBJbnRlcm1lZGlhdGUxEDAOBgNVBAsMB8OJUVVJUEUwgZ8wDQYJKoZI
+hvcNAQEBBQADgY0AMIGJAoGBAMH3AZATShC+8Oq03mXHV60geCp1lwibG6WDn0i+
+UdAZSeHhXCRW6iuKF6pca2pq5qXu6+FIETRGGr51gVnDK85L0nSqlsSi9+3Ny2z/
+FnqI76H133hXKZoR6QQj5LxH4gTYUFPXYgkEN75zMx8RFZL1+uzGmk1UqZrSSkK+
+alIbAgMBAAGjUzBRMB0GA1UdDgQWBBTq7tqvYeiPtoxbNd8Rpzb9IKEisTAfBgNV
+HSMEGDAWgBTq7tqvYeiPtoxbNd8Rpzb9IKEisTAPBgNVHRMBAf8EBTADAQH/MA0G
+CSqGSIb3DQEBCwUAA4GBADhL5XNWdGKpXIBzfBaHrSUDc3uyN7cwydLCqKC88CQs
+K6f7bQvXOOem4l73L7H5ya4/YwReL+DbNrf11Ffq7bEF1JpzyVw2sXLB0pqTtUSK
+Z8HcA6RhracEZ0mXrjZ1d+IU8ewAb604GfdnHewHRIqG8Z+Dc6kr6e1TorLt7I+3
+-----END CERTIFICATE-----
+"""
+
+# Subject "/CN=leaf.example.com", issued by ROOT_CA_CERTIFICATE, not a CA
+LEAF_CERTIFICATE = """-----BEGIN CERTIFICATE-----
+MIICMzCCAZygAwIBAgIUBlYx8nk97njk70/ThlawMucML1gwDQYJKoZIhvcNAQEL
+BQAwQjELMAkGA1UEBhMCR0IxGzAZBgNVBAoMEiAgQ2Fub25pY2FsICAgTHRkIDEW
+MBQGA1UEAwwNVGVzdCAgUm9vdCBDQTAeFw0yNjEwMTgwOTMyMjNaFw0yNjExMTcw
+OTMyMjNaMBsxGTAXBgNVBAMMEGxlYWYuZXhhbXBsZS5jb20wgZ8wDQYJKoZIhvcN
+AQEBBQADgY0AMIGJAoGBAMOI+2wowd8l/P2BemRWvKndeAt0sgxkbxgFQs+o30HL
+xCyD4KehIK4MTJ4C3j9WbVi+Zm9kdFr+finkP/+yswyD/O762qzvnycNLqwJ4idD
+ruvLZQ1xSW2A2qY0XEFhyIt3ulciKA9nZppNTFKie3EJ9Y6sORNT+Jrd56f6F5OH
+AgMBAAGjTTBLMAkGA1UdEwQCMAAwHQYDVR0OBBYEFOhEEnl5c4A/h/Mxy1UAKlgl
++PiTMB8GA1UdIwQYMBaAFGb15G6IoiaieeT4xYaMaOGk5GJ3MA0GCSqGSIb3DQEB
+CwUAA4GBAJPlsBIRRgYABzGxLhP8BBQyY75QVf21sW0ddiZtFvP+hUlmLmpIPUtV
+t+6P6TPcKgX7YdKtaPPKzKXtccqJrK4DiMFGktbOAiuduD8U2yb1I2YEqPbLuTGO
+CzM7+Ix9QQeeahKH0Vk7uD232pp830roVZsHFsPAnV7PK16xtAHE
+-----END CERTIFICATE-----
+"""
+
+# Basic certificate whose only extension is an empty SEQUENCE
+MALFORMED_EXTENSION_CERTIFICATE = """-----BEGIN CERTIFICATE-----
+MIGHMHOgAwIBAgIBATANBgkqhkiG9w0BAQsFADAPMQ0wCwYDVQQDDARUZXN0MB4X
+DTI2MDEwMTAwMDAwMFoXDTM2MDEwMTAwMDAwMFowDzENMAsGA1UEAwwEVGVzdDAS
+MA0GCSqGSIb3DQEBCwUAAwEAowQwAjAAMA0GCSqGSIb3DQEBCwUAAwEA
+-----END CERTIFICATE-----
+"""
+
+STORED_STATE_OWNER_PATH = (
+    "DummyCertificateTransferRequirerCharm/CertificateTransferRequires[certificate_transfer_v1]"
+)
+TRACKING_STORED_STATE_OWNER_PATH = (
+    "DummyTrackingRequirerCharm/CertificateTransferRequires[certificate_transfer_v1]"
+)
+
+
+def zlib_der_payload(certificates: List[str]) -> str:
+    payload = _encode_certificates("zlib-der", certificates)
+    assert payload is not None
+    return payload
+
 
 class DummyCertificateTransferRequirerCharm(ops.CharmBase):
     def __init__(self, *args: Any):
@@ -49,6 +166,63 @@ class DummyCertificateTransferRequirerCharm(ops.CharmBase):
             self.unit.status = ops.WaitingStatus()
 
 
+class DummyTrackingRequirerCharm(ops.CharmBase):
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferRequires(
+            self, "certificate_transfer", track_changes=True
+        )
+
+
+class DummyDeduplicatingRequirerCharm(ops.CharmBase):
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferRequires(
+            self, "certificate_transfer", suppress_unchanged_events=True
+        )
+
+
+class DummyInstrumentedRequirerCharm(ops.CharmBase):
+    metrics: List[HookMetrics] = []
+
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferRequires(
+            self,
+            "certificate_transfer",
+            suppress_unchanged_events=True,
+            metrics_callback=self._on_metrics,
+        )
+
+    def _on_metrics(self, metrics: HookMetrics):
+        self.metrics.append(metrics)
+
+
+class DummyCachingRequirerCharm(ops.CharmBase):
+    databag_cache_path = ""
+
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferRequires(
+            self,
+            "certificate_transfer",
+            databag_cache=DatabagCache(path=self.databag_cache_path),
+        )
+
+
+class DummySnapshotRequirerCharm(ops.CharmBase):
+    snapshot_directory = ""
+
+    def __init__(self, *args: Any):
+        super().__init__(*args)
+        self.certificate_transfer = CertificateTransferRequires(
+            self,
+            "certificate_transfer",
+            track_changes=True,
+            snapshot_directory=self.snapshot_directory,
+        )
+
+
 class TestCertificateTransferRequiresV1:
     @pytest.fixture(autouse=True)
     def context(self):
@@ -87,6 +261,8 @@ class TestCertificateTransferRequiresV1:
         relation = state_out.get_relations("certificate_transfer")[0]
 
         assert relation.local_app_data["version"] == "1"
+        assert relation.local_app_data["encodings"] == json.dumps(["zlib-der"])
+        assert relation.local_app_data["layouts"] == json.dumps(["sharded"])
 
     def test_given_is_not_leader_when_relation_created_then_debug_message_is_logged(
         self,
@@ -216,15 +392,15 @@ class TestCertificateTransferRequiresV1:
         [
             (
                 '"some string"',
-                """('Error parsing relation databag: ('failed to validate databag: \
-{\\'certificates\\': \\'"some string"\\'}',). ', 'Make sure not to interact with the\
- databags except using the public methods in the provider library and use version V1.')""",
+                """Error parsing relation databag: failed to validate databag: \
+{'certificates': '"some string"'}. Make sure not to interact with the databags except using \
+the public methods in the provider library and use version V1.""",
             ),
             (
                 "unloadable",
-                """('Error parsing relation databag: ("invalid databag contents: \
-expecting json. {'certificates': 'unloadable'}",). ', 'Make sure not to interact with \
-the databags except using the public methods in the provider library and use version V1.')""",
+                """Error parsing relation databag: invalid databag contents: \
+expecting json. {'certificates': 'unloadable'}. Make sure not to interact with the databags \
+except using the public methods in the provider library and use version V1.""",
             ),
         ],
     )
@@ -334,3 +510,1425 @@ the databags except using the public methods in the provider library and use ver
             result = charm.certificate_transfer.get_all_certificates_by_relation()
 
         assert result == {}
+
+    def test_given_certificates_in_relation_data_when_read_multiple_times_then_databag_parsed_once(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert_b", "cert_a"])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with patch.object(
+            ProviderApplicationData, "load", side_effect=ProviderApplicationData.load
+        ) as mock_load:
+            with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+                certificate_transfer = manager.charm.certificate_transfer
+                all_certificates = certificate_transfer.get_all_certificates()
+                by_relation = certificate_transfer.get_all_certificates_by_relation()
+                is_ready = certificate_transfer.is_ready(
+                    manager.charm.model.relations["certificate_transfer"][0]
+                )
+
+        assert mock_load.call_count == 1
+        assert all_certificates == {"cert_a", "cert_b"}
+        assert by_relation == {relation.id: ["cert_a", "cert_b"]}
+        assert is_ready
+
+    def test_given_parsed_databag_when_databag_contents_change_then_databag_parsed_again(self):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1"])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            model_relation = manager.charm.model.get_relation("certificate_transfer", relation.id)
+            assert model_relation
+            assert model_relation.app
+            assert certificate_transfer.get_all_certificates() == {"cert1"}
+            # Remote databags are read-only, so update the loaded contents in place.
+            remote_app_data = model_relation.data[model_relation.app]._data
+            remote_app_data["certificates"] = json.dumps(["cert1", "cert2"])
+
+            assert certificate_transfer.get_all_certificates() == {"cert1", "cert2"}
+
+    def test_given_previously_delivered_certificates_when_relation_changed_then_event_contains_added_and_removed_certificates(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyTrackingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert2", "cert3"])},
+        )
+        stored_state = scenario.StoredState(
+            owner_path=TRACKING_STORED_STATE_OWNER_PATH,
+            name="_stored",
+            content={"certificates": {str(relation.id): ["cert1", "cert2"]}},
+        )
+        state_in = scenario.State(relations=[relation], stored_states=[stored_state])
+
+        state_out = ctx.run(ctx.on.relation_changed(relation), state_in)
+
+        event = ctx.emitted_events[1]
+        assert isinstance(event, CertificatesAvailableEvent)
+        assert event.certificates == {"cert2", "cert3"}
+        assert event.added == {"cert3"}
+        assert event.removed == {"cert1"}
+        stored_state_out = state_out.get_stored_state(
+            "_stored", owner_path=TRACKING_STORED_STATE_OWNER_PATH
+        )
+        assert stored_state_out.content["certificates"] == {str(relation.id): ["cert2", "cert3"]}
+
+    def test_given_changes_not_tracked_when_relation_changed_then_no_delta_is_kept(self):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert2", "cert3"])},
+        )
+        stored_state = scenario.StoredState(
+            owner_path=STORED_STATE_OWNER_PATH,
+            name="_stored",
+            content={"certificates": {str(relation.id): ["cert1", "cert2"]}},
+        )
+        state_in = scenario.State(relations=[relation], stored_states=[stored_state])
+
+        state_out = self.ctx.run(self.ctx.on.relation_changed(relation), state_in)
+
+        event = self.ctx.emitted_events[1]
+        assert isinstance(event, CertificatesAvailableEvent)
+        assert event.certificates == {"cert2", "cert3"}
+        assert event.added is None
+        assert event.removed is None
+        stored_state_out = state_out.get_stored_state(
+            "_stored", owner_path=STORED_STATE_OWNER_PATH
+        )
+        assert stored_state_out.content["certificates"] == {}
+
+    def test_given_no_previously_delivered_certificates_when_relation_changed_then_all_certificates_are_added(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyTrackingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1", "cert2"])},
+        )
+        state_in = scenario.State(relations=[relation])
+
+        ctx.run(ctx.on.relation_changed(relation), state_in)
+
+        event = ctx.emitted_events[1]
+        assert isinstance(event, CertificatesAvailableEvent)
+        assert event.added == {"cert1", "cert2"}
+        assert event.removed == set()
+
+    def test_given_previously_delivered_certificates_when_relation_broken_then_delivered_certificates_are_forgotten(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1"])},
+        )
+        stored_state = scenario.StoredState(
+            owner_path=STORED_STATE_OWNER_PATH,
+            name="_stored",
+            content={"certificates": {str(relation.id): ["cert1"]}},
+        )
+        state_in = scenario.State(relations=[relation], stored_states=[stored_state])
+
+        state_out = self.ctx.run(self.ctx.on.relation_broken(relation), state_in)
+
+        stored_state_out = state_out.get_stored_state(
+            "_stored", owner_path=STORED_STATE_OWNER_PATH
+        )
+        assert stored_state_out.content["certificates"] == {}
+
+    def test_given_suppress_unchanged_events_and_unchanged_certificates_when_relation_changed_then_event_is_suppressed(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyDeduplicatingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        owner_path = (
+            "DummyDeduplicatingRequirerCharm/CertificateTransferRequires[certificate_transfer_v1]"
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1"])},
+        )
+        stored_state = scenario.StoredState(
+            owner_path=owner_path,
+            name="_stored",
+            content={"certificates": {str(relation.id): ["cert1"]}, "suppressed_events": 2},
+        )
+        state_in = scenario.State(relations=[relation], stored_states=[stored_state])
+
+        state_out = ctx.run(ctx.on.relation_changed(relation), state_in)
+
+        assert len(ctx.emitted_events) == 1
+        stored_state_out = state_out.get_stored_state("_stored", owner_path=owner_path)
+        assert stored_state_out.content["suppressed_events"] == 3
+
+    def test_given_suppress_unchanged_events_and_changed_certificates_when_relation_changed_then_event_is_emitted(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyDeduplicatingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        owner_path = (
+            "DummyDeduplicatingRequirerCharm/CertificateTransferRequires[certificate_transfer_v1]"
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1", "cert2"])},
+        )
+        stored_state = scenario.StoredState(
+            owner_path=owner_path,
+            name="_stored",
+            content={"certificates": {str(relation.id): ["cert1"]}, "suppressed_events": 0},
+        )
+        state_in = scenario.State(relations=[relation], stored_states=[stored_state])
+
+        state_out = ctx.run(ctx.on.relation_changed(relation), state_in)
+
+        assert len(ctx.emitted_events) == 2
+        event = ctx.emitted_events[1]
+        assert isinstance(event, CertificatesAvailableEvent)
+        assert event.added == {"cert2"}
+        stored_state_out = state_out.get_stored_state("_stored", owner_path=owner_path)
+        assert stored_state_out.content["suppressed_events"] == 0
+
+    def test_given_certificates_with_zlib_der_encoding_in_relation_data_when_get_all_certificates_then_certificates_are_decoded(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={
+                "certificates": json.dumps([]),
+                "encoding": json.dumps("zlib-der"),
+                "compressed_certificates": json.dumps(
+                    _encode_certificates("zlib-der", [CERTIFICATE])
+                ),
+                "version": "1",
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificates = manager.charm.certificate_transfer.get_all_certificates()
+
+        assert certificates == {CERTIFICATE}
+
+    def test_given_certificates_with_unsupported_encoding_in_relation_data_when_is_ready_then_return_false(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={
+                "encoding": json.dumps("unknown"),
+                "compressed_certificates": json.dumps("payload"),
+                "version": "1",
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        self.ctx.run(
+            self.ctx.on.action("is-ready", params={"relation-id": str(relation.id)}),
+            state_in,
+        )
+
+        assert self.ctx.action_results
+        assert not self.ctx.action_results["is-ready"]
+
+    def test_given_sharded_certificates_in_relation_data_when_get_all_certificates_then_certificates_are_loaded_from_all_shards(
+        self,
+    ):
+        certificates = {CERTIFICATE} | {f"certificate{index}" for index in range(20)}
+        databag = CertificateTransferProvides._serialize_relation_data(
+            True, None, True, frozenset(certificates)
+        )
+        assert databag
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data=dict(databag),
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            loaded_certificates = manager.charm.certificate_transfer.get_all_certificates()
+
+        assert loaded_certificates == certificates
+
+    def test_given_sharded_certificates_in_relation_data_when_shard_changes_then_only_changed_shard_is_parsed(
+        self,
+    ):
+        databag = CertificateTransferProvides._serialize_relation_data(
+            True, None, True, frozenset(f"certificate{index}" for index in range(20))
+        )
+        assert databag
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data=dict(databag),
+        )
+        state_in = scenario.State(relations=[relation])
+        shard_count = len(json.loads(databag["manifest"]))
+
+        with patch(
+            "lib.charms.certificate_transfer_interface.v1.certificate_transfer._decode_shard",
+            side_effect=_decode_shard,
+        ) as mock_decode_shard:
+            with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+                certificate_transfer = manager.charm.certificate_transfer
+                model_relation = manager.charm.model.get_relation(
+                    "certificate_transfer", relation.id
+                )
+                assert model_relation
+                assert model_relation.app
+                certificate_transfer.get_all_certificates()
+                # Remote databags are read-only, so update the loaded contents in place.
+                remote_app_data = model_relation.data[model_relation.app]._data
+                manifest = json.loads(remote_app_data["manifest"])
+                shard = next(iter(manifest))
+                shard_certificates = json.loads(remote_app_data[shard])
+                remote_app_data[shard] = json.dumps(shard_certificates + ["certificate20"])
+                manifest[shard] = hashlib.sha256(remote_app_data[shard].encode()).hexdigest()
+                remote_app_data["manifest"] = json.dumps(manifest)
+
+                certificates = certificate_transfer.get_all_certificates()
+
+        assert "certificate20" in certificates
+        assert mock_decode_shard.call_count == shard_count + 1
+
+    def test_given_shard_not_matching_manifest_when_is_ready_then_return_false(self):
+        databag = CertificateTransferProvides._serialize_relation_data(
+            True, None, True, frozenset({"certificate1"})
+        )
+        assert databag
+        manifest = json.loads(databag["manifest"])
+        remote_app_data = dict(databag)
+        remote_app_data[next(iter(manifest))] = json.dumps(["certificate2"])
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data=remote_app_data,
+        )
+        state_in = scenario.State(relations=[relation])
+
+        self.ctx.run(
+            self.ctx.on.action("is-ready", params={"relation-id": str(relation.id)}),
+            state_in,
+        )
+
+        assert self.ctx.action_results
+        assert not self.ctx.action_results["is-ready"]
+
+    def test_given_certificates_in_multiple_relations_when_write_ca_bundle_then_bundle_is_written_in_deterministic_order(
+        self, tmp_path: Path
+    ):
+        relation_1 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert2\n", "cert1\n"])},
+        )
+        relation_2 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert3", "cert1\n"])},
+        )
+        state_in = scenario.State(relations=[relation_1, relation_2])
+        bundle_path = tmp_path / "certs" / "ca-bundle.pem"
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            written = manager.charm.certificate_transfer.write_ca_bundle(bundle_path)
+
+        assert written
+        assert bundle_path.read_text() == "cert1\ncert2\ncert3\n"
+        assert bundle_path.stat().st_mode & 0o777 == 0o644
+        assert list(bundle_path.parent.iterdir()) == [bundle_path]
+
+    def test_given_bundle_already_up_to_date_when_write_ca_bundle_then_write_is_skipped(
+        self, tmp_path: Path
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1"])},
+        )
+        state_in = scenario.State(relations=[relation])
+        bundle_path = tmp_path / "ca-bundle.pem"
+        bundle_path.write_text("cert1\n")
+        inode = bundle_path.stat().st_ino
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            written = manager.charm.certificate_transfer.write_ca_bundle(bundle_path)
+
+        assert not written
+        assert bundle_path.stat().st_ino == inode
+
+    def test_given_container_when_write_ca_bundle_then_bundle_is_pushed_to_container(self):
+        ctx = scenario.Context(
+            charm_type=DummyDeduplicatingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+                "containers": {"workload": {}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert2", "cert1"])},
+        )
+        container = scenario.Container(name="workload", can_connect=True)
+        state_in = scenario.State(relations=[relation], containers=[container])
+
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            workload = manager.charm.unit.get_container("workload")
+            written = manager.charm.certificate_transfer.write_ca_bundle(
+                "/etc/ssl/ca-bundle.pem", container=workload
+            )
+            written_again = manager.charm.certificate_transfer.write_ca_bundle(
+                "/etc/ssl/ca-bundle.pem", container=workload
+            )
+            state_out = manager.run()
+
+        assert written
+        assert not written_again
+        filesystem = state_out.get_container("workload").get_filesystem(ctx)
+        assert (filesystem / "etc/ssl/ca-bundle.pem").read_text() == "cert1\ncert2\n"
+
+    @pytest.mark.parametrize(
+        "certificate,subject_hash",
+        [
+            (ROOT_CA_CERTIFICATE, "748cda89"),
+            (OTHER_ROOT_CA_CERTIFICATE, "748cda89"),
+            (INTERMEDIATE_CA_CERTIFICATE, "221035a0"),
+        ],
+    )
+    def test_given_certificate_when_openssl_subject_hash_then_hash_matches_openssl(
+        self, certificate: str, subject_hash: str
+    ):
+        der = _certificate_der(certificate)
+        assert der
+
+        assert _openssl_subject_hash(der) == subject_hash
+
+    def test_given_empty_directory_when_sync_hashed_directory_then_certificates_are_written_by_subject_hash(
+        self, tmp_path: Path
+    ):
+        certificates = [
+            ROOT_CA_CERTIFICATE,
+            OTHER_ROOT_CA_CERTIFICATE,
+            INTERMEDIATE_CA_CERTIFICATE,
+        ]
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(certificates + ["cert1"])},
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            written, removed = certificate_transfer.sync_hashed_directory(
+                LocalDirectoryWriter(tmp_path)
+            )
+            written_again, removed_again = certificate_transfer.sync_hashed_directory(
+                LocalDirectoryWriter(tmp_path)
+            )
+
+        assert written == ["221035a0.0", "748cda89.0", "748cda89.1"]
+        assert removed == []
+        assert (written_again, removed_again) == ([], [])
+        assert (tmp_path / "221035a0.0").read_text() == INTERMEDIATE_CA_CERTIFICATE
+        assert {(tmp_path / "748cda89.0").read_text(), (tmp_path / "748cda89.1").read_text()} == {
+            ROOT_CA_CERTIFICATE,
+            OTHER_ROOT_CA_CERTIFICATE,
+        }
+
+    def test_given_synced_directory_when_certificate_removed_then_only_changed_files_are_updated(
+        self, tmp_path: Path
+    ):
+        certificates = [
+            ROOT_CA_CERTIFICATE,
+            OTHER_ROOT_CA_CERTIFICATE,
+            INTERMEDIATE_CA_CERTIFICATE,
+        ]
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(certificates)},
+        )
+        with self.ctx(
+            self.ctx.on.update_status(), scenario.State(relations=[relation])
+        ) as manager:
+            manager.charm.certificate_transfer.sync_hashed_directory(
+                LocalDirectoryWriter(tmp_path)
+            )
+        remaining_certificate = (tmp_path / "748cda89.1").read_text()
+        removed_certificate = (tmp_path / "748cda89.0").read_text()
+        relation = dataclasses.replace(
+            relation,
+            remote_app_data={
+                "certificates": json.dumps([INTERMEDIATE_CA_CERTIFICATE, remaining_certificate])
+            },
+        )
+
+        with self.ctx(
+            self.ctx.on.update_status(), scenario.State(relations=[relation])
+        ) as manager:
+            written, removed = manager.charm.certificate_transfer.sync_hashed_directory(
+                LocalDirectoryWriter(tmp_path)
+            )
+
+        assert written == ["748cda89.0"]
+        assert removed == ["748cda89.1"]
+        assert (tmp_path / "748cda89.0").read_text() == remaining_certificate
+        assert remaining_certificate != removed_certificate
+
+    def test_given_container_writer_when_sync_hashed_directory_then_certificates_are_pushed_to_container(
+        self,
+    ):
+        ctx = scenario.Context(
+            charm_type=DummyDeduplicatingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+                "containers": {"workload": {}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps([INTERMEDIATE_CA_CERTIFICATE])},
+        )
+        container = scenario.Container(name="workload", can_connect=True)
+        state_in = scenario.State(relations=[relation], containers=[container])
+
+        with ctx(ctx.on.update_status(), state_in) as manager:
+            writer = ContainerDirectoryWriter(
+                manager.charm.unit.get_container("workload"), "/etc/ssl/certs"
+            )
+            written, _ = manager.charm.certificate_transfer.sync_hashed_directory(writer)
+            written_again, _ = manager.charm.certificate_transfer.sync_hashed_directory(writer)
+            state_out = manager.run()
+
+        assert written == ["221035a0.0"]
+        assert written_again == []
+        filesystem = state_out.get_container("workload").get_filesystem(ctx)
+        assert (filesystem / "etc/ssl/certs/221035a0.0").read_text() == INTERMEDIATE_CA_CERTIFICATE
+
+    def test_given_certificates_in_relation_data_when_get_certificates_metadata_then_metadata_is_returned(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={
+                "certificates": json.dumps([ROOT_CA_CERTIFICATE, LEAF_CERTIFICATE, "cert1"])
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            metadata = manager.charm.certificate_transfer.get_certificates_metadata()
+
+        assert metadata == {
+            ROOT_CA_CERTIFICATE: CertificateMetadata(
+                subject="CN=Test  Root CA,O=\\  Canonical   Ltd\\ ,C=GB",
+                issuer="CN=Test  Root CA,O=\\  Canonical   Ltd\\ ,C=GB",
+                not_after=datetime.datetime(2036, 10, 15, 9, 28, 23, tzinfo=datetime.timezone.utc),
+                is_ca=True,
+                sha256="3427ae3ef71c0ecd3683fdcebcb9e69b91bd01eeee28d380d885370f07971bf4",
+            ),
+            LEAF_CERTIFICATE: CertificateMetadata(
+                subject="CN=leaf.example.com",
+                issuer="CN=Test  Root CA,O=\\  Canonical   Ltd\\ ,C=GB",
+                not_after=datetime.datetime(2026, 11, 17, 9, 32, 23, tzinfo=datetime.timezone.utc),
+                is_ca=False,
+                sha256=metadata[LEAF_CERTIFICATE].sha256,
+            ),
+        }
+
+    def test_given_certificate_with_malformed_extension_when_get_certificates_metadata_then_certificate_is_left_out(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={
+                "certificates": json.dumps([ROOT_CA_CERTIFICATE, MALFORMED_EXTENSION_CERTIFICATE])
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            metadata = manager.charm.certificate_transfer.get_certificates_metadata()
+
+        assert set(metadata) == {ROOT_CA_CERTIFICATE}
+        assert CertificateMetadataCache().get(MALFORMED_EXTENSION_CERTIFICATE) is None
+
+    def test_given_persisted_metadata_cache_when_get_then_certificate_is_not_parsed_again(
+        self, tmp_path: Path
+    ):
+        cache_path = tmp_path / "metadata-cache.json"
+        cache = CertificateMetadataCache(path=cache_path)
+        metadata = cache.get(INTERMEDIATE_CA_CERTIFICATE)
+        cache.save()
+
+        with patch(
+            "lib.charms.certificate_transfer_interface.v1.certificate_transfer._certificate_metadata"
+        ) as mock_certificate_metadata:
+            loaded_metadata = CertificateMetadataCache(path=cache_path).get(
+                INTERMEDIATE_CA_CERTIFICATE
+            )
+
+        mock_certificate_metadata.assert_not_called()
+        assert metadata
+        assert metadata.subject == "OU=ÉQUIPE,CN=Émile Intermediate"
+        assert loaded_metadata == metadata
+
+    def test_given_full_metadata_cache_when_get_then_least_recently_used_entry_is_evicted(self):
+        cache = CertificateMetadataCache(maxsize=2)
+        cache.get(ROOT_CA_CERTIFICATE)
+        cache.get(LEAF_CERTIFICATE)
+        cache.get(ROOT_CA_CERTIFICATE)
+
+        with patch(
+            "lib.charms.certificate_transfer_interface.v1.certificate_transfer._certificate_metadata",
+            side_effect=_certificate_metadata,
+        ) as mock_certificate_metadata:
+            cache.get(INTERMEDIATE_CA_CERTIFICATE)
+            cache.get(ROOT_CA_CERTIFICATE)
+            cache.get(LEAF_CERTIFICATE)
+
+        assert len(cache) == 2
+        assert mock_certificate_metadata.call_count == 2
+
+    def test_given_v0_data_in_multiple_units_when_get_all_certificates_twice_then_certificates_of_all_units_are_merged_and_units_not_mutated(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_units_data={
+                3: {
+                    "certificate": json.dumps(INTERMEDIATE_CA_CERTIFICATE),
+                    "ca": json.dumps(ROOT_CA_CERTIFICATE),
+                    "chain": json.dumps(
+                        [INTERMEDIATE_CA_CERTIFICATE, ROOT_CA_CERTIFICATE.replace("\n", "\r\n")]
+                    ),
+                },
+                1: {
+                    "certificate": json.dumps(LEAF_CERTIFICATE),
+                    "ca": json.dumps(ROOT_CA_CERTIFICATE),
+                    "chain": json.dumps([LEAF_CERTIFICATE, ROOT_CA_CERTIFICATE]),
+                },
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            model_relation = manager.charm.model.get_relation("certificate_transfer", relation.id)
+            assert model_relation
+            first_certificates = certificate_transfer.get_all_certificates()
+            second_certificates = certificate_transfer.get_all_certificates()
+            sources = certificate_transfer.get_certificate_sources()
+            unit_count = len(model_relation.units)
+
+        expected = {LEAF_CERTIFICATE, INTERMEDIATE_CA_CERTIFICATE, ROOT_CA_CERTIFICATE}
+        assert first_certificates == second_certificates == expected
+        assert sources == {
+            LEAF_CERTIFICATE: {"remote/1"},
+            INTERMEDIATE_CA_CERTIFICATE: {"remote/3"},
+            ROOT_CA_CERTIFICATE: {"remote/1", "remote/3"},
+        }
+        assert unit_count == 2
+
+    def test_given_v0_data_in_multiple_units_when_merged_twice_in_same_hook_then_merge_is_cached(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_units_data={
+                1: {
+                    "certificate": json.dumps(ROOT_CA_CERTIFICATE),
+                    "ca": json.dumps(ROOT_CA_CERTIFICATE),
+                    "chain": json.dumps([ROOT_CA_CERTIFICATE]),
+                },
+                2: {
+                    "certificate": json.dumps(INTERMEDIATE_CA_CERTIFICATE),
+                    "ca": json.dumps(INTERMEDIATE_CA_CERTIFICATE),
+                    "chain": json.dumps([INTERMEDIATE_CA_CERTIFICATE]),
+                },
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            with patch(
+                "lib.charms.certificate_transfer_interface.v1.certificate_transfer._certificate_fingerprint",
+                side_effect=lambda certificate: certificate,
+            ) as mock_fingerprint:
+                certificate_transfer.get_all_certificates()
+                certificate_transfer.get_certificate_sources()
+
+        assert mock_fingerprint.call_count == 2
+
+    def test_given_invalid_v0_data_in_one_unit_when_get_all_certificates_then_other_units_are_returned(
+        self, caplog: pytest.LogCaptureFixture
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_units_data={
+                1: {"certificate": "not json", "ca": "not json", "chain": "not json"},
+                2: {
+                    "certificate": json.dumps(ROOT_CA_CERTIFICATE),
+                    "ca": json.dumps(ROOT_CA_CERTIFICATE),
+                    "chain": json.dumps([ROOT_CA_CERTIFICATE]),
+                },
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificates = manager.charm.certificate_transfer.get_all_certificates()
+
+        assert certificates == {ROOT_CA_CERTIFICATE}
+        assert any(
+            record.levelname == "WARNING" and "remote/1" in record.message
+            for record in caplog.records
+        )
+
+    def test_given_v1_data_when_get_certificate_sources_then_provider_application_is_returned(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps([ROOT_CA_CERTIFICATE])},
+            remote_units_data={
+                1: {
+                    "certificate": json.dumps(INTERMEDIATE_CA_CERTIFICATE),
+                    "ca": json.dumps(INTERMEDIATE_CA_CERTIFICATE),
+                    "chain": json.dumps([INTERMEDIATE_CA_CERTIFICATE]),
+                }
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            sources = manager.charm.certificate_transfer.get_certificate_sources()
+
+        assert sources == {ROOT_CA_CERTIFICATE: {"remote"}}
+
+    def test_given_metrics_callback_when_relation_changed_then_metrics_are_reported(
+        self, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(DummyInstrumentedRequirerCharm, "metrics", [])
+        ctx = scenario.Context(
+            charm_type=DummyInstrumentedRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1", "cert2"])},
+        )
+        state_in = scenario.State(leader=True, relations=[relation])
+
+        state_out = ctx.run(ctx.on.relation_changed(relation), state_in)
+        ctx.run(ctx.on.relation_changed(state_out.get_relation(relation.id)), state_out)
+
+        first, second = DummyInstrumentedRequirerCharm.metrics
+        assert first.relation_id == second.relation_id == relation.id
+        assert first.databag_reads == 1
+        assert first.databag_writes == 3
+        assert first.bytes_serialized > 0
+        assert first.parse_time > 0
+        assert (first.certificates_added, first.certificates_removed) == (2, 0)
+        assert (first.events_emitted, first.events_suppressed) == (1, 0)
+        assert second.databag_writes == 0
+        assert (second.certificates_added, second.certificates_removed) == (0, 0)
+        assert (second.events_emitted, second.events_suppressed) == (0, 1)
+
+    def test_given_failing_metrics_callback_when_relation_changed_then_warning_is_logged(
+        self, caplog: pytest.LogCaptureFixture
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1"])},
+        )
+        state_in = scenario.State(relations=[relation])
+        ctx = scenario.Context(
+            charm_type=DummyInstrumentedRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+
+        with patch.object(
+            DummyInstrumentedRequirerCharm, "_on_metrics", side_effect=ZeroDivisionError
+        ):
+            ctx.run(ctx.on.relation_changed(relation), state_in)
+
+        logs = [(record.levelname, record.message) for record in caplog.records]
+        assert ("WARNING", "Metrics callback failed") in logs
+
+    def test_given_persisted_databag_cache_when_databag_unchanged_in_next_hook_then_databag_is_not_parsed_again(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(
+            DummyCachingRequirerCharm, "databag_cache_path", str(tmp_path / "databag-cache.json")
+        )
+        ctx = scenario.Context(
+            charm_type=DummyCachingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1", "cert2"])},
+        )
+        state_in = scenario.State(relations=[relation])
+        state_out = ctx.run(ctx.on.relation_changed(relation), state_in)
+
+        with ctx(ctx.on.update_status(), state_out) as manager:
+            with patch.object(ProviderApplicationData, "load") as mock_load:
+                certificates = manager.charm.certificate_transfer.get_all_certificates()
+
+        mock_load.assert_not_called()
+        assert certificates == {"cert1", "cert2"}
+
+    def test_given_persisted_databag_cache_when_databag_changed_in_next_hook_then_databag_is_parsed(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(
+            DummyCachingRequirerCharm, "databag_cache_path", str(tmp_path / "databag-cache.json")
+        )
+        ctx = scenario.Context(
+            charm_type=DummyCachingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1"])},
+        )
+        state_out = ctx.run(
+            ctx.on.relation_changed(relation), scenario.State(relations=[relation])
+        )
+        changed_relation = dataclasses.replace(
+            state_out.get_relation(relation.id),
+            remote_app_data={"certificates": json.dumps(["cert1", "cert2"])},
+        )
+
+        with ctx(
+            ctx.on.update_status(), dataclasses.replace(state_out, relations=[changed_relation])
+        ) as manager:
+            certificates = manager.charm.certificate_transfer.get_all_certificates()
+
+        assert certificates == {"cert1", "cert2"}
+
+    def test_given_persisted_databag_cache_when_relation_broken_then_entries_are_removed(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        cache_path = tmp_path / "databag-cache.json"
+        monkeypatch.setattr(DummyCachingRequirerCharm, "databag_cache_path", str(cache_path))
+        ctx = scenario.Context(
+            charm_type=DummyCachingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1"])},
+        )
+        state_out = ctx.run(
+            ctx.on.relation_changed(relation), scenario.State(relations=[relation])
+        )
+        assert len(DatabagCache(path=cache_path)) == 1
+
+        ctx.run(ctx.on.relation_broken(state_out.get_relation(relation.id)), state_out)
+
+        assert len(DatabagCache(path=cache_path)) == 0
+        assert cache_path.stat().st_mode & 0o777 == 0o600
+
+    def test_given_same_databag_in_multiple_relations_when_databag_cache_saved_then_certificates_are_stored_once(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        cache_path = tmp_path / "databag-cache.json"
+        monkeypatch.setattr(DummyCachingRequirerCharm, "databag_cache_path", str(cache_path))
+        ctx = scenario.Context(
+            charm_type=DummyCachingRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relations = [
+            scenario.Relation(
+                endpoint="certificate_transfer",
+                interface="certificate_transfer",
+                local_app_data={"version": "1"},
+                remote_app_data={"certificates": json.dumps([CERTIFICATE, "cert2"])},
+            )
+            for _ in range(3)
+        ]
+
+        with ctx(ctx.on.update_status(), scenario.State(relations=relations)) as manager:
+            with patch(
+                "lib.charms.certificate_transfer_interface.v1.certificate_transfer._databag_digest",
+                return_value="digest",
+            ) as mock_digest:
+                manager.charm.certificate_transfer.get_all_certificates()
+            manager.run()
+
+        mock_digest.assert_called_once()
+        header, text = cache_path.read_text().split("\n", 1)
+        assert json.loads(header)["sets"] == {"digest": [0, 1]}
+        assert len(json.loads(header)["entries"]) == 3
+        assert text == CERTIFICATE + "cert2"
+        cache = DatabagCache(path=cache_path)
+        assert cache.get(relations[0].id, "remote", "digest") == {CERTIFICATE, "cert2"}
+
+    def test_given_databag_cache_file_when_cache_created_then_file_is_only_loaded_on_first_use(
+        self, tmp_path: Path
+    ):
+        cache_path = tmp_path / "databag-cache.json"
+        cache = DatabagCache(path=cache_path)
+        cache.set(1, "remote", "digest", frozenset({"cert1"}))
+        cache.save()
+
+        cache = DatabagCache(path=cache_path)
+        cache_path.unlink()
+
+        assert len(cache) == 0
+
+    def test_given_invalid_databag_cache_file_when_loaded_then_cache_is_empty(
+        self, tmp_path: Path
+    ):
+        cache_path = tmp_path / "databag-cache.json"
+        cache_path.write_text('[["not a relation id", "remote", "digest", []]]')
+
+        cache = DatabagCache(path=cache_path)
+
+        assert len(cache) == 0
+
+    def test_given_same_certificate_with_different_line_endings_when_added_to_collection_then_certificate_is_stored_once(
+        self,
+    ):
+        collection = CertificateCollection([ROOT_CA_CERTIFICATE, "cert1"])
+
+        collection.add(ROOT_CA_CERTIFICATE.replace("\n", "\r\n"))
+        collection.update(CertificateCollection([LEAF_CERTIFICATE, "cert1"]))
+
+        assert len(collection) == 3
+        assert list(collection) == [ROOT_CA_CERTIFICATE, "cert1", LEAF_CERTIFICATE]
+        assert ROOT_CA_CERTIFICATE.replace("\n", "\r\n") in collection
+        assert INTERMEDIATE_CA_CERTIFICATE not in collection
+        assert collection.fingerprints() == {
+            hashlib.sha256(_certificate_der(ROOT_CA_CERTIFICATE) or b"").hexdigest(),
+            hashlib.sha256(_certificate_der(LEAF_CERTIFICATE) or b"").hexdigest(),
+            hashlib.sha256(b"cert1").hexdigest(),
+        }
+
+    def test_given_certificates_in_multiple_relations_when_get_certificate_collection_then_certificates_are_merged(
+        self,
+    ):
+        relation_1 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps([ROOT_CA_CERTIFICATE, "cert1"])},
+        )
+        relation_2 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={
+                "certificates": json.dumps([ROOT_CA_CERTIFICATE.replace("\n", "\r\n")])
+            },
+        )
+        state_in = scenario.State(relations=[relation_1, relation_2])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            collection = manager.charm.certificate_transfer.get_certificate_collection()
+            relation_collection = manager.charm.certificate_transfer.get_certificate_collection(
+                relation_2.id
+            )
+
+        assert sorted(collection) == sorted([ROOT_CA_CERTIFICATE, "cert1"])
+        assert list(relation_collection) == [ROOT_CA_CERTIFICATE]
+
+    def test_given_same_certificates_in_multiple_relations_when_get_certificate_collection_then_databag_is_decoded_once(
+        self,
+    ):
+        databag = {"certificates": json.dumps([ROOT_CA_CERTIFICATE, "cert1"])}
+        relation_1 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data=databag,
+        )
+        relation_2 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data=databag,
+        )
+        state_in = scenario.State(relations=[relation_1, relation_2])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            with patch.object(
+                ProviderApplicationData, "load", wraps=ProviderApplicationData.load
+            ) as mock_load:
+                collection = certificate_transfer.get_certificate_collection()
+                certificates = certificate_transfer.get_all_certificates()
+                relation_collection = certificate_transfer.get_certificate_collection(
+                    relation_2.id
+                )
+
+        # Once for the collection, once for get_all_certificates, whose parse is reused
+        assert mock_load.call_count == 2
+        assert list(collection) == [ROOT_CA_CERTIFICATE, "cert1"]
+        assert sorted(relation_collection) == sorted(certificates)
+
+    def test_given_zlib_der_certificates_spanning_several_chunks_when_get_certificate_collection_then_certificates_are_decoded(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={
+                "encoding": json.dumps("zlib-der"),
+                "compressed_certificates": json.dumps(
+                    _encode_certificates(
+                        "zlib-der", [ROOT_CA_CERTIFICATE, INTERMEDIATE_CA_CERTIFICATE]
+                    )
+                ),
+                "version": "1",
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            with patch(
+                "lib.charms.certificate_transfer_interface.v1.certificate_transfer._DECODE_CHUNK_SIZE",
+                8,
+            ):
+                collection = manager.charm.certificate_transfer.get_certificate_collection()
+
+        assert sorted(collection) == sorted([ROOT_CA_CERTIFICATE, INTERMEDIATE_CA_CERTIFICATE])
+
+    @pytest.mark.parametrize(
+        "databag",
+        [
+            pytest.param({"certificates": json.dumps(["cert1", 2])}, id="not-a-string"),
+            pytest.param({"certificates": '["cert1"] []'}, id="trailing-data"),
+            pytest.param(
+                {
+                    "encoding": json.dumps("zlib-der"),
+                    "compressed_certificates": json.dumps(
+                        zlib_der_payload([ROOT_CA_CERTIFICATE])[:-8]
+                    ),
+                },
+                id="truncated-payload",
+            ),
+        ],
+    )
+    def test_given_invalid_certificates_in_one_relation_when_get_certificate_collection_then_other_relations_are_merged(
+        self, databag: dict
+    ):
+        invalid_relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data=databag,
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps([LEAF_CERTIFICATE])},
+        )
+        state_in = scenario.State(relations=[invalid_relation, relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            collection = manager.charm.certificate_transfer.get_certificate_collection()
+
+        assert list(collection) == [LEAF_CERTIFICATE]
+
+    def test_given_same_certificates_in_multiple_relations_when_get_all_certificates_then_databag_is_parsed_once(
+        self,
+    ):
+        databag = {"certificates": json.dumps(["cert1", "cert2"])}
+        relation_1 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data=databag,
+        )
+        relation_2 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data=databag,
+        )
+        state_in = scenario.State(relations=[relation_1, relation_2])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            with patch.object(
+                ProviderApplicationData, "load", wraps=ProviderApplicationData.load
+            ) as mock_load:
+                certificates = certificate_transfer.get_all_certificates()
+                relation_1_certificates = certificate_transfer.get_all_certificates(relation_1.id)
+                relation_2_certificates = certificate_transfer.get_all_certificates(relation_2.id)
+
+        mock_load.assert_called_once()
+        assert certificates == relation_1_certificates == relation_2_certificates
+        assert certificates == {"cert1", "cert2"}
+
+    def test_given_same_certificate_with_different_line_endings_in_multiple_relations_when_aggregate_certificates_then_certificate_is_returned_once_with_its_relations(
+        self,
+    ):
+        relation_1 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert2", ROOT_CA_CERTIFICATE])},
+        )
+        relation_2 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={
+                "certificates": json.dumps(["cert1", ROOT_CA_CERTIFICATE.replace("\n", "\r\n")])
+            },
+        )
+        state_in = scenario.State(relations=[relation_1, relation_2])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            aggregate = certificate_transfer.aggregate_certificates(with_relations=True)
+            relation_aggregate = certificate_transfer.aggregate_certificates(relation_2.id)
+
+        assert aggregate.certificates == [ROOT_CA_CERTIFICATE, "cert2", "cert1"]
+        assert aggregate.relations == {
+            ROOT_CA_CERTIFICATE: {relation_1.id, relation_2.id},
+            "cert2": {relation_1.id},
+            "cert1": {relation_2.id},
+        }
+        assert relation_aggregate.certificates == [
+            ROOT_CA_CERTIFICATE.replace("\n", "\r\n"),
+            "cert1",
+        ]
+        assert relation_aggregate.relations is None
+
+    def test_given_same_certificates_in_multiple_relations_when_aggregate_certificates_then_certificates_are_merged_once(
+        self,
+    ):
+        databag = {"certificates": json.dumps(["cert1", "cert2"])}
+        relations = [
+            scenario.Relation(
+                endpoint="certificate_transfer",
+                interface="certificate_transfer",
+                local_app_data={"version": "1"},
+                remote_app_data=databag,
+            )
+            for _ in range(3)
+        ]
+        state_in = scenario.State(relations=relations)
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            with patch(
+                "lib.charms.certificate_transfer_interface.v1.certificate_transfer._certificate_fingerprint",
+                side_effect=lambda certificate: certificate,
+            ) as mock_fingerprint:
+                aggregate = manager.charm.certificate_transfer.aggregate_certificates(
+                    with_relations=True
+                )
+
+        assert mock_fingerprint.call_count == 2
+        assert aggregate.certificates == ["cert1", "cert2"]
+        relation_ids = {relation.id for relation in relations}
+        assert aggregate.relations == {"cert1": relation_ids, "cert2": relation_ids}
+
+    def test_given_unchanged_databag_when_read_multiple_times_in_hook_then_digest_is_computed_once(
+        self,
+    ):
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1", "cert2"])},
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificate_transfer = manager.charm.certificate_transfer
+            with patch(
+                "lib.charms.certificate_transfer_interface.v1.certificate_transfer._databag_digest",
+                return_value="digest",
+            ) as mock_digest:
+                certificate_transfer.get_all_certificates()
+                certificate_transfer.aggregate_certificates()
+
+        mock_digest.assert_called_once()
+
+    def test_given_chain_and_one_of_its_certificates_when_added_to_collection_then_both_are_stored(
+        self,
+    ):
+        chain = LEAF_CERTIFICATE + ROOT_CA_CERTIFICATE
+
+        collection = CertificateCollection([LEAF_CERTIFICATE, chain])
+
+        assert len(collection) == 2
+        assert list(collection) == [LEAF_CERTIFICATE, chain]
+        assert chain.replace("\n", "\r\n") in collection
+        assert ROOT_CA_CERTIFICATE not in collection
+
+    def test_given_chain_in_one_relation_and_one_of_its_certificates_in_another_when_write_ca_bundle_then_whole_chain_is_written(
+        self, tmp_path: Path
+    ):
+        chain = LEAF_CERTIFICATE + ROOT_CA_CERTIFICATE
+        relation_1 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps([LEAF_CERTIFICATE])},
+        )
+        relation_2 = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps([chain])},
+        )
+        state_in = scenario.State(relations=[relation_1, relation_2])
+        bundle_path = tmp_path / "ca-bundle.pem"
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            manager.charm.certificate_transfer.write_ca_bundle(bundle_path)
+
+        assert bundle_path.read_text() == LEAF_CERTIFICATE + chain
+
+    def test_given_chain_and_one_of_its_certificates_in_v0_unit_databags_when_get_all_certificates_then_both_are_returned(
+        self,
+    ):
+        chain = LEAF_CERTIFICATE + ROOT_CA_CERTIFICATE
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_units_data={
+                1: {
+                    "certificate": json.dumps(LEAF_CERTIFICATE),
+                    "ca": json.dumps(LEAF_CERTIFICATE),
+                    "chain": json.dumps([LEAF_CERTIFICATE]),
+                },
+                2: {
+                    "certificate": json.dumps(chain),
+                    "ca": json.dumps(chain),
+                    "chain": json.dumps([chain]),
+                },
+            },
+        )
+        state_in = scenario.State(relations=[relation])
+
+        with self.ctx(self.ctx.on.update_status(), state_in) as manager:
+            certificates = manager.charm.certificate_transfer.get_all_certificates()
+
+        assert certificates == {LEAF_CERTIFICATE, chain}
+
+    def test_given_snapshot_directory_when_relation_changed_in_next_hook_then_delta_is_computed_from_unit_local_snapshot(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(
+            DummySnapshotRequirerCharm, "snapshot_directory", str(tmp_path / "snapshots")
+        )
+        ctx = scenario.Context(
+            charm_type=DummySnapshotRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        owner_path = (
+            "DummySnapshotRequirerCharm/CertificateTransferRequires[certificate_transfer_v1]"
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1", "cert2"])},
+        )
+        state_out = ctx.run(
+            ctx.on.relation_changed(relation), scenario.State(relations=[relation])
+        )
+        changed_relation = dataclasses.replace(
+            state_out.get_relation(relation.id),
+            remote_app_data={"certificates": json.dumps(["cert2", "cert3"])},
+        )
+
+        state_out = ctx.run(
+            ctx.on.relation_changed(changed_relation),
+            dataclasses.replace(state_out, relations=[changed_relation]),
+        )
+
+        event = ctx.emitted_events[-1]
+        assert isinstance(event, CertificatesAvailableEvent)
+        assert event.added == {"cert3"}
+        assert event.removed == {"cert1"}
+        snapshot_path = tmp_path / "snapshots" / f"{relation.id}.json"
+        assert json.loads(snapshot_path.read_text()) == ["cert2", "cert3"]
+        assert snapshot_path.stat().st_mode & 0o777 == 0o600
+        stored_state_out = state_out.get_stored_state("_stored", owner_path=owner_path)
+        assert stored_state_out.content["certificates"] == {}
+
+    def test_given_snapshot_directory_and_snapshot_in_stored_state_when_relation_changed_then_snapshot_is_moved_to_directory(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(DummySnapshotRequirerCharm, "snapshot_directory", str(tmp_path))
+        ctx = scenario.Context(
+            charm_type=DummySnapshotRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        owner_path = (
+            "DummySnapshotRequirerCharm/CertificateTransferRequires[certificate_transfer_v1]"
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert2"])},
+        )
+        stored_state = scenario.StoredState(
+            owner_path=owner_path,
+            name="_stored",
+            content={"certificates": {str(relation.id): ["cert1", "cert2"]}},
+        )
+        state_in = scenario.State(relations=[relation], stored_states=[stored_state])
+
+        state_out = ctx.run(ctx.on.relation_changed(relation), state_in)
+
+        event = ctx.emitted_events[-1]
+        assert isinstance(event, CertificatesAvailableEvent)
+        assert event.added == set()
+        assert event.removed == {"cert1"}
+        assert json.loads((tmp_path / f"{relation.id}.json").read_text()) == ["cert2"]
+        stored_state_out = state_out.get_stored_state("_stored", owner_path=owner_path)
+        assert stored_state_out.content["certificates"] == {}
+
+    def test_given_snapshot_directory_when_relation_broken_then_snapshot_is_removed(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ):
+        monkeypatch.setattr(DummySnapshotRequirerCharm, "snapshot_directory", str(tmp_path))
+        ctx = scenario.Context(
+            charm_type=DummySnapshotRequirerCharm,
+            meta={
+                "name": "certificate-transfer-requirer",
+                "requires": {"certificate_transfer": {"interface": "certificate_transfer"}},
+            },
+        )
+        relation = scenario.Relation(
+            endpoint="certificate_transfer",
+            interface="certificate_transfer",
+            local_app_data={"version": "1"},
+            remote_app_data={"certificates": json.dumps(["cert1"])},
+        )
+        state_out = ctx.run(
+            ctx.on.relation_changed(relation), scenario.State(relations=[relation])
+        )
+        assert (tmp_path / f"{relation.id}.json").exists()
+
+        ctx.run(ctx.on.relation_broken(state_out.get_relation(relation.id)), state_out)
+
+        assert not (tmp_path / f"{relation.id}.json").exists()